@@ -0,0 +1,262 @@
+"""
+Micro-benchmarks of the pure-Python hot paths, compared with stored baselines.
+
+    python -m benchmarks.bench_hotpaths            # fails on a regression
+    python -m benchmarks.bench_hotpaths --quick    # without the 50 MB transcript
+    python -m benchmarks.bench_hotpaths --update   # after an intended change
+
+Everything runs in-process and offline: the transcripts are generated from
+the meetings of benchmarks/corpus. Timings are stored relative to a fixed
+calibration workload run alongside them, so baselines recorded on one machine
+remain meaningful on another; a case fails when it gets more than --tolerance
+times slower than its baseline.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import re
+import sys
+import timeit
+
+from benchmarks.eval_compaction import load_corpus
+from docker_app.utils.compaction import compact_transcript
+from docker_app.utils.notes import SECTIONS, parse_review, render_html, render_review
+from docker_app.utils.pipeline import build_review_prompt
+from docker_app.utils.streamlitutils import USER_PROMPT, conform_to_regex
+from docker_app.utils.summarize import build_chunk_prompt, chunk_transcript
+from docker_app.utils.transcript import parse_transcript
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines', 'hotpaths.json')
+
+KB = 1024
+MB = 1024 * KB
+
+# Slowdown against the baseline that counts as a regression
+TOLERANCE = 2.0
+# Each case is timed for about this long per repeat, and the best repeat kept
+MIN_SECONDS = 0.2
+REPEAT = 5
+
+SECONDS_PER_WORD = 0.35
+
+
+def synthetic_transcript(size, meetings=None):
+    """
+    Amazon Transcribe output of about size bytes, cycling through the turns
+    of the corpus meetings with increasing timings.
+    """
+    turns = itertools.cycle([turn for meeting in (meetings or load_corpus()) for turn in meeting['turns']])
+    items = []
+    length = 0
+    clock = 0.0
+    while length < size:
+        speaker, text = next(turns)
+        for token in text.split():
+            word = token.rstrip('.,?!')
+            word, _, confidence = word.partition('~')
+            item = json.dumps({'type': 'pronunciation', 'start_time': f'{clock:.2f}',
+                               'end_time': f'{clock + SECONDS_PER_WORD:.2f}', 'speaker_label': speaker,
+                               'alternatives': [{'confidence': confidence or '0.99', 'content': word}]})
+            items.append(item)
+            length += len(item) + 1
+            clock += SECONDS_PER_WORD
+            if token != token.rstrip('.,?!'):
+                item = json.dumps({'type': 'punctuation', 'speaker_label': speaker,
+                                   'alternatives': [{'confidence': '0.0', 'content': token[-1]}]})
+                items.append(item)
+                length += len(item) + 1
+        clock += 1.0
+    # The full text is as long as the transcript and read in the same pass
+    return ('{"jobName": "bench", "results": {"transcripts": [{"transcript": "'
+            + 'lorem ipsum ' * (size // 60) + '"}], "items": [' + ','.join(items) + ']}, "status": "COMPLETED"}'
+            ).encode('utf-8')
+
+
+def synthetic_review(items_per_section=40):
+    """
+    Bulleted review shaped like the model output, with nested bullets and bold text.
+    """
+    lines = ['Here are the meeting notes:', '']
+    for name in SECTIONS:
+        lines.append(f'**{name}**')
+        for i in range(items_per_section):
+            lines.append(f'* Item {i} of {name.lower()}: **Alex** to send the <draft> & budget by Friday')
+            if i % 4 == 0:
+                lines.append(f'    * Detail {i}, agreed with "Sam"')
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def _transcript_text(size):
+    return parse_transcript(io.BytesIO(synthetic_transcript(size))).format_segments()
+
+
+def _case_parse(size):
+    data = synthetic_transcript(size)
+    return lambda: parse_transcript(io.BytesIO(data))
+
+
+def _case_format_segments(size):
+    transcript = parse_transcript(io.BytesIO(synthetic_transcript(size)))
+    return transcript.format_segments
+
+
+def _case_compaction(size):
+    transcript = parse_transcript(io.BytesIO(synthetic_transcript(size)))
+    return lambda: compact_transcript(transcript, min_confidence=0.4)
+
+
+def _case_review_prompt(size):
+    text = _transcript_text(size)
+    return lambda: build_review_prompt(USER_PROMPT, 'Alex, Sam', text, '')
+
+
+def _case_chunk_prompts(size):
+    text = _transcript_text(size)
+
+    def run():
+        chunks = chunk_transcript(text)
+        return [build_chunk_prompt(chunk, i, len(chunks)) for i, chunk in enumerate(chunks)]
+    return run
+
+
+def _case_parse_review():
+    review = synthetic_review()
+    return lambda: parse_review(review)
+
+
+def _case_render_html():
+    notes = parse_review(synthetic_review())
+    return lambda: render_html(notes)
+
+
+def _case_render_review():
+    notes = parse_review(synthetic_review())
+    return lambda: render_review(notes)
+
+
+# name -> (setup returning the function to time, large); large cases are skipped with --quick
+CASES = {
+    'filename.valid': (lambda: lambda: conform_to_regex('ml_test/media/2024-06-28-weekly-sync.mp4'), False),
+    'filename.unicode': (lambda: lambda: conform_to_regex('Réunion d’équipe — 28 juin 2024 (final) ✔.m4a'), False),
+    'filename.long': (lambda: lambda: conform_to_regex('Weekly sync, team A & B ' * 200), False),
+    'transcript.parse.10KB': (lambda: _case_parse(10 * KB), False),
+    'transcript.parse.1MB': (lambda: _case_parse(MB), False),
+    'transcript.parse.50MB': (lambda: _case_parse(50 * MB), True),
+    'transcript.format_segments.1MB': (lambda: _case_format_segments(MB), False),
+    'prompt.compaction.1MB': (lambda: _case_compaction(MB), False),
+    'prompt.review.1MB': (lambda: _case_review_prompt(MB), False),
+    'prompt.chunks.1MB': (lambda: _case_chunk_prompts(MB), False),
+    'html.parse_review': (_case_parse_review, False),
+    'html.render_html': (_case_render_html, False),
+    'html.render_review': (_case_render_review, False),
+}
+
+
+def _calibration():
+    # A fixed mix of the operations the cases are made of: JSON decoding,
+    # regular expressions, string building
+    data = json.dumps([{'content': f'word{i}', 'confidence': '0.99'} for i in range(200)])
+    pattern = re.compile(r'[^a-zA-Z0-9]+')
+
+    def run():
+        values = json.loads(data)
+        return ' '.join(pattern.sub('', value['content'] + ' !') for value in values)
+    return run
+
+
+def measure(func, min_seconds=MIN_SECONDS, repeat=REPEAT):
+    """
+    Best time of one call, in seconds.
+    """
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    if number > 1:
+        # autorange stops at 0.2s; scale the loop to min_seconds
+        number = max(1, int(number * min_seconds / max(elapsed, 1e-9)))
+    elif elapsed > min_seconds:
+        # Slow cases are few calls, kept to a reasonable total
+        repeat = min(repeat, 3)
+    return min(timer.repeat(repeat, number)) / number
+
+
+def run(names, min_seconds=MIN_SECONDS, repeat=REPEAT):
+    """
+    Time the named cases. Returns {name: seconds}, with the calibration
+    workload under 'calibration'.
+    """
+    calibration = measure(_calibration(), min_seconds, repeat)
+    results = {}
+    for name in names:
+        setup, _ = CASES[name]
+        results[name] = measure(setup(), min_seconds, repeat)
+    # Calibrated on both sides of the cases, in case the machine got busier or quieter
+    results['calibration'] = min(calibration, measure(_calibration(), min_seconds, repeat))
+    return results
+
+
+def load_baselines(path=BASELINES_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['relative']
+
+
+def save_baselines(relative, path=BASELINES_PATH):
+    baselines = load_baselines(path)
+    baselines.update((name, float(f'{value:.4g}')) for name, value in relative.items())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'relative': dict(sorted(baselines.items()))}, f, indent=2)
+        f.write('\n')
+
+
+def compare(relative, baselines, tolerance=TOLERANCE):
+    """
+    Names of the cases more than tolerance times slower than their baseline.
+    Cases without a baseline are not compared.
+    """
+    return [name for name, value in relative.items()
+            if name in baselines and value > baselines[name] * tolerance]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('cases', nargs='*', help='Cases to run, or prefixes such as "transcript" (default: all)')
+    parser.add_argument('--quick', action='store_true', help='Skip the large inputs')
+    parser.add_argument('--update', action='store_true', help='Store the timings as the new baselines')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='Slowdown against the baseline that fails the run')
+    parser.add_argument('--baselines', default=BASELINES_PATH, help='Baselines file')
+    args = parser.parse_args()
+
+    names = [name for name, (_, large) in CASES.items()
+             if (not args.cases or any(name.startswith(prefix) for prefix in args.cases))
+             and not (large and args.quick)]
+    results = run(names)
+    calibration = results.pop('calibration')
+    relative = {name: seconds / calibration for name, seconds in results.items()}
+    baselines = load_baselines(args.baselines)
+
+    print(f"{'case':<32} {'time':>12} {'relative':>10} {'baseline':>10} {'change':>8}")
+    for name, seconds in results.items():
+        baseline = baselines.get(name)
+        change = f'{relative[name] / baseline - 1:+.0%}' if baseline else 'new'
+        print(f"{name:<32} {seconds * 1000:>10.3f}ms {relative[name]:>10.4g} "
+              f"{baseline if baseline is not None else float('nan'):>10.4g} {change:>8}")
+
+    if args.update:
+        save_baselines(relative, args.baselines)
+        print(f'Baselines written to {args.baselines}')
+        return
+    regressions = compare(relative, baselines, args.tolerance)
+    if regressions:
+        print(f'\nREGRESSION: {", ".join(regressions)} more than {args.tolerance}x slower than the baseline',
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
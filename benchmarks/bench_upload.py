@@ -0,0 +1,50 @@
+"""
+Throughput of the multipart upload stage against the in-process S3 stand-in.
+
+    python -m benchmarks.bench_upload --sizes 50 200 1000 --latency 0.03 --bandwidth 40
+
+The stand-in models each connection as latency + bytes / bandwidth, so the
+numbers compare upload settings with each other, not with a real bucket.
+"""
+import argparse
+import time
+
+from benchmarks.fakes import MB, FakeS3Client, SyntheticFile
+from docker_app.utils.upload import MAX_BUFFERED_BYTES, MAX_CONCURRENCY, PART_SIZE, MultipartUploader
+
+CONFIGS = {
+    # Close to a single-stream upload with the default transfer settings
+    'sequential 8 MiB': dict(part_size=8 * MB, max_concurrency=1, max_buffered_bytes=8 * MB),
+    'tuned': dict(part_size=PART_SIZE, max_concurrency=MAX_CONCURRENCY, max_buffered_bytes=MAX_BUFFERED_BYTES),
+}
+
+
+def run(size_mb, latency, bandwidth_mb, failure_rate, config):
+    client = FakeS3Client(latency=latency, bandwidth=bandwidth_mb * MB, failure_rate=failure_rate,
+                          store_data=False, seed=0)
+    uploader = MultipartUploader(client, retries=5, **config)
+    size = size_mb * MB
+    start = time.perf_counter()
+    uploader.upload(SyntheticFile(size), 'bucket', 'ml_test/media/bench.mp4', size)
+    elapsed = time.perf_counter() - start
+    assert client.objects[('bucket', 'ml_test/media/bench.mp4')] == size
+    return elapsed, uploader.peak_buffered_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 1000], help='File sizes in MB')
+    parser.add_argument('--latency', type=float, default=0.03, help='Per-request latency in seconds')
+    parser.add_argument('--bandwidth', type=float, default=40, help='Per-connection bandwidth in MB/s')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Probability that a request fails')
+    args = parser.parse_args()
+
+    print(f"{'size':>8}  {'config':<18} {'seconds':>8} {'MB/s':>8} {'peak buffer':>12}")
+    for size_mb in args.sizes:
+        for name, config in CONFIGS.items():
+            elapsed, peak = run(size_mb, args.latency, args.bandwidth, args.failure_rate, config)
+            print(f"{size_mb:>6}MB  {name:<18} {elapsed:>8.2f} {size_mb / elapsed:>8.1f} {peak / MB:>10.0f}MB")
+
+
+if __name__ == '__main__':
+    main()
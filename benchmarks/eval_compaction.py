@@ -0,0 +1,124 @@
+"""
+Regression corpus of the transcript compaction.
+
+    python -m benchmarks.eval_compaction
+    python -m benchmarks.eval_compaction --summarize --min-confidence 0.4
+
+Each meeting of benchmarks/corpus lists the keywords of its action items and
+decisions. The report shows the token reduction of every meeting and
+whether the keywords survive compaction. With --summarize, the raw and the
+compacted transcripts are also summarized with Bedrock (AWS credentials
+needed), and the keywords are looked for in the ACTION ITEMS and DECISIONS
+sections of both reviews.
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import re
+
+from docker_app.utils.compaction import compact_transcript
+from docker_app.utils.transcript import parse_transcript
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'corpus')
+
+SECONDS_PER_WORD = 0.35
+TURN_GAP_SECONDS = 0.8
+
+# "word" or "word~0.3" for a word transcribed with confidence 0.3
+_TOKEN = re.compile(r"([^\s.,?!~]+)(?:~([\d.]+))?|([.,?!])")
+
+
+def load_corpus(directory=CORPUS_DIR):
+    meetings = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with open(path, encoding='utf-8') as f:
+            meeting = json.load(f)
+        meeting['name'] = os.path.splitext(os.path.basename(path))[0]
+        meetings.append(meeting)
+    return meetings
+
+
+def to_transcribe_output(meeting):
+    """
+    Amazon Transcribe output of the turns of a corpus meeting, with made-up
+    but consistent timings.
+    """
+    items = []
+    clock = 0.0
+    for speaker, text in meeting['turns']:
+        for word, confidence, punctuation in _TOKEN.findall(text):
+            if punctuation:
+                items.append({'type': 'punctuation', 'speaker_label': speaker,
+                              'alternatives': [{'confidence': '0.0', 'content': punctuation}]})
+                continue
+            items.append({'type': 'pronunciation', 'start_time': f'{clock:.2f}',
+                          'end_time': f'{clock + SECONDS_PER_WORD:.2f}', 'speaker_label': speaker,
+                          'alternatives': [{'confidence': confidence or '0.99', 'content': word}]})
+            clock += SECONDS_PER_WORD
+        clock += TURN_GAP_SECONDS
+    text = ' '.join(text for _, text in meeting['turns'])
+    return json.dumps({'results': {'transcripts': [{'transcript': text}], 'items': items}}).encode('utf-8')
+
+
+def load_transcript(meeting):
+    return parse_transcript(io.BytesIO(to_transcribe_output(meeting)))
+
+
+def missing_keywords(text, groups):
+    """
+    The keyword groups of which at least one keyword is not in text.
+    """
+    text = text.lower()
+    return [group for group in groups if not all(keyword.lower() in text for keyword in group)]
+
+
+def summarize(llm, transcription):
+    from docker_app.utils.notes import NotesFormatError, parse_review
+    from docker_app.utils.pipeline import generate_review
+    from docker_app.utils.streamlitutils import USER_PROMPT
+    review = generate_review(llm, transcription, USER_PROMPT, '', '').text
+    try:
+        notes = parse_review(review)
+    except NotesFormatError:
+        return review, review
+    action_items = ' '.join(text for _, text in notes.items('ACTION ITEMS'))
+    decisions = ' '.join(text for _, text in notes.items('DECISIONS'))
+    return action_items, decisions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--min-confidence', type=float, default=None, help='Drop the words under this confidence')
+    parser.add_argument('--summarize', action='store_true', help='Also compare the reviews generated by Bedrock')
+    args = parser.parse_args()
+
+    llm = None
+    if args.summarize:
+        from docker_app.utils.clients import get_client, REGION_NAME
+        from docker_app.utils.llm import Llm, MODEL_ID
+        llm = Llm(client=get_client('bedrock-runtime', region_name=REGION_NAME), model_id=MODEL_ID)
+
+    failures = 0
+    print(f"{'meeting':<20} {'tokens':>7} {'compact':>8} {'saved':>6}  keywords")
+    for meeting in load_corpus():
+        transcript = load_transcript(meeting)
+        text, stats = compact_transcript(transcript, min_confidence=args.min_confidence)
+        missing = missing_keywords(text, meeting['action_items'] + meeting['decisions'])
+        failures += bool(missing)
+        print(f"{meeting['name']:<20} {stats.original_tokens:>7} {stats.compacted_tokens:>8} "
+              f"{stats.reduction:>6.0%}  {'ok' if not missing else f'MISSING {missing}'}")
+        if llm is None:
+            continue
+        for label, transcription in (('raw', transcript.format_segments()), ('compacted', text)):
+            action_items, decisions = summarize(llm, transcription)
+            missing = missing_keywords(action_items, meeting['action_items']) + \
+                missing_keywords(decisions, meeting['decisions'])
+            print(f"  {label:<10} review: {'ok' if not missing else f'MISSING {missing}'}")
+            failures += label == 'compacted' and bool(missing)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
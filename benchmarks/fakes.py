@@ -0,0 +1,398 @@
+"""
+In-process stand-ins for the AWS services and the Quip client used by the
+app, with configurable latency and failure rates. They keep the shape of the boto3 responses the app
+reads, and nothing more.
+"""
+import io
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+MB = 1024 * 1024
+
+
+def _client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class SyntheticFile(io.RawIOBase):
+    """
+    Seekable file of a given size whose content is generated on read, so
+    benchmarks can upload gigabytes without holding them in memory.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.size}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        remaining = self.size - self._position
+        length = remaining if size is None or size < 0 else min(size, remaining)
+        self._position += length
+        return bytes(length)
+
+
+class FakePaginator:
+
+    def __init__(self, method):
+        self._method = method
+
+    def paginate(self, **kwargs):
+        kwargs.pop('PaginationConfig', None)
+        yield self._method(**kwargs)
+
+
+class FakeS3Client:
+    """
+    S3 stand-in. Each request sleeps for latency plus its payload divided by
+    bandwidth (bytes per second, per connection), and fails with probability
+    failure_rate (only for failing_operations when given). Object bodies are
+    only kept when store_data is set.
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None, failure_rate=0.0, failing_operations=None, store_data=True,
+                 seed=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.failing_operations = failing_operations
+        self.store_data = store_data
+        self.objects = {}
+        self.uploads = {}
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _request(self, operation, payload=0):
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.failure_rate and \
+                (self.failing_operations is None or operation in self.failing_operations)
+        delay = self.latency + (payload / self.bandwidth if self.bandwidth else 0)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise _client_error('InternalError', operation)
+
+    def get_paginator(self, operation):
+        return FakePaginator(getattr(self, operation))
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        self._request('PutObject', len(Body))
+        self.objects[(Bucket, Key)] = Body if self.store_data else len(Body)
+        return {'ETag': uuid.uuid4().hex}
+
+    def head_object(self, Bucket, Key):
+        self._request('HeadObject')
+        if (Bucket, Key) not in self.objects:
+            raise _client_error('404', 'HeadObject')
+        return {}
+
+    def get_object(self, Bucket, Key):
+        self._request('GetObject')
+        if (Bucket, Key) not in self.objects:
+            raise _client_error('NoSuchKey', 'GetObject')
+        body = self.objects[(Bucket, Key)]
+        if isinstance(body, int):
+            body = bytes(body)
+        return {'Body': io.BytesIO(body)}
+
+    def delete_object(self, Bucket, Key):
+        self._request('DeleteObject')
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._request('CreateMultipartUpload')
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = {'Bucket': Bucket, 'Key': Key, 'Parts': {},
+                                   'Initiated': datetime.now(timezone.utc)}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._request('UploadPart', len(Body))
+        etag = uuid.uuid4().hex
+        self.uploads[UploadId]['Parts'][PartNumber] = (etag, Body if self.store_data else len(Body))
+        return {'ETag': etag}
+
+    def list_multipart_uploads(self, Bucket, Prefix=''):
+        self._request('ListMultipartUploads')
+        return {'Uploads': [{'Key': upload['Key'], 'UploadId': upload_id, 'Initiated': upload['Initiated']}
+                            for upload_id, upload in self.uploads.items()
+                            if upload['Bucket'] == Bucket and upload['Key'].startswith(Prefix)]}
+
+    def list_parts(self, Bucket, Key, UploadId):
+        self._request('ListParts')
+        parts = self.uploads[UploadId]['Parts']
+        return {'Parts': [{'PartNumber': number, 'ETag': etag, 'Size': body if isinstance(body, int) else len(body)}
+                          for number, (etag, body) in sorted(parts.items())]}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self._request('CompleteMultipartUpload')
+        upload = self.uploads.pop(UploadId)
+        bodies = [upload['Parts'][part['PartNumber']][1] for part in MultipartUpload['Parts']]
+        if self.store_data:
+            self.objects[(Bucket, Key)] = b''.join(bodies)
+        else:
+            self.objects[(Bucket, Key)] = sum(bodies)
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._request('AbortMultipartUpload')
+        self.uploads.pop(UploadId, None)
+        return {}
+
+
+class _FakeService:
+    """
+    Common behaviour of the stand-ins: each request sleeps for latency, plus
+    an optional extra delay, and fails with probability failure_rate.
+    """
+    error_code = 'InternalFailure'
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _request(self, operation, delay=0.0):
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.failure_rate
+        if self.latency + delay:
+            time.sleep(self.latency + delay)
+        if failed:
+            raise _client_error(self.error_code, operation)
+
+
+class FakeTranscribeClient(_FakeService):
+    """
+    Transcribe stand-in. A job runs for duration seconds, then writes
+    transcript (bytes, or a function of the job name returning them) to the
+    S3 stand-in and completes, or fails with probability failure_rate. Like
+    the service, it rejects a job name that is already in use.
+    """
+
+    def __init__(self, s3_client, transcript, duration=5.0, latency=0.0, failure_rate=0.0, seed=None):
+        super().__init__(latency, 0.0, seed)
+        self.s3_client = s3_client
+        self.transcript = transcript
+        self.duration = duration
+        self.job_failure_rate = failure_rate
+        self.jobs = {}
+
+    def start_transcription_job(self, TranscriptionJobName, OutputBucketName=None, OutputKey=None, **kwargs):
+        self._request('StartTranscriptionJob')
+        with self._lock:
+            if TranscriptionJobName in self.jobs:
+                raise _client_error('ConflictException', 'StartTranscriptionJob')
+            failed = self._random.random() < self.job_failure_rate
+            self.jobs[TranscriptionJobName] = {
+                'name': TranscriptionJobName, 'bucket': OutputBucketName,
+                'key': OutputKey or f'{TranscriptionJobName}.json', 'failed': failed,
+                'created': datetime.now(timezone.utc), 'written': False,
+            }
+        return {'TranscriptionJob': {'TranscriptionJobName': TranscriptionJobName,
+                                     'TranscriptionJobStatus': 'IN_PROGRESS'}}
+
+    def _details(self, job):
+        created = job['created']
+        done = (datetime.now(timezone.utc) - created).total_seconds() >= self.duration
+        details = {'TranscriptionJobName': job['name'], 'CreationTime': created, 'StartTime': created,
+                   'TranscriptionJobStatus': 'IN_PROGRESS'}
+        if done and job['failed']:
+            details.update(TranscriptionJobStatus='FAILED', FailureReason='Simulated failure',
+                           CompletionTime=datetime.now(timezone.utc))
+        elif done:
+            if not job['written']:
+                transcript = self.transcript(job['name']) if callable(self.transcript) else self.transcript
+                self.s3_client.put_object(Bucket=job['bucket'], Key=job['key'], Body=transcript)
+                job['written'] = True
+            details.update(TranscriptionJobStatus='COMPLETED', CompletionTime=datetime.now(timezone.utc),
+                           Transcript={'TranscriptFileUri': f"https://s3.amazonaws.com/{job['bucket']}/{job['key']}"})
+        return details
+
+    def _job(self, name, operation):
+        job = self.jobs.get(name)
+        if job is None:
+            raise _client_error('BadRequestException', operation)
+        return job
+
+    def get_transcription_job(self, TranscriptionJobName):
+        self._request('GetTranscriptionJob')
+        return {'TranscriptionJob': self._details(self._job(TranscriptionJobName, 'GetTranscriptionJob'))}
+
+    def list_transcription_jobs(self, Status=None, JobNameContains=None, **kwargs):
+        self._request('ListTranscriptionJobs')
+        summaries = [self._details(job) for job in list(self.jobs.values())
+                     if JobNameContains is None or JobNameContains in job['name']]
+        summaries = [summary for summary in summaries if Status is None or summary['TranscriptionJobStatus'] == Status]
+        for summary in summaries:
+            summary.pop('Transcript', None)
+        return {'TranscriptionJobSummaries': summaries}
+
+    def get_paginator(self, operation):
+        return FakePaginator(getattr(self, operation))
+
+    def delete_transcription_job(self, TranscriptionJobName):
+        self._request('DeleteTranscriptionJob')
+        self.jobs.pop(TranscriptionJobName, None)
+        return {}
+
+
+class FakeBedrockClient(_FakeService):
+    """
+    Bedrock Runtime stand-in answering every prompt with text (a string, or
+    a function of the prompt returning one). Generation takes latency plus
+    one second per tokens_per_second output tokens, spread over the stream.
+    """
+    error_code = 'ThrottlingException'
+
+    # Characters per output token
+    CHARS_PER_TOKEN = 4
+    STREAM_CHUNK_CHARS = 40
+
+    def __init__(self, text, tokens_per_second=200.0, latency=0.0, failure_rate=0.0, seed=None):
+        super().__init__(latency, failure_rate, seed)
+        self.text = text
+        self.tokens_per_second = tokens_per_second
+
+    def _answer(self, body):
+        prompt = json.loads(body)['messages'][0]['content'][0]['text']
+        text = self.text(prompt) if callable(self.text) else self.text
+        return text, len(prompt) // self.CHARS_PER_TOKEN, len(text) // self.CHARS_PER_TOKEN
+
+    def invoke_model(self, modelId, body, **kwargs):
+        text, input_tokens, output_tokens = self._answer(body)
+        self._request('InvokeModel', output_tokens / self.tokens_per_second)
+        payload = {'content': [{'type': 'text', 'text': text}],
+                   'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens}}
+        return {'body': io.BytesIO(json.dumps(payload).encode('utf-8'))}
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        text, input_tokens, output_tokens = self._answer(body)
+        self._request('InvokeModelWithResponseStream')
+        chunks = [text[i:i + self.STREAM_CHUNK_CHARS] for i in range(0, len(text), self.STREAM_CHUNK_CHARS)]
+        delay = output_tokens / self.tokens_per_second / max(len(chunks), 1)
+
+        def events():
+            yield {'type': 'message_start', 'message': {'usage': {'input_tokens': input_tokens}}}
+            for chunk in chunks:
+                time.sleep(delay)
+                yield {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': chunk}}
+            yield {'type': 'message_delta', 'usage': {'output_tokens': output_tokens}}
+
+        return {'body': ({'chunk': {'bytes': json.dumps(event).encode('utf-8')}} for event in events())}
+
+
+class FakeStreamingTranscriber:
+    """
+    Streaming Transcribe stand-in. script lists the (end seconds, speaker,
+    text) of the segments of the meeting, each one delivered once that much
+    16 kHz mono 16-bit audio was sent; finish() delivers the rest.
+    """
+    BYTES_PER_SECOND = 16000 * 2
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.audio_bytes = 0
+        self.finished = False
+        self._on_segment = None
+        self._next = 0
+
+    def start(self, on_segment):
+        self._on_segment = on_segment
+
+    def _deliver(self, until):
+        while self._next < len(self.script) and self.script[self._next][0] <= until:
+            end, speaker, text = self.script[self._next]
+            start = self.script[self._next - 1][0] if self._next else 0.0
+            self._next += 1
+            self._on_segment(speaker, start, end, text)
+
+    def send(self, chunk):
+        self.audio_bytes += len(chunk)
+        self._deliver(self.audio_bytes / self.BYTES_PER_SECOND)
+
+    def finish(self):
+        self._deliver(float('inf'))
+        self.finished = True
+
+
+class FakeQuipError(Exception):
+    pass
+
+
+class FakeQuipClient(_FakeService):
+    """
+    quipclient.QuipClient stand-in: documents are created in any folder, and
+    nothing is kept.
+    """
+
+    def __init__(self, access_token=None, base_url=None, latency=0.0, failure_rate=0.0, seed=None):
+        super().__init__(latency, failure_rate, seed)
+        self.documents = 0
+
+    def _request(self, operation, delay=0.0):
+        try:
+            super()._request(operation, delay)
+        except ClientError as e:
+            raise FakeQuipError(f'{operation} failed: 503') from e
+
+    def get_authenticated_user(self):
+        self._request('get_authenticated_user')
+        return {'id': 'user', 'name': 'Load Test'}
+
+    def new_document(self, content, format='html', title=None, member_ids=()):
+        self._request('new_document')
+        with self._lock:
+            self.documents += 1
+            number = self.documents
+        return {'thread': {'id': f'doc{number}', 'link': f'https://quip.example.com/doc{number}'}}
+
+    def edit_document(self, thread_id, content, operation=None, format='html', section_id=None, **kwargs):
+        self._request('edit_document')
+        return {'thread': {'id': thread_id}}
+
+
+class FakeAuthenticator:
+    """
+    Stand-in for the Cognito authenticator of the page: always signed in.
+    """
+
+    def __init__(self, username='load-test'):
+        self.username = username
+
+    def login(self):
+        return True
+
+    def logout(self):
+        pass
+
+    def get_username(self):
+        return self.username
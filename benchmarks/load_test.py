@@ -0,0 +1,421 @@
+"""
+Load test of the page: concurrent Streamlit sessions going through the full
+flow of docker_app/app.py against in-process stand-ins of S3, Transcribe,
+Bedrock, Cognito and Quip.
+
+    python -m benchmarks.load_test --sessions 1 2 4 8 16 32
+    taskset -c 0 python -m benchmarks.load_test --sessions 4 8 --bedrock-latency 1 --failure-rate 0.02
+
+Every session loads the page, uploads a recording, refreshes until its
+transcription completes, reviews the notes and writes them to Quip, with
+some think time in between, like a user. Each step is one rerun of the
+script, run by the Streamlit testing runner on its own thread as the server
+would; rerun latencies include the parsing of the page by the runner, so they
+are a slight overestimate.
+
+For each number of concurrent sessions, the report shows the latency
+percentiles of the reruns, split between the light ones (page loads and
+status refreshes, which only wait on the CPU) and the steps waiting on the
+services, the resident memory per session, and the failures. The
+saturation point is the first level whose light reruns have a p95 above
+--slo: from there, reruns queue behind each other. The task runs on one
+vCPU (cpu=1024 in cdk/cdk_stack.py), pin the harness to one core with
+taskset to get comparable numbers.
+
+Meetings are processed inside the page (JOB_QUEUE_URL is unset), audio
+preprocessing and browser uploads are off, and no port is opened.
+"""
+import argparse
+import gc
+import io
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from unittest.mock import MagicMock
+from urllib import parse
+
+from benchmarks.bench_hotpaths import synthetic_review, synthetic_transcript
+from benchmarks.fakes import (MB, FakeAuthenticator, FakeBedrockClient, FakeQuipClient, FakeS3Client,
+                              FakeTranscribeClient)
+from docker_app.utils.notes import section_name
+from docker_app.utils.pipeline import StageStats
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docker_app')
+APP_PATH = os.path.join(APP_DIR, 'app.py')
+
+# Session state keys read by the stand-ins of the file uploader and of the authenticator
+RECORDING_KEY = 'load_test_recording'
+USER_KEY = 'load_test_user'
+
+# Settings of the page during the load test
+CONFIG_OVERRIDES = {
+    'JOB_QUEUE_URL': None,
+    # Sessions click through the stages
+    'AUTO_PIPELINE': False,
+    'AUDIO_PREPROCESSING': False,
+    'BROWSER_UPLOAD_ENABLED': False,
+    'TRANSCRIBE_EVENTS_QUEUE_URL': None,
+    'METRICS_PORT': None,
+    'LOG_LEVEL': 'WARNING',
+    'LOG_JSON': False,
+}
+
+# Reruns that only wait on the CPU, whose latency shows queueing
+LIGHT_STEPS = ('load', 'refresh')
+STEPS = ('load', 'submit', 'refresh', 'review', 'quip')
+
+SLO_SECONDS = 0.5
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# How the prompts of the concurrent section calls name their section
+_SECTION_REQUEST = re.compile(r'Write only the (?P<name>[A-Z/ ]+) section')
+
+
+class UploadedRecording(io.BytesIO):
+    """
+    What st.file_uploader returns: a file object with a name, type and size.
+    """
+
+    def __init__(self, name, type, data):
+        super().__init__(data)
+        self.name = name
+        self.type = type
+        self.size = len(data)
+
+
+class SessionError(Exception):
+    pass
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        import resource
+        # Peak rather than current size where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def unique_transcripts(size):
+    """
+    Transcribe outputs of about size bytes, different for every job, so
+    that no session is served the model answer of another from the cache.
+    """
+    base = synthetic_transcript(size)
+
+    def transcript(job_name):
+        item = json.dumps({'type': 'pronunciation', 'start_time': '0.00', 'end_time': '0.10', 'speaker_label': 'spk_0',
+                           'alternatives': [{'confidence': '0.99', 'content': job_name}]})
+        return base.replace(b'"items": [', b'"items": [' + item.encode('utf-8') + b',', 1)
+    return transcript
+
+
+def review_answers(review):
+    """
+    Model answer to a prompt: the bullets of one section when the prompt
+    asks for a single section, the whole review otherwise.
+    """
+    sections = {}
+    name = None
+    for line in review.splitlines():
+        heading = section_name(line)
+        if heading is not None:
+            name = heading
+        elif name is not None:
+            sections.setdefault(name, []).append(line)
+
+    def answer(prompt):
+        match = _SECTION_REQUEST.search(prompt)
+        if match is None:
+            return review
+        return '\n'.join(sections.get(match.group('name'), [])).strip()
+    return answer
+
+
+def install_fakes(args):
+    """
+    Point the page at the stand-ins. Returns them by service name.
+    """
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    import quipclient
+    import streamlit
+    from config_file import Config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from utils.auth import Auth
+    from utils.clients import REGION_NAME, register_client
+
+    for name, value in CONFIG_OVERRIDES.items():
+        setattr(Config, name, value)
+
+    transcript = unique_transcripts(args.transcript_kb * 1024)
+    review = synthetic_review(args.review_items)
+    fakes = {'s3': FakeS3Client(latency=args.s3_latency, failure_rate=args.failure_rate, seed=0)}
+    fakes['transcribe'] = FakeTranscribeClient(fakes['s3'], transcript, duration=args.transcribe_seconds,
+                                               latency=args.transcribe_latency, failure_rate=args.failure_rate, seed=1)
+    fakes['bedrock-runtime'] = FakeBedrockClient(review_answers(review), tokens_per_second=args.tokens_per_second,
+                                                 latency=args.bedrock_latency, failure_rate=args.failure_rate, seed=2)
+    register_client('s3', fakes['s3'])
+    register_client('transcribe', fakes['transcribe'], region_name=REGION_NAME)
+    register_client('bedrock-runtime', fakes['bedrock-runtime'], region_name=REGION_NAME)
+    quipclient.QuipClient = partial(FakeQuipClient, latency=args.quip_latency, failure_rate=args.failure_rate)
+
+    Auth.get_authenticator = staticmethod(
+        lambda secret_id, session_state=None, ttl=None: FakeAuthenticator(session_state.get(USER_KEY, 'load-test')))
+
+    def file_uploader(label, *args, **kwargs):
+        recording = streamlit.session_state.get(RECORDING_KEY)
+        return UploadedRecording(*recording) if recording is not None else None
+
+    streamlit.file_uploader = file_uploader
+    # Sessions are driven from threads without a script context, which Streamlit warns about
+    logging.getLogger('streamlit.runtime.scriptrunner.script_run_context').addFilter(
+        lambda record: 'missing ScriptRunContext' not in record.getMessage())
+
+    # The runtime the sessions share, as the testing runner would set up for each run
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage('/mock/media'))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    return fakes
+
+
+@lru_cache(maxsize=None)
+def _session_app_class():
+    # Streamlit is imported once the app directory is on the path
+    from streamlit.runtime.scriptrunner import RerunData, ScriptRunnerEvent
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import AppTest
+    from streamlit.testing.v1.element_tree import parse_tree_from_messages
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    class SessionApp(AppTest):
+        """
+        AppTest whose runs leave the process-wide runtime alone, so that many
+        sessions can run at once, and wait for the end of the script on an
+        event instead of polling for it. Like the server, the sessions share
+        the compiled script.
+        """
+        script_cache = ScriptCache()
+
+        def _run(self, widget_state=None, timeout=None):
+            timeout = timeout or self.default_timeout
+            runner = LocalScriptRunner(self._script_path, self.session_state)
+            runner._script_cache = self.script_cache
+            stopped = threading.Event()
+
+            def on_event(sender, event, **kwargs):
+                if event == ScriptRunnerEvent.SHUTDOWN:
+                    stopped.set()
+
+            runner.on_event.connect(on_event, weak=False)
+            runner.request_rerun(RerunData(widget_states=widget_state,
+                                           query_string=parse.urlencode(self.query_params, doseq=True)))
+            runner.start()
+            if not stopped.wait(timeout):
+                runner.request_stop()
+                runner.join()
+                raise RuntimeError(f'Script run timed out after {timeout}s')
+            self._tree = parse_tree_from_messages(runner.forward_msgs())
+            self._tree._runner = self
+            self.query_params = parse.parse_qs(runner.event_data[-1]['client_state'].query_string)
+            return self
+
+    return SessionApp
+
+
+def _session_app(timeout):
+    return _session_app_class()(APP_PATH, default_timeout=timeout)
+
+
+class Session:
+    """
+    One user going through the flow of the page.
+    """
+
+    def __init__(self, index, args, stats):
+        self.index = index
+        self.args = args
+        self.stats = stats
+        self.random = random.Random(index)
+        self.app = _session_app(args.rerun_timeout)
+        self.app.session_state[USER_KEY] = f'user-{index}'
+
+    def think(self, seconds=None):
+        time.sleep((seconds or self.args.think_seconds) * self.random.uniform(0.5, 1.5))
+
+    def rerun(self, step, run):
+        start = time.perf_counter()
+        failed = True
+        try:
+            run()
+            if self.app.exception:
+                raise SessionError(f'{step}: {self.app.exception[0].value}')
+            if self.app.error:
+                raise SessionError(f'{step}: {self.app.error[0].value}')
+            failed = False
+        finally:
+            self.stats[step].record(time.perf_counter() - start, failed)
+
+    def click(self, step, label):
+        buttons = [button for button in self.app.button if button.label == label]
+        if not buttons:
+            raise SessionError(f'{step}: no "{label}" button on the page')
+        self.rerun(step, buttons[0].click().run)
+
+    def has_button(self, label):
+        return any(button.label == label for button in self.app.button)
+
+    def run(self):
+        args = self.args
+        self.rerun('load', self.app.run)
+        for meeting in range(args.meetings):
+            self.think()
+            data = f'session {self.index} meeting {meeting}\n'.encode('utf-8') + bytes(args.recording_kb * 1024)
+            self.app.session_state[RECORDING_KEY] = (f'meeting-{self.index}-{meeting}.m4a', 'audio/x-m4a', data)
+            self.click('submit', 'Submit for Analysis')
+            self.app.session_state[RECORDING_KEY] = None
+            deadline = time.time() + args.transcribe_seconds * 10 + 60
+            while self.has_button('Refresh transcription status'):
+                if time.time() > deadline:
+                    raise SessionError('refresh: transcription did not complete')
+                self.think(args.refresh_seconds)
+                self.click('refresh', 'Refresh transcription status')
+            self.think()
+            self.click('review', 'Review Meeting Notes')
+            self.think()
+            self.app.text_input(key='QuipToken').input('token')
+            self.app.text_input(key='QuipLoc').input('https://quip.example.com/folder/notes')
+            self.click('quip', 'Write Notes To Quip')
+            self.think()
+            self.click('load', 'Clear Meeting Info')
+
+
+def run_level(sessions, args):
+    """
+    Run sessions concurrently, their starts spread over --ramp-seconds.
+    """
+    stats = {step: StageStats() for step in STEPS}
+    gc.collect()
+    rss_before = rss_bytes()
+    stored_before = _stored_bytes(args.fakes['s3'])
+    ready = []
+    errors = []
+    lock = threading.Lock()
+
+    def run_session(index):
+        time.sleep(args.ramp_seconds * index / sessions)
+        session = Session(index, args, stats)
+        with lock:
+            ready.append(session)
+        try:
+            session.run()
+        except SessionError as e:
+            with lock:
+                errors.append(str(e))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        list(executor.map(run_session, range(sessions)))
+    elapsed = time.perf_counter() - start
+    # Measured while the sessions, and their state, are still alive
+    gc.collect()
+    memory = rss_bytes() - rss_before - (_stored_bytes(args.fakes['s3']) - stored_before)
+    light = StageStats()
+    for step in LIGHT_STEPS:
+        for seconds in stats[step].latencies:
+            light.record(seconds)
+    reruns = sum(len(stats[step].latencies) for step in STEPS)
+    del ready
+    return {
+        'sessions': sessions,
+        'elapsed': elapsed,
+        'reruns_per_second': reruns / elapsed,
+        'light': light.summary(),
+        'steps': {step: stats[step].summary() for step in STEPS},
+        'memory_per_session': max(memory, 0) / sessions,
+        'errors': errors,
+    }
+
+
+def _stored_bytes(s3_client):
+    # The bodies kept by the S3 stand-in are not memory of the sessions
+    return sum(len(body) if isinstance(body, bytes) else 0 for body in list(s3_client.objects.values()))
+
+
+def saturation_point(levels, slo=SLO_SECONDS):
+    for level in levels:
+        if level['light']['p95'] > slo:
+            return level['sessions']
+    return None
+
+
+def format_level(level):
+    light = level['light']
+    lines = [f"{level['sessions']:>4} sessions  {level['reruns_per_second']:>6.1f} reruns/s  "
+             f"light p50 {light['p50']:.3f}s p95 {light['p95']:.3f}s max {light['max']:.3f}s  "
+             f"{level['memory_per_session'] / MB:>6.1f} MB/session  {len(level['errors'])} failed sessions"]
+    for step, summary in level['steps'].items():
+        if summary['count']:
+            lines.append(f"        {step:<8} n={summary['count']:<4} p50 {summary['p50']:.3f}s "
+                         f"p95 {summary['p95']:.3f}s max {summary['max']:.3f}s failures {summary['failures']}")
+    for error in sorted(set(level['errors']))[:5]:
+        lines.append(f'        ! {error}')
+    return '\n'.join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                        help='Numbers of concurrent sessions to run, in order')
+    parser.add_argument('--meetings', type=int, default=1, help='Meetings each session goes through')
+    parser.add_argument('--slo', type=float, default=SLO_SECONDS,
+                        help='p95 latency of the light reruns that marks saturation, in seconds')
+    parser.add_argument('--ramp-seconds', type=float, default=5.0, help='Period over which the sessions start')
+    parser.add_argument('--think-seconds', type=float, default=1.0, help='Average pause between two steps')
+    parser.add_argument('--refresh-seconds', type=float, default=2.0, help='Average pause between two refreshes')
+    parser.add_argument('--recording-kb', type=int, default=1024, help='Size of the uploaded recordings')
+    parser.add_argument('--transcript-kb', type=int, default=200, help='Size of the Transcribe output')
+    parser.add_argument('--review-items', type=int, default=8, help='Bullets per section of the generated review')
+    parser.add_argument('--transcribe-seconds', type=float, default=5.0, help='Duration of a transcription job')
+    parser.add_argument('--tokens-per-second', type=float, default=200.0, help='Generation speed of the model')
+    parser.add_argument('--s3-latency', type=float, default=0.02, help='Latency of an S3 request')
+    parser.add_argument('--transcribe-latency', type=float, default=0.05, help='Latency of a Transcribe request')
+    parser.add_argument('--bedrock-latency', type=float, default=0.5, help='Latency before the first token')
+    parser.add_argument('--quip-latency', type=float, default=0.2, help='Latency of a Quip request')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Probability that a request fails')
+    parser.add_argument('--rerun-timeout', type=float, default=300.0, help='Longest rerun before a session fails')
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    args.fakes = install_fakes(args)
+    # Load the page once, so that the first level does not pay for the imports of the app
+    _session_app(args.rerun_timeout).run()
+
+    levels = []
+    for sessions in args.sessions:
+        level = run_level(sessions, args)
+        levels.append(level)
+        print(format_level(level), flush=True)
+    saturation = saturation_point(levels, args.slo)
+    if saturation is None:
+        print(f'\nNot saturated up to {max(args.sessions)} sessions (p95 of the light reruns under {args.slo}s)')
+    else:
+        print(f'\nSaturation point: {saturation} concurrent sessions (p95 of the light reruns over {args.slo}s)')
+
+
+if __name__ == '__main__':
+    main()
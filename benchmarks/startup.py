@@ -0,0 +1,148 @@
+"""
+Import time of the page, the part of a cold start and of a first page load
+that the code controls.
+
+    python -m benchmarks.startup                 # report of docker_app/app.py
+    python -m benchmarks.startup --budget 1500   # fails above 1.5s of imports
+
+The modules imported at the top of the script are imported in a fresh
+interpreter with python -X importtime, from the folder of the script like
+streamlit run does, best of --repeat runs. The report gives their time,
+the self time of each package and the slowest modules. The modules of the
+app (those of the script folder) are then imported alone, and the report
+fails when they import one of LAZY_PACKAGES: these are only needed by some
+code paths, and are imported by the functions that use them.
+"""
+import argparse
+import ast
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docker_app', 'app.py')
+
+# Imported on first use: the first AWS client, audio processing, Quip, the time zones, the login form
+LAZY_PACKAGES = ('boto3', 'numpy', 'quipclient', 'pytz', 'streamlit_cognito_auth', 'amazon_transcribe')
+
+REPEAT = 3
+TOP = 15
+
+# import time: self [us] | cumulative | imported package
+_IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def script_imports(path):
+    """
+    Modules imported by the top-level statements of a script, in order.
+    Imports made inside functions are left out: they do not slow the start.
+    """
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and not node.level:
+            names = [node.module]
+        else:
+            continue
+        modules.extend(name for name in names if name not in modules)
+    return modules
+
+
+def parse_import_times(output):
+    """
+    (module, self seconds, cumulative seconds, depth) of each line of the
+    -X importtime output, in the order the imports completed.
+    """
+    entries = []
+    for line in output.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match:
+            entries.append((match.group(4), int(match.group(1)) / 1e6, int(match.group(2)) / 1e6,
+                            len(match.group(3)) // 2))
+    return entries
+
+
+def measure(modules, cwd, python=sys.executable):
+    """
+    Import the modules in a fresh interpreter, returns the parsed
+    -X importtime entries of these imports, without the start of the
+    interpreter itself.
+    """
+    marker = 'startup: imports of the script'
+    # The marker separates the start of the interpreter (site...) from the imports measured
+    code = f'import sys; print({marker!r}, file=sys.stderr, flush=True); import ' + ', '.join(modules)
+    process = subprocess.run([python, '-X', 'importtime', '-c', code], cwd=cwd, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError(f'Importing {", ".join(modules)} failed:\n{process.stderr[-2000:]}')
+    return parse_import_times(process.stderr.split(marker + '\n', 1)[-1])
+
+
+def own_modules(modules, folder):
+    """
+    The modules of a list that come from the folder, not from packages.
+    """
+    return [module for module in modules
+            if any(os.path.exists(os.path.join(folder, module.split('.')[0] + suffix)) for suffix in ('', '.py'))]
+
+
+def total_seconds(entries):
+    return sum(cumulative for _, _, cumulative, depth in entries if depth == 0)
+
+
+def package_seconds(entries):
+    packages = defaultdict(float)
+    for module, self_seconds, _, _ in entries:
+        packages[module.split('.')[0]] += self_seconds
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+
+def lazy_imports(entries, lazy_packages=LAZY_PACKAGES):
+    loaded = {module.split('.')[0] for module, _, _, _ in entries}
+    return [package for package in lazy_packages if package in loaded]
+
+
+def format_report(path, entries, own_entries, top=TOP):
+    lines = [f'Imports of {os.path.basename(path)}: {total_seconds(entries) * 1000:.0f}ms',
+             f'Modules of the app alone: {total_seconds(own_entries) * 1000:.0f}ms', '']
+    lines.append('By package (self time):')
+    lines += [f'  {package:<40} {seconds * 1000:8.1f}ms' for package, seconds in package_seconds(entries)[:top]]
+    lines.append('')
+    lines.append('Slowest modules (cumulative time):')
+    slowest = sorted(entries, key=lambda entry: entry[2], reverse=True)[:top]
+    lines += [f'  {module:<40} {cumulative * 1000:8.1f}ms' for module, _, cumulative, _ in slowest]
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--script', default=APP_PATH, help='Script whose imports are measured')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='Runs, the fastest one is reported')
+    parser.add_argument('--top', type=int, default=TOP, help='Packages and modules listed')
+    parser.add_argument('--budget', type=float, help='Fail when the imports take more milliseconds than this')
+    args = parser.parse_args(argv)
+
+    folder = os.path.dirname(os.path.abspath(args.script))
+    modules = script_imports(args.script)
+    entries = min((measure(modules, folder) for _ in range(args.repeat)), key=total_seconds)
+    own = own_modules(modules, folder)
+    own_entries = min((measure(own, folder) for _ in range(args.repeat)), key=total_seconds)
+    print(format_report(args.script, entries, own_entries, args.top))
+
+    failed = False
+    loaded = lazy_imports(own_entries)
+    if loaded:
+        print(f'\nImported by the modules of the app, but only needed by some code paths: {", ".join(loaded)}')
+        failed = True
+    if args.budget is not None and total_seconds(entries) * 1000 > args.budget:
+        print(f'\nImports take more than the budget of {args.budget:.0f}ms')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,5 @@
 from aws_cdk import (
-    # Duration,
+    Duration,
     Stack,
     aws_ec2 as ec2,
     aws_ecs as ecs,
@@ -51,7 +51,11 @@ class CdkStack(Stack):
         # Create S3 bucket and provide acccess
         bucket = s3.Bucket(self, f"{prefix}AppS3",
                            bucket_name=Config.S3_BUCKET_NAME,
-                           public_read_access=False, enforce_ssl=True)
+                           public_read_access=False, enforce_ssl=True,
+                           # Uploads interrupted for good are resumed by the app,
+                           # clean up the parts of those that never are
+                           lifecycle_rules=[s3.LifecycleRule(
+                               abort_incomplete_multipart_upload_after=Duration.days(1))])
 
 
         # VPC for ALB and ECS cluster
@@ -138,7 +142,7 @@ class CdkStack(Stack):
         bedrock_policy = iam.Policy(self, f"{prefix}BedrockPolicy",
                                     statements=[
                                         iam.PolicyStatement(
-                                            actions=["bedrock:InvokeModel"],
+                                            actions=["bedrock:InvokeModel", "bedrock:InvokeModelWithResponseStream"],
                                             resources=["*"]
                                         )
                                     ]
@@ -183,6 +187,16 @@ class CdkStack(Stack):
             ),
         )
 
+        # Let the browser upload recordings straight to the bucket through
+        # presigned multipart URLs, and read the ETag of each part
+        bucket.add_cors_rule(
+            allowed_methods=[s3.HttpMethods.PUT, s3.HttpMethods.POST],
+            allowed_origins=[f"https://{cloudfront_distribution.domain_name}"] + Config.BROWSER_UPLOAD_EXTRA_ORIGINS,
+            allowed_headers=["*"],
+            exposed_headers=["ETag"],
+            max_age=3000,
+        )
+
         # ALB Listener
         http_listener = alb.add_listener(
             f"{prefix}HttpListener",
@@ -201,6 +215,15 @@ class CdkStack(Stack):
                     [Config.CUSTOM_HEADER_VALUE])],
             protocol=elbv2.ApplicationProtocol.HTTP,
             targets=[service],
+            # Streamlit's own health endpoint, checked often enough that a new
+            # task receives traffic seconds after the server is up
+            health_check=elbv2.HealthCheck(
+                path="/_stcore/health",
+                interval=Duration.seconds(10),
+                timeout=Duration.seconds(5),
+                healthy_threshold_count=2,
+            ),
+            deregistration_delay=Duration.seconds(30),
         )
         # add a default action to the listener that will deny all requests that
         # do not have the custom header
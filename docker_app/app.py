@@ -11,19 +11,50 @@
 # streamlit run streamlit-hello.py
 
 import streamlit as st
-import boto3
+import streamlit.components.v1 as components
+import hashlib
+import logging
+import os
+import sys
 import time
-from utils.streamlitutils import *
-import json
+from utils.streamlitutils import (BUCKET_NAME, KEY, USER_PROMPT, HTML_PROMPT_PREFIX, conform_to_regex, get_current_time,
+                                  format_llm_timings, format_upload_progress, render_rerun_timer, write_to_quip)
+from utils.clients import get_client, REGION_NAME
+from utils.transcription import get_tracker, transcription_job_name, TERMINAL_STATUSES
+from utils.llm import Llm, MODEL_ID
+from utils.pipeline import (generate_review, read_transcript, delete_recording, get_time_map, put_time_map,
+                            start_split_transcription, upload_segments, load_transcription, quip_html, MeetingChain)
+from utils.audio import ffmpeg_available, preprocess_fileobj
+from utils.compaction import CompactionStats, compact_transcript
+from utils.summarize import ReviewState
+from utils.notes import parse_review, render_html, render_markdown, NotesFormatError
+from utils.cache import get_response_cache, make_store
+from utils.upload import MultipartUploader
+from utils.browser_upload import (MEDIA_FORMATS as BROWSER_UPLOAD_FORMATS, abort_browser_upload, create_browser_upload,
+                                  presign_browser_upload, render_browser_upload)
+from utils.storage import hash_fileobj, media_extension, media_key, transcribe_media_format, transcript_key, object_exists, get_manifest
+from utils.jobs import get_job_store, start_worker_processes, FINAL_STATUSES, SUCCEEDED
 from utils.auth import Auth
+from utils.telemetry import configure_logging, get_telemetry, new_trace_id, span, start_metrics_server
 from config_file import Config
 
+logger = logging.getLogger(__name__)
+
+# Structured logs (spans included) on stderr, and Prometheus metrics, once per process
+configure_logging(Config.LOG_LEVEL, Config.LOG_JSON)
+if Config.METRICS_PORT:
+    try:
+        start_metrics_server(Config.METRICS_PORT)
+    except OSError as e:
+        logger.warning('Could not serve metrics on port %s: %s', Config.METRICS_PORT, e)
+
 
 # ID of Secrets Manager containing cognito parameters
 secrets_manager_id = Config.SECRETS_MANAGER_ID
 
-# Initialise CognitoAuthenticator
-authenticator = Auth.get_authenticator(secrets_manager_id)
+# Initialise CognitoAuthenticator, reused across the reruns of the session
+authenticator = Auth.get_authenticator(secrets_manager_id, session_state=st.session_state,
+                                       ttl=Config.SECRET_CACHE_TTL_SECONDS)
 
 # Authenticate user, and stop here if not logged in
 is_logged_in = authenticator.login()
@@ -35,6 +66,205 @@ def logout():
     authenticator.logout()
 
 
+def transcription_tracker():
+    """
+    The tracker of the process. Every call gives the events queue, so that
+    it is fed by the events whichever call comes first.
+    """
+    return get_tracker(region_name=REGION_NAME, events_queue_url=Config.TRANSCRIBE_EVENTS_QUEUE_URL)
+
+
+def start_transcription(filename, transcription_key, digest, on_completed=None, segments=None):
+    """
+    Start the transcription of a recording stored in S3, or of its segments
+    when it was split, and return the name of the job, None if it could not
+    start. The tracker polls the jobs in the background and the page reads
+    their state on each run.
+    """
+    try:
+        try:
+            tracker = transcription_tracker()
+        except Exception as e:
+            st.error(f'Error creating Transcribe client: {e}')
+            st.stop()
+
+        job_args = dict(
+            Media={'MediaFileUri': f's3://{BUCKET_NAME}/{filename}'},
+            LanguageCode='en-US',
+            OutputBucketName=BUCKET_NAME,
+            Settings={'ShowSpeakerLabels': True, 'MaxSpeakerLabels': Config.TRANSCRIBE_MAX_SPEAKERS},
+            **transcribe_media_format(filename)
+        )
+        # Named after the recording and the settings: the same recording submitted
+        # from another tab or by another user attaches to the running job
+        job_name = transcription_job_name(digest, job_args)
+        # Start transcription job, its span joins the trace of the meeting
+        with span('stage.transcribe', trace_id=st.session_state.trace_id):
+            if segments:
+                job_name, job = start_split_transcription(tracker, get_client('s3'), BUCKET_NAME, KEY, digest, segments,
+                                                          transcription_key, Config.TRANSCRIBE_MAX_SPEAKERS)
+            else:
+                job = tracker.start_job(job_name, output_key=transcription_key, **job_args)
+        if on_completed is not None:
+            tracker.add_callback(job_name, on_completed)
+        st.session_state.transcription_job = job_name
+        if job['requesters'] > 1:
+            st.info('This recording is already being transcribed, following that job. ' + get_current_time())
+        elif segments:
+            st.info(f'Transcription started as {len(segments)} parallel jobs. Please wait... ' + get_current_time())
+        else:
+            st.info('Transcription job started. Please wait... ' + get_current_time())
+        return job_name
+    except Exception as e:
+        st.error(f'Error starting transcription: {e}')
+        return None
+
+
+def submit_meeting_job(file, direct_upload_key):
+    """
+    Queue the meeting for the worker processes, which upload, transcribe and
+    summarize it (and write it to Quip when a location is set) even if the
+    browser disconnects. The page only follows the job.
+    """
+    user_prompt = st.session_state.get("UserPrompt", USER_PROMPT)
+    quip_token = st.session_state.get("QuipToken", "")
+    quip_location = st.session_state.get("QuipLoc", "")
+    state = {
+        'user_prompt': user_prompt,
+        'attendees_agenda': user_input_attendees_agenda,
+        'meeting_notes': user_input_meeting_notes,
+        'delete_files': delete_files,
+        # The token stays in the session, the page writes the notes to Quip once they are ready
+        'quip': {'location': quip_location, 'doc_name': st.session_state.get("QuipDocName", "")}
+                if quip_token and quip_location else None,
+    }
+    request = hashlib.sha256()
+    if file is not None:
+        # Leave the recording for the workers, hashing it on the way
+        os.makedirs(Config.JOB_SPOOL_DIR, exist_ok=True)
+        spool_tmp = os.path.join(Config.JOB_SPOOL_DIR, f'{time.time_ns()}.tmp')
+        file.seek(0)
+        with open(spool_tmp, 'wb') as spool:
+            for chunk in iter(lambda: file.read(8 * 1024 * 1024), b''):
+                request.update(chunk)
+                spool.write(chunk)
+        state['filename'] = file.name
+    else:
+        request.update(direct_upload_key.encode('utf-8'))
+        state['media_key'] = direct_upload_key
+    for value in (user_prompt, user_input_attendees_agenda, user_input_meeting_notes, quip_location, str(delete_files)):
+        request.update(b'\0' + value.encode('utf-8'))
+    # Submitting the same meeting twice (e.g. a double click) returns the same job
+    idempotency_key = request.hexdigest()
+    if file is not None:
+        state['spool_path'] = os.path.join(Config.JOB_SPOOL_DIR, f'{idempotency_key}.{media_extension(file.name)}')
+        os.replace(spool_tmp, state['spool_path'])
+    job_id = job_store.submit('meeting', state, idempotency_key, max_attempts=Config.JOB_MAX_ATTEMPTS)
+    if file is not None and job_store.get(job_id)['state'].get('spool_path') is None:
+        # The same meeting was already submitted and its recording uploaded
+        os.remove(state['spool_path'])
+    st.session_state.job_id = job_id
+    st.session_state.loaded_job_id = None
+    # Keep the job in the URL, so that it can be followed again after a disconnect
+    st.experimental_set_query_params(job=job_id)
+    st.info('Meeting submitted, it is processed in the background. ' + get_current_time())
+
+
+def start_meeting_chain():
+    """
+    Chain the stages of the meeting instead of waiting for the buttons, and
+    draft the review of the typed notes right away, while the recording is
+    uploaded and transcribed.
+    """
+    user_prompt = st.session_state.get("UserPrompt", USER_PROMPT)
+    attendees_agenda, meeting_notes = user_input_attendees_agenda, user_input_meeting_notes
+    review_state = st.session_state.review_state
+
+    def summarize(transcription, on_text):
+        return generate_review(llm, transcription, user_prompt, attendees_agenda, meeting_notes,
+                               on_text=on_text if Config.LLM_STREAMING else None,
+                               map_reduce_threshold=Config.MAP_REDUCE_THRESHOLD_CHARS,
+                               max_workers=Config.MAP_REDUCE_MAX_WORKERS,
+                               parallel_sections=Config.PARALLEL_SECTIONS, state=review_state)
+
+    chain = MeetingChain(summarize, trace_id=st.session_state.trace_id)
+    if attendees_agenda or meeting_notes:
+        chain.start_draft()
+    st.session_state.meeting_chain = chain
+    return chain
+
+
+def chain_review(chain, digest=None, media_key=None, transcription_key=None, job_name=None):
+    """
+    Start the review of the chained meeting once its transcript is ready: at
+    once, or when the job_name Transcribe job completes. The notes are then
+    written to Quip when its token and location are filled in, and the files
+    deleted when asked to.
+    """
+    s3_client = get_client('s3')
+    user_prompt = st.session_state.get("UserPrompt", USER_PROMPT)
+    quip_token = st.session_state.get("QuipToken", "")
+    quip_location = st.session_state.get("QuipLoc", "")
+    quip_doc_name = st.session_state.get("QuipDocName", "")
+    quip_clients = st.session_state.quip_clients
+    compaction_options = dict(min_confidence=Config.COMPACTION_MIN_CONFIDENCE) if Config.TRANSCRIPT_COMPACTION else None
+    trace_id = st.session_state.trace_id
+    delete = delete_files
+
+    def load():
+        if transcription_key is None:
+            # Meeting notes only
+            return '', None
+        return load_transcription(s3_client, bucket_name, key, digest, transcription_key, compaction_options)
+
+    def finish(review):
+        result = None
+        if quip_token and quip_location:
+            with span('stage.quip', trace_id=trace_id):
+                result = write_to_quip(quip_token, quip_doc_name, quip_html(llm, review, user_prompt), quip_location,
+                                       quip_clients)
+        if delete and media_key:
+            delete_recording(s3_client, bucket_name, key, digest, media_key, transcription_key,
+                             transcription_tracker())
+        return result
+
+    if job_name is not None:
+        transcription_tracker().add_callback(job_name, chain.on_transcribed(load, finish))
+    else:
+        chain.start_review(load, finish)
+
+
+def show_meeting_chain(placeholders, chain_state):
+    """
+    Progress of the chained meeting, with the draft until the review replaces it.
+    """
+    status, review = placeholders
+    if chain_state['error']:
+        status.error(f"Error reviewing the meeting: {chain_state['error']}")
+    elif chain_state['stage'] == 'summarize':
+        status.info('Transcription ready, reviewing the meeting notes... ' + get_current_time())
+    elif chain_state['stage'] == 'finish':
+        status.info('Writing the notes... ' + get_current_time())
+    elif chain_state['result']:
+        status.info(chain_state['result'])
+    else:
+        status.empty()
+    if chain_state['review_text']:
+        review.info(chain_state['review_text'])
+    elif chain_state['draft_text']:
+        review.info("Draft from your notes, until the recording is reviewed:\n\n" + chain_state['draft_text'])
+    else:
+        review.empty()
+
+
+# Meetings are processed by worker processes when a job queue is configured
+job_store = None
+if Config.JOB_QUEUE_URL:
+    job_store = get_job_store(Config.JOB_QUEUE_URL)
+    if Config.JOB_START_WORKERS:
+        start_worker_processes([sys.executable, 'cli.py', 'worker', '--queue', Config.JOB_QUEUE_URL],
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+
 with st.sidebar:
     st.text(f"Welcome,\n{authenticator.get_username()}")
     st.button("Logout", "logout_btn", on_click=logout)
@@ -44,10 +274,49 @@ st.title('Peronal Meeting Summarizer Assistant')
 # Add a welcome message 
 st.write('Welcome to your own meeting summarizer assistant!') 
 
-# input form to upload a file to s3 bucket
-file = st.file_uploader("""Upload a meeting recording in mp3, mp4 or m4a format from your local desktop, 
-                        and the application will guide you to extract agenda, action items and meeting notes for you:""")
-
+# Large recordings can be sent by the browser straight to S3, without going through the container
+upload_mode = "Through the app"
+if Config.BROWSER_UPLOAD_ENABLED:
+    upload_mode = st.radio("How do you want to upload the recording?", ["Through the app", "Directly to S3 (large files)"],
+                           horizontal=True)
+
+file = None
+direct_upload_key = None
+if upload_mode == "Through the app":
+    # input form to upload a file to s3 bucket
+    file = st.file_uploader("""Upload a meeting recording in mp3, mp4 or m4a format from your local desktop, 
+                            and the application will guide you to extract agenda, action items and meeting notes for you:""")
+else:
+    st.write("Upload a meeting recording in mp3, mp4 or m4a format from your local desktop:")
+    direct_upload = st.session_state.get('direct_upload')
+    upload_format = st.selectbox("Format of the recording", BROWSER_UPLOAD_FORMATS)
+    # The multipart upload is created when the user starts one, not on every page view
+    if st.button("Start the upload") or (direct_upload is not None and direct_upload['extension'] != upload_format):
+        if direct_upload is not None:
+            try:
+                abort_browser_upload(get_client('s3'), BUCKET_NAME, direct_upload)
+            except Exception as e:
+                logger.warning('Error aborting the direct upload %s: %s', direct_upload['key'], e)
+        direct_upload = create_browser_upload(get_client('s3'), BUCKET_NAME, KEY, f'recording.{upload_format}',
+                                              concurrency=Config.BROWSER_UPLOAD_CONCURRENCY)
+    elif direct_upload is not None and direct_upload['expires_at'] < time.time() + 300:
+        # New URLs for the same upload, the parts already sent are kept
+        direct_upload = presign_browser_upload(get_client('s3'), BUCKET_NAME, direct_upload)
+    st.session_state.direct_upload = direct_upload
+    if direct_upload is not None:
+        components.html(render_browser_upload(direct_upload), height=110)
+        direct_upload_key = direct_upload['key']
+
+
+# Recordings are shrunk to mono 16 kHz audio without long silences before upload, when ffmpeg is installed
+preprocess_audio = Config.AUDIO_PREPROCESSING and ffmpeg_available()
+audio_options = dict(output_format=Config.AUDIO_OUTPUT_FORMAT, trim=Config.AUDIO_TRIM_SILENCES,
+                     min_silence=Config.AUDIO_MIN_SILENCE_SECONDS, threshold_db=Config.AUDIO_SILENCE_THRESHOLD_DB)
+# Long recordings are cut into segments transcribed in parallel, along with their preprocessing
+split_options = dict(min_seconds=Config.TRANSCRIBE_SPLIT_MIN_SECONDS,
+                     segment_seconds=Config.TRANSCRIBE_SPLIT_SEGMENT_SECONDS,
+                     overlap=Config.TRANSCRIBE_SPLIT_OVERLAP_SECONDS) \
+    if Config.TRANSCRIBE_SPLIT_MIN_SECONDS is not None else None
 
 # check if the file format is not among mp3, mp4 or m4a, then display an error message in a popup window and stop the app
 fileUploaded = False
@@ -70,6 +339,49 @@ if 'user_input_attendees_agenda' not in st.session_state:
 if 'user_input_meeting_notes' not in st.session_state:
     st.session_state.user_input_meeting_notes = ""
 
+if 'transcription_job' not in st.session_state:
+    st.session_state.transcription_job = None
+
+if 'transcript_key' not in st.session_state:
+    st.session_state.transcript_key = None
+
+if 'audio_digest' not in st.session_state:
+    st.session_state.audio_digest = None
+
+if 'media_key' not in st.session_state:
+    st.session_state.media_key = None
+
+if 'transcript' not in st.session_state:
+    st.session_state.transcript = None
+
+if 'meeting_notes' not in st.session_state:
+    st.session_state.meeting_notes = None
+
+if 'compaction' not in st.session_state:
+    st.session_state.compaction = None
+
+# Spans of the meeting being worked on, shown in the timing panel
+if 'trace_id' not in st.session_state:
+    st.session_state.trace_id = new_trace_id()
+
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = st.experimental_get_query_params().get('job', [None])[0]
+    st.session_state.loaded_job_id = None
+    # (job id, result) of the Quip document written for a finished job
+    st.session_state.job_quip_result = None
+
+# Quip client of the access token of this session, dropped with the session
+if 'quip_clients' not in st.session_state:
+    st.session_state.quip_clients = {}
+
+# Stages of the meeting chained in the background, when auto_pipeline is set
+if 'meeting_chain' not in st.session_state:
+    st.session_state.meeting_chain = None
+
+# Inputs of the last review, so that editing the notes or the prompt only regenerates the sections it affects
+if 'review_state' not in st.session_state:
+    st.session_state.review_state = ReviewState()
+
 #define the variables for s3 bucket and key
 bucket_name = BUCKET_NAME
 key = KEY
@@ -81,8 +393,32 @@ user_input_delete_choice = st.checkbox("Do you want to delete uploaded info afte
 if user_input_delete_choice:
     delete_files = True
 
+# Review, and write to Quip, without waiting for the buttons
+auto_pipeline = st.checkbox("Review the notes as soon as the recording is transcribed, and write them to Quip "
+                            "when its token and location are filled in", value=Config.AUTO_PIPELINE)
+
+# Get the shared Bedrock Runtime client in the AWS Region of your choice.
+client = get_client("bedrock-runtime", region_name=REGION_NAME)
+
+# Persistent tier of the model response cache, shared by every task when on S3
+llm_cache = get_response_cache(lambda: make_store(Config.LLM_CACHE_STORE, get_client('s3'), bucket_name,
+                                                  key + 'llm-cache/', Config.LLM_CACHE_DIR),
+                               Config.LLM_CACHE_MAX_ENTRIES, Config.LLM_CACHE_MAX_BYTES, Config.LLM_CACHE_TTL_SECONDS)
+llm_cache_stats = llm_cache.stats()
+st.sidebar.caption(f"Model cache: {llm_cache_stats['memory_hits'] + llm_cache_stats['store_hits']} hits, "
+                   f"{llm_cache_stats['misses']} misses")
+
+# Set the model ID, e.g., Claude 3 Haiku. Answers are not persisted when
+# the user asked to delete the uploaded info.
+llm = Llm(client=client, model_id=MODEL_ID, cache=llm_cache, persist_cache=not delete_files)
+
 if st.button("Submit for Analysis"):
-    if (user_input_meeting_notes == "" and file is None):
+    st.session_state.trace_id = new_trace_id()
+    st.session_state.review_state = ReviewState()
+    if direct_upload_key is not None and not object_exists(get_client('s3'), bucket_name, direct_upload_key):
+        direct_upload_key = None
+
+    if (user_input_meeting_notes == "" and file is None and direct_upload_key is None):
         st.info ("Please upload a meeting recording file, or your meeting notes to proceed...")
         st.stop()
 
@@ -94,13 +430,24 @@ if st.button("Submit for Analysis"):
             file = None
             st.stop()
 
+    chain = start_meeting_chain() if auto_pipeline else None
+    st.session_state.meeting_chain = chain
+
+    if job_store is not None and (file is not None or direct_upload_key is not None):
+        submit_meeting_job(file, direct_upload_key)
+        if direct_upload_key is not None:
+            st.session_state.direct_upload = None
+        # The workers take it from here, the chain only drafts the review
+        file = None
+        direct_upload_key = None
+        chain = None
+
     if file is not None:
         with file:
 
             bucket = f'{bucket_name}'
-            filename = key + conform_to_regex(file.name)
-            
-            s3_client = boto3.client('s3')
+
+            s3_client = get_client('s3')
             #check if file already exists in the bucket
             try:
                 # check if a prefix exists in a bucket
@@ -109,149 +456,297 @@ if st.button("Submit for Analysis"):
                 st.error(f'Error creating key in bucket: {e}')
                 st.stop()
 
-            try:
-                s3_client.head_object(Bucket=bucket, Key=filename)
-                fileUploaded = True
-            except Exception as e:
-                st.info("File does not exist in S3, uploading... "+get_current_time())
-
-            if not fileUploaded:
-                try:
-                    #st.info("Filename being uploaded: " + filename)
-                    s3_client.upload_fileobj(file, bucket, filename)
-                    st.success("File uploaded successfully! "+get_current_time())
-                    fileUploaded = True
-                except Exception as e:
-                    st.error(f'Error uploading file: {e}')
-            else:
-                fileUploaded = True
+            # Recordings are addressed by the hash of their content: a renamed or
+            # re-uploaded recording is neither uploaded nor transcribed again
+            audio_digest = hash_fileobj(file)
+            # Preprocessed recordings are stored as audio only, in the output format
+            filename = media_key(key, audio_digest, f'audio.{audio_options["output_format"]}' if preprocess_audio
+                                 else conform_to_regex(file.name))
+            transcription_key = transcript_key(key, audio_digest)
+            manifest = get_manifest(s3_client, bucket, key)
 
             # check if transcription file is available
+            st.session_state.fileTranscribed = False
             try:
-                s3_client.head_object(Bucket=bucket, Key=f'{filename}.json')
-                #fileTranscribed = True
-                st.session_state.fileTranscribed = True
+                entry = manifest.get(audio_digest)
+                if entry is not None and object_exists(s3_client, bucket, entry['transcript_key']):
+                    filename = entry['media_key']
+                    transcription_key = entry['transcript_key']
+                    st.session_state.fileTranscribed = True
+                    st.info("This recording was already transcribed, reusing its transcription. "+get_current_time())
+                elif object_exists(s3_client, bucket, transcription_key):
+                    # Transcribed by another task, whose manifest entry is not visible here yet
+                    st.session_state.fileTranscribed = True
+                    st.info("This recording was already transcribed, reusing its transcription. "+get_current_time())
             except Exception as e:
-                st.info("Transcription does not exist in S3, transcribing... "+get_current_time())
+                st.error(f'Error reading transcription manifest: {e}')
 
             if not st.session_state.fileTranscribed:
                 try:
-                    if fileUploaded:
-                        date_time = get_current_datetime()
-                        job_name = 'transcribe-media-' + date_time
+                    fileUploaded = object_exists(s3_client, bucket, filename)
+                except Exception as e:
+                    st.error(f'Error checking file in S3: {e}')
+
+                segments = None
+                if not fileUploaded:
+                    upload_source, upload_size, processed_path, segment_files = file, file.size, None, None
+                    if preprocess_audio:
                         try:
-                            transcribe_client = boto3.client('transcribe', region_name='us-east-1')
+                            with st.spinner("Extracting the audio and cutting long silences... "+get_current_time()), \
+                                    span('stage.preprocess', trace_id=st.session_state.trace_id, bytes=file.size):
+                                processed_path, time_map, segment_files = preprocess_fileobj(
+                                    file, '.' + media_extension(file.name), split=split_options, **audio_options)
+                            # Keep the way back to the timeline of the original recording
+                            put_time_map(s3_client, bucket, key, audio_digest, time_map)
+                            upload_source = open(processed_path, 'rb')
+                            upload_size = os.path.getsize(processed_path)
+                            st.info(f"Audio reduced from {file.size / (1024 * 1024):.1f} MB to "
+                                    f"{upload_size / (1024 * 1024):.1f} MB ({time_map.duration / 60:.0f} min kept).")
                         except Exception as e:
-                            st.error(f'Error creating Transcribe client: {e}')
-                            st.stop()
-
-                        # Start transcription job
-                        transcribe_client.start_transcription_job(
-                            TranscriptionJobName=job_name,
-                            Media={'MediaFileUri': f's3://{bucket_name}/{filename}'},
-                            MediaFormat=filename.split('.')[-1],
-                            LanguageCode='en-US',
-                            OutputBucketName=bucket_name,
-                            OutputKey=f'{filename}.json'
-                        )
-                        st.info('Transcription job started. Please wait... '+get_current_time())
-                        # Wait for the transcription job to complete
-                        while True:
-                            status = transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
-                            if status['TranscriptionJob']['TranscriptionJobStatus'] in ['COMPLETED', 'FAILED']:
-                                break
-                            print(f"Waiting for transcription job to complete. Current status: {status['TranscriptionJob']['TranscriptionJobStatus']}")
-                            time.sleep(5)
-
-                        # Check if the transcription job was successful
-                        if status['TranscriptionJob']['TranscriptionJobStatus'] == 'COMPLETED':
-                            st.info('Transcription job completed successfully! '+get_current_time())
-                            output_file_uri = status['TranscriptionJob']['Transcript']['TranscriptFileUri']
-                            st.info(f'Transcription output file: {output_file_uri}')
-                            st.session_state.fileTranscribed = True
-                        else:
-                            st.info('Transcription job failed. '+ get_current_time())
-                            failure_reason = status['TranscriptionJob']['FailureReason']
-                            st.info(f'Failure reason: {failure_reason}')
-                            st.session_state.fileTranscribed = False
-                        #delete transcribe job
-                        transcribe_client.delete_transcription_job(TranscriptionJobName=job_name)
-
+                            st.warning(f'Could not preprocess the audio, uploading the original file: {e}')
+                            filename = media_key(key, audio_digest, conform_to_regex(file.name))
+                    st.info("File does not exist in S3, uploading... "+get_current_time())
+                    try:
+                        upload_progress = st.progress(0.0, text="Uploading...")
+                        uploader = MultipartUploader(s3_client, Config.UPLOAD_PART_SIZE, Config.UPLOAD_MAX_CONCURRENCY,
+                                                     Config.UPLOAD_MAX_BUFFERED_BYTES)
+                        show_progress = lambda done, total: upload_progress.progress(
+                            done / total, text=format_upload_progress(done, total))
+                        with span('stage.upload', trace_id=st.session_state.trace_id):
+                            if segment_files is not None:
+                                segments = upload_segments(uploader, bucket, key, audio_digest, segment_files,
+                                                           on_progress=show_progress)
+                            else:
+                                uploader.upload(upload_source, bucket, filename, upload_size, on_progress=show_progress)
+                        st.success("File uploaded successfully! "+get_current_time())
+                        fileUploaded = True
+                    except Exception as e:
+                        st.error(f'Error uploading file: {e}')
+                    finally:
+                        if processed_path is not None:
+                            upload_source.close()
+                            os.remove(processed_path)
 
-                except Exception as e:
-                    st.error(f'Error uploading file: {e}')
-            else:
-                st.session_state.fileTranscribed = True
-            
-    # capture the transcribed output to a string variable
-    if st.session_state.fileTranscribed:
-        s3_resource = boto3.resource('s3')
-        obj = s3_resource.Object(bucket_name, f'{filename}.json')
-        full_transcription = obj.get()['Body'].read().decode('utf-8')
-        transcribed_text = full_transcription.split('transcripts')[1].split('}')[0].split(':[{"transcript')[1].split(':')[1]
-        st.session_state.user_input_transcription = st.text_area("Transcribed text: ", transcribed_text, height=500)
-
-    st.info("Please proceed to generate notes by hitting 'Review Meeting Notes': ")
+                st.info("Transcription does not exist in S3, transcribing... "+get_current_time())
+                if fileUploaded:
+                    # Record the transcript in the manifest once it is written
+                    job_name = start_transcription(filename, transcription_key, audio_digest,
+                                                   manifest.record_when_completed(audio_digest, filename,
+                                                                                  transcription_key, file.name),
+                                                   segments)
+                    if chain is not None and job_name is not None:
+                        chain_review(chain, audio_digest, filename, transcription_key, job_name)
+                        chain = None
+            elif chain is not None:
+                chain_review(chain, audio_digest, filename, transcription_key)
+                chain = None
+
+            st.session_state.audio_digest = audio_digest
+            st.session_state.media_key = filename
+            st.session_state.transcript_key = transcription_key
+            st.session_state.user_input_transcription = ""
+
+    if direct_upload_key is not None:
+        # The browser uploaded the recording, only its key went through the app
+        st.session_state.fileTranscribed = False
+        st.session_state.audio_digest = None
+        st.session_state.media_key = direct_upload_key
+        st.session_state.transcript_key = direct_upload_key + '.json'
+        st.session_state.user_input_transcription = ""
+        # The content is not hashed on this path, the key of the upload stands for it
+        job_name = start_transcription(direct_upload_key, direct_upload_key + '.json',
+                                       hashlib.sha256(direct_upload_key.encode('utf-8')).hexdigest())
+        if chain is not None and job_name is not None:
+            chain_review(chain, None, direct_upload_key, direct_upload_key + '.json', job_name)
+            chain = None
+        # The next recording gets a new upload
+        st.session_state.direct_upload = None
+
+    if chain is not None and file is None and direct_upload_key is None:
+        # Meeting notes only: the draft is the review
+        chain_review(chain)
+
+    if st.session_state.meeting_chain is not None:
+        st.info("The notes will be reviewed as soon as they are ready, and written to Quip if its token and "
+                "location are filled in.")
+    elif st.session_state.job_id is None:
+        st.info("Please proceed to generate notes by hitting 'Review Meeting Notes': ")
     
-# Create a Bedrock Runtime client in the AWS Region of your choice.
-client = boto3.client("bedrock-runtime", region_name="us-east-1")
-# Set the model ID, e.g., Claude 3 Haiku.
-model_id = "anthropic.claude-3-haiku-20240307-v1:0"
-
-user_input_prompt = st.text_area("Please modify your prompt based on your needs:", USER_PROMPT)
+# Read the state of the running transcription job, the tracker owns the polling
+if st.session_state.transcription_job:
+    tracker = transcription_tracker()
+    job = tracker.get(st.session_state.transcription_job)
+    if job is None and st.session_state.transcript_key:
+        # Unknown to this process (restarted, or the finished job was pruned): the
+        # transcript may already be written, else follow the job from now on
+        if object_exists(get_client('s3'), BUCKET_NAME, st.session_state.transcript_key):
+            job = {'status': 'COMPLETED', 'transcript_uri': None, 'output_key': st.session_state.transcript_key}
+        else:
+            job = tracker.track(st.session_state.transcription_job, st.session_state.transcript_key)
+    if job is None or job['status'] not in TERMINAL_STATUSES:
+        st.info('Transcription in progress, you can keep editing your notes. ' + get_current_time())
+        st.button('Refresh transcription status')
+    elif job['status'] == 'COMPLETED':
+        st.info('Transcription job completed successfully! '+get_current_time())
+        # Completion events carry no URI, the output key of the job is known
+        transcript_uri = job['transcript_uri'] or f"s3://{BUCKET_NAME}/{job['output_key']}"
+        st.info(f"Transcription output file: {transcript_uri}")
+        st.session_state.fileTranscribed = True
+        st.session_state.transcription_job = None
+    else:
+        st.info('Transcription job failed. '+ get_current_time())
+        st.info(f"Failure reason: {job['failure_reason']}")
+        st.session_state.fileTranscribed = False
+        st.session_state.transcription_job = None
+
+# Follow the meeting job, the workers own the processing
+if st.session_state.job_id and job_store is not None:
+    meeting_job = job_store.get(st.session_state.job_id)
+    if meeting_job is None:
+        st.info('This meeting is no longer available.')
+        st.session_state.job_id = None
+    elif meeting_job['status'] not in FINAL_STATUSES:
+        stage = meeting_job['stage'] or 'waiting'
+        attempt = f" (attempt {meeting_job['attempts']})" if meeting_job['attempts'] > 1 else ""
+        st.info(f"Meeting in progress, last completed step: {stage}{attempt}. You can close this page and "
+                f"come back to this URL later. " + get_current_time())
+        st.button('Refresh meeting status')
+    elif meeting_job['status'] == SUCCEEDED:
+        meeting_state = meeting_job['state']
+        if st.session_state.loaded_job_id != meeting_job['id']:
+            st.session_state.loaded_job_id = meeting_job['id']
+            st.session_state.fileTranscribed = True
+            st.session_state.user_input_transcription = meeting_state['transcription']
+            st.session_state.compaction = CompactionStats.from_dict(meeting_state['compaction']) \
+                if meeting_state.get('compaction') else None
+            st.session_state.llm_review_response = meeting_state['review']
+            try:
+                st.session_state.meeting_notes = parse_review(meeting_state['review'])
+            except NotesFormatError:
+                st.session_state.meeting_notes = None
+            # The workers already deleted the files when asked to
+            st.session_state.audio_digest = None
+            st.session_state.media_key = None
+            st.session_state.transcript_key = None
+            # The review replaces the draft of the notes
+            st.session_state.meeting_chain = None
+            st.session_state.review_state.record(meeting_state['transcription'], meeting_state['user_prompt'],
+                                                 meeting_state.get('attendees_agenda', ''),
+                                                 meeting_state.get('meeting_notes', ''), meeting_state['review'])
+        st.info(meeting_state['review'])
+        quip = meeting_state.get('quip')
+        quip_token = st.session_state.get("QuipToken", "")
+        if quip and quip_token and (st.session_state.job_quip_result or (None,))[0] != meeting_job['id']:
+            # Jobs do not keep the access token, the notes are written with the one of this session
+            with span('stage.quip', trace_id=meeting_job['id']):
+                result = write_to_quip(quip_token, quip.get('doc_name', ''),
+                                       quip_html(llm, meeting_state['review'], meeting_state['user_prompt']),
+                                       quip['location'], st.session_state.quip_clients)
+            st.session_state.job_quip_result = (meeting_job['id'], result)
+        if (st.session_state.job_quip_result or (None,))[0] == meeting_job['id']:
+            st.info(st.session_state.job_quip_result[1])
+        elif quip:
+            st.info("Fill in the Quip access token to write the notes to Quip.")
+    else:
+        st.error(f"Processing the meeting failed after {meeting_job['attempts']} attempts: {meeting_job['error']}")
+
+# Pick up what the chained stages produced since the last run
+chain_state = None
+if st.session_state.meeting_chain is not None:
+    chain_state = st.session_state.meeting_chain.snapshot()
+    if chain_state['transcription'] and not st.session_state.user_input_transcription:
+        st.session_state.fileTranscribed = True
+        st.session_state.user_input_transcription = chain_state['transcription']
+        st.session_state.compaction = chain_state['compaction']
+    if chain_state['review'] is not None and st.session_state.llm_review_response != chain_state['review'].text:
+        st.session_state.llm_review_response = chain_state['review'].text
+        try:
+            st.session_state.meeting_notes = parse_review(chain_state['review'].text)
+        except NotesFormatError:
+            st.session_state.meeting_notes = None
+# The chain is reading the transcript, no need to read it twice
+chain_reading = chain_state is not None and chain_state['stage'] == 'transcribe'
+
+# capture the transcribed output to a string variable
+if st.session_state.fileTranscribed and not chain_reading and \
+        (st.session_state.transcript_key or st.session_state.user_input_transcription):
+    if st.session_state.user_input_transcription == "":
+        # Parse the transcript as it streams from S3 into a compact segment model
+        # Times of a preprocessed recording are mapped back to the original one
+        with span('stage.read_transcript', trace_id=st.session_state.trace_id):
+            time_map = get_time_map(get_client('s3'), bucket_name, key, st.session_state.audio_digest)
+            st.session_state.transcript = read_transcript(get_client('s3'), bucket_name,
+                                                          st.session_state.transcript_key, time_map)
+        if Config.TRANSCRIPT_COMPACTION:
+            # Fillers, repetitions and crosstalk cost prompt tokens without adding content
+            with span('stage.compaction', trace_id=st.session_state.trace_id) as compaction_span:
+                st.session_state.user_input_transcription, st.session_state.compaction = compact_transcript(
+                    st.session_state.transcript, Config.COMPACTION_MIN_CONFIDENCE)
+                compaction_span.set(**st.session_state.compaction.to_dict())
+        else:
+            st.session_state.user_input_transcription = st.session_state.transcript.format_segments()
+            st.session_state.compaction = None
+    st.session_state.user_input_transcription = st.text_area("Transcribed text: ", st.session_state.user_input_transcription, height=500)
+    if st.session_state.compaction is not None:
+        st.caption(f"Compacted transcript: {st.session_state.compaction}")
+
+# Draft, then review, of the chained meeting, updated below while the chain runs
+if chain_state is not None:
+    show_meeting_chain((st.empty(), st.empty()), chain_state)
+    if chain_state['review'] is not None:
+        st.caption(format_llm_timings(chain_state['review']))
+        if st.session_state.meeting_notes is not None:
+            st.download_button("Download notes (Markdown)", render_markdown(st.session_state.meeting_notes),
+                               file_name="meeting-notes.md", mime="text/markdown")
+
+user_input_prompt = st.text_area("Please modify your prompt based on your needs:", USER_PROMPT, key="UserPrompt")
     
 if st.button('Review Meeting Notes'):
     # Re-validate inputs
-    if (user_input_meeting_notes == "" and file is None):
+    if (user_input_meeting_notes == "" and file is None and st.session_state.media_key is None
+            and not st.session_state.fileTranscribed):
         st.info ("Please upload a meeting recording file, or your meeting notes to proceed...")
         st.stop()
     if (not st.session_state.fileTranscribed and user_input_meeting_notes == ""):
         st.info ("Please 'Submit Analysis' first...")
         st.stop()
 
-    # Define the prompt for the model.
-    prompt_review = SYSTEM_PROMPT_REVIEW + "\n" + TEMPLATE_FORMAT + "\n" + EXAMPLE_REVIEW + "\n" + user_input_prompt +": \n"  \
-                    + user_input_attendees_agenda +"\n" + st.session_state.user_input_transcription +"\n" + user_input_meeting_notes
-    
-    # Format the request payload using the model's native structure.
-    request_review = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 10000,
-        "temperature": 0,
-        "messages": [
-            {
-                "role": "user",
-                "content": [{"type": "text", "text": prompt_review}],
-            }
-        ],
-    }
-
-    # Convert the native request to JSON.
-    request_review = json.dumps(request_review)
-
     try:
-        # Invoke the model with the request.
-        response_review = client.invoke_model(modelId = model_id, body = request_review)
+        review_placeholder = st.empty()
+        # Stream partial text into the page as it arrives.
+        on_review_text = review_placeholder.info if Config.LLM_STREAMING else None
+        if len(st.session_state.user_input_transcription) > Config.MAP_REDUCE_THRESHOLD_CHARS:
+            # Long meetings are summarized chunk by chunk in parallel, then merged
+            st.info("Long transcription, summarizing it in parallel parts... " + get_current_time())
+        with span('stage.summarize', trace_id=st.session_state.trace_id):
+            llm_response_review = generate_review(llm, st.session_state.user_input_transcription, user_input_prompt,
+                                                  user_input_attendees_agenda, user_input_meeting_notes,
+                                                  on_text=on_review_text,
+                                                  map_reduce_threshold=Config.MAP_REDUCE_THRESHOLD_CHARS,
+                                                  max_workers=Config.MAP_REDUCE_MAX_WORKERS,
+                                                  parallel_sections=Config.PARALLEL_SECTIONS,
+                                                  state=st.session_state.review_state)
+        review_placeholder.info(llm_response_review.text)
 
     except Exception as e:
         st.error(f'Error summarizing transcript: {e}')
         st.stop()
 
-    # Decode the response body.
-    model_response_review = json.loads(response_review["body"].read())
-
-    # Extract and print the response text.
-    response_text_review = model_response_review["content"][0]["text"]
-    st.info(response_text_review)
-    st.session_state.llm_review_response = response_text_review
+    st.caption(format_llm_timings(llm_response_review))
+    st.session_state.llm_review_response = llm_response_review.text
+    # Keep the notes structured, so they can be rendered without another model call
+    try:
+        st.session_state.meeting_notes = parse_review(llm_response_review.text)
+        st.download_button("Download notes (Markdown)", render_markdown(st.session_state.meeting_notes),
+                           file_name="meeting-notes.md", mime="text/markdown")
+    except NotesFormatError:
+        st.session_state.meeting_notes = None
 
     # Clear up all customer data
-    if (delete_files and file is not None):
+    if (delete_files and st.session_state.media_key):
         try:
-            s3_resource = boto3.resource('s3')
-            filename = key + conform_to_regex(file.name)
-            s3_resource.Object(bucket_name, f'{filename}.json').delete()
-            s3_resource.Object(bucket_name, f'{filename}').delete()
+            delete_recording(get_client('s3'), bucket_name, key, st.session_state.audio_digest,
+                             st.session_state.media_key, st.session_state.transcript_key, transcription_tracker())
         except Exception as e:
             st.error(f'Error deleting files from S3: {e}')
 
@@ -266,7 +761,8 @@ user_input_quip_doc_name = st.text_input("Enter your Quip document name: ", key=
 
 if st.button('Write Notes To Quip'):
     # Re-validate inputs
-    if (user_input_meeting_notes == "" and file is None):
+    if (user_input_meeting_notes == "" and file is None and st.session_state.media_key is None
+            and not st.session_state.fileTranscribed):
         st.info ("Please upload a meeting recording file, or your meeting notes to proceed...")
         st.stop()
     if (not st.session_state.fileTranscribed and user_input_meeting_notes == ""):
@@ -280,39 +776,33 @@ if st.button('Write Notes To Quip'):
         st.stop()
 
     st.info("Writing to quip... " + get_current_time())
-    # Define the prompt for the model.
-    prompt_quip = SYSTEM_PROMPT_HTML + "\n" + TEMPLATE_FORMAT + "\n" + EXAMPLE_HTML + "\n" + user_input_prompt +": \n"  \
-                    + st.session_state.llm_review_response
-    # Format the request payload using the model's native structure.
-    request_quip = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 10000,
-        "temperature": 0,
-        "messages": [
-            {
-                "role": "user",
-                "content": [{"type": "text", "text": prompt_quip}],
-            }
-        ],
-    }
-
-    # Convert the native request to JSON.
-    request_quip = json.dumps(request_quip)
-
-    try:
-        # Invoke the model with the request.
-        response_quip = client.invoke_model(modelId = model_id, body = request_quip)
-
-    except Exception as e:
-        st.error(f'Error summarizing transcript: {e}')
-        st.stop()
+    if st.session_state.meeting_notes is not None:
+        # Render the HTML locally from the structured notes
+        render_start = time.perf_counter()
+        with span('stage.quip_render', trace_id=st.session_state.trace_id):
+            response_text_quip = render_html(st.session_state.meeting_notes)
+        with st.expander("Quip document preview"):
+            st.code(response_text_quip, language="html")
+        st.caption(f"Rendered locally in {(time.perf_counter() - render_start) * 1000:.1f}ms")
+    else:
+        # The review did not follow the template, let the model reformat it.
+        prompt_quip = HTML_PROMPT_PREFIX + user_input_prompt + ": \n" + st.session_state.llm_review_response
+        try:
+            # Invoke the model, streaming the HTML into a preview as it arrives.
+            with span('stage.quip_render', trace_id=st.session_state.trace_id):
+                if Config.LLM_STREAMING:
+                    with st.expander("Quip document preview"):
+                        quip_placeholder = st.empty()
+                    llm_response_quip = llm.generate_stream(prompt_quip, lambda text: quip_placeholder.code(text, language="html"))
+                else:
+                    llm_response_quip = llm.generate(prompt_quip)
 
-    # Decode the response body.
-    model_response_quip = json.loads(response_quip["body"].read())
+        except Exception as e:
+            st.error(f'Error summarizing transcript: {e}')
+            st.stop()
 
-    # Extract and print the response text.
-    response_text_quip = model_response_quip["content"][0]["text"]
-    #st.info(response_text_review)
+        st.caption(format_llm_timings(llm_response_quip))
+        response_text_quip = llm_response_quip.text
 
     #Save the output to a quip document
     quip_token = user_input_quip_accesstoken
@@ -321,18 +811,62 @@ if st.button('Write Notes To Quip'):
 
     try:
         # Call function to write LLM response to quip
-        result = write_to_quip(quip_token, quip_doc_name, response_text_quip, quip_location)
+        with span('stage.quip', trace_id=st.session_state.trace_id):
+            result = write_to_quip(quip_token, quip_doc_name, response_text_quip, quip_location,
+                                   st.session_state.quip_clients)
         # Show results from the function
         st.info(result)
         st.info(get_current_time())
     except Exception as e:
-        print(e)
+        logger.warning('Error writing to Quip: %s', e)
+        st.error(f'Error writing to Quip: {e}')
     
 #create a button to clear everything
 if st.button('Clear Meeting Info'):
     st.session_state.fileUploaded = False
     st.session_state.fileTranscribed = False
+    st.session_state.transcription_job = None
+    st.session_state.transcript_key = None
+    st.session_state.audio_digest = None
+    st.session_state.media_key = None
+    st.session_state.transcript = None
+    st.session_state.meeting_notes = None
+    st.session_state.compaction = None
+    st.session_state.meeting_chain = None
+    chain_state = None
+    if st.session_state.get('direct_upload') is not None:
+        try:
+            abort_browser_upload(get_client('s3'), BUCKET_NAME, st.session_state.direct_upload)
+        except Exception as e:
+            logger.warning('Error aborting the direct upload: %s', e)
+        st.session_state.direct_upload = None
+    st.session_state.review_state = ReviewState()
+    st.session_state.trace_id = new_trace_id()
+    st.session_state.job_id = None
+    st.experimental_set_query_params()
     st.session_state.user_input_transcription = ""
     st.session_state.user_input_meeting_notes = ""
     st.session_state.user_input_attendees_agenda = ""
-    file = None
\ No newline at end of file
+    file = None
+
+# Timings of the current meeting and of the whole process, for the admins
+if authenticator.get_username() in Config.ADMIN_USERS:
+    with st.sidebar.expander("Timings"):
+        if st.session_state.job_id:
+            st.caption(f"Processed by the workers, their spans are logged with trace_id {st.session_state.job_id}")
+        spans = get_telemetry().trace(st.session_state.trace_id)
+        if spans:
+            st.dataframe([{'span': s['name'], 'seconds': round(s['duration'], 3),
+                           **{name: s.get(name) for name in ('bytes', 'input_tokens', 'output_tokens', 'retries', 'error')}}
+                          for s in spans], hide_index=True)
+        st.caption("All sessions of this server")
+        st.dataframe(get_telemetry().stage_summary(), hide_index=True)
+
+# Follow the chained stages until they are done or failed, waiting for the
+# transcript too: each run shows one snapshot and ends, and a timer in the
+# browser clicks the refresh button for the next one, so no script thread
+# waits in between
+if chain_state is not None and chain_state['running']:
+    refresh_label = 'Refresh the meeting progress'
+    st.button(refresh_label)
+    components.html(render_rerun_timer(refresh_label, Config.CHAIN_REFRESH_SECONDS, time.time()), height=0)
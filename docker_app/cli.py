@@ -0,0 +1,263 @@
+"""
+Command-line entry point of the meeting summarizer.
+
+Summarize every recording of a local directory or of an S3 prefix, without
+the web page, and write one Markdown file of notes per recording:
+
+    python cli.py batch ./recordings --output ./notes
+    python cli.py batch s3://my-bucket/recordings/ --output ./notes --transcribe-concurrency 50
+
+Run the workers of the job queue the page submits meetings to:
+
+    python cli.py worker --processes 2 --threads 4
+
+Take notes of a meeting while it happens, from 16 kHz mono 16-bit PCM on
+stdin, or from a recording played at its real pace:
+
+    ffmpeg -f pulse -i default -ac 1 -ar 16000 -f s16le - | python cli.py live - --output notes.md
+    python cli.py live meeting.mp4 --realtime --output notes.md
+
+Run it from this folder, with the same AWS credentials as the app.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from utils.audio import SAMPLE_RATE, ffmpeg_available, iter_pcm
+from utils.clients import get_client, REGION_NAME
+from utils.cache import get_response_cache, make_store
+from utils.llm import Llm, MODEL_ID
+from utils.jobs import JobWorker, get_job_store
+from utils.live import BYTES_PER_SAMPLE, CHUNK_SECONDS, LiveMeeting, RollingSummary, make_transcriber
+from utils.notes import NotesFormatError, parse_review, render_markdown
+from utils.telemetry import configure_logging, start_metrics_server
+from utils.pipeline import (MeetingPipeline, format_report, list_local_recordings, list_s3_recordings,
+                            run_meeting_job, UPLOAD_CONCURRENCY, TRANSCRIBE_CONCURRENCY, SUMMARIZE_CONCURRENCY)
+from utils.streamlitutils import BUCKET_NAME, KEY, USER_PROMPT
+from utils.transcription import get_tracker
+from utils.upload import MultipartUploader
+from config_file import Config
+
+
+def make_llm(delete_files):
+    cache = get_response_cache(lambda: make_store(Config.LLM_CACHE_STORE, get_client('s3'), BUCKET_NAME,
+                                                  KEY + 'llm-cache/', Config.LLM_CACHE_DIR),
+                               Config.LLM_CACHE_MAX_ENTRIES, Config.LLM_CACHE_MAX_BYTES, Config.LLM_CACHE_TTL_SECONDS)
+    return Llm(client=get_client('bedrock-runtime', region_name=REGION_NAME), model_id=MODEL_ID, cache=cache,
+               persist_cache=not delete_files)
+
+
+def audio_options():
+    # Recordings are shrunk before upload when ffmpeg is installed
+    if not (Config.AUDIO_PREPROCESSING and ffmpeg_available()):
+        return None
+    return dict(output_format=Config.AUDIO_OUTPUT_FORMAT, trim=Config.AUDIO_TRIM_SILENCES,
+                min_silence=Config.AUDIO_MIN_SILENCE_SECONDS, threshold_db=Config.AUDIO_SILENCE_THRESHOLD_DB)
+
+
+def split_options():
+    # Long recordings are cut from their preprocessed audio
+    if Config.TRANSCRIBE_SPLIT_MIN_SECONDS is None or audio_options() is None:
+        return None
+    return dict(min_seconds=Config.TRANSCRIBE_SPLIT_MIN_SECONDS,
+                segment_seconds=Config.TRANSCRIBE_SPLIT_SEGMENT_SECONDS,
+                overlap=Config.TRANSCRIBE_SPLIT_OVERLAP_SECONDS)
+
+
+def compaction_options():
+    if not Config.TRANSCRIPT_COMPACTION:
+        return None
+    return dict(min_confidence=Config.COMPACTION_MIN_CONFIDENCE)
+
+
+def list_recordings(source):
+    if source.startswith('s3://'):
+        bucket, _, prefix = source[len('s3://'):].partition('/')
+        return list_s3_recordings(get_client('s3'), bucket, prefix)
+    if not os.path.isdir(source):
+        raise SystemExit(f'{source} is neither a directory nor an s3:// prefix')
+    return list_local_recordings(source)
+
+
+def batch(args):
+    recordings = list_recordings(args.source)
+    if args.skip_existing:
+        recordings = [recording for recording in recordings
+                      if not os.path.exists(os.path.join(args.output, os.path.splitext(recording.name)[0] + '.md'))]
+    if not recordings:
+        print('No recordings to summarize')
+        return 0
+    print(f'Summarizing {len(recordings)} recordings...')
+
+    s3_client = get_client('s3')
+    pipeline = MeetingPipeline(
+        s3_client, make_llm(args.delete), get_tracker(region_name=REGION_NAME), BUCKET_NAME, KEY, args.output,
+        user_prompt=args.prompt,
+        upload_concurrency=args.upload_concurrency,
+        transcribe_concurrency=args.transcribe_concurrency,
+        summarize_concurrency=args.summarize_concurrency,
+        uploader=MultipartUploader(s3_client, Config.UPLOAD_PART_SIZE, Config.UPLOAD_MAX_CONCURRENCY,
+                                   Config.UPLOAD_MAX_BUFFERED_BYTES),
+        delete_files=args.delete,
+        max_speakers=Config.TRANSCRIBE_MAX_SPEAKERS,
+        map_reduce_threshold=Config.MAP_REDUCE_THRESHOLD_CHARS,
+        parallel_sections=Config.PARALLEL_SECTIONS,
+        audio_options=audio_options(),
+        compaction_options=compaction_options(),
+        split_options=split_options(),
+    )
+
+    def on_result(result):
+        status = result.output_path if result.error is None else f'FAILED: {result.error}'
+        print(f'{result.recording.name}: {status}', flush=True)
+
+    start = time.perf_counter()
+    results = pipeline.run(recordings, on_result)
+    print()
+    print(format_report(results, pipeline.stats, time.perf_counter() - start))
+    return 0 if all(result.error is None for result in results) else 1
+
+
+def run_worker_process(queue_url, threads, metrics_port=None):
+    # Spawned processes start without the logging setup of their parent
+    configure_logging(Config.LOG_LEVEL, Config.LOG_JSON)
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    s3_client = get_client('s3')
+    # Uploaded files are deleted by the job when asked, the cache is kept either way
+    pipeline = MeetingPipeline(
+        s3_client, make_llm(delete_files=False), get_tracker(region_name=REGION_NAME), BUCKET_NAME, KEY, None,
+        uploader=MultipartUploader(s3_client, Config.UPLOAD_PART_SIZE, Config.UPLOAD_MAX_CONCURRENCY,
+                                   Config.UPLOAD_MAX_BUFFERED_BYTES),
+        max_speakers=Config.TRANSCRIBE_MAX_SPEAKERS,
+        map_reduce_threshold=Config.MAP_REDUCE_THRESHOLD_CHARS,
+        parallel_sections=Config.PARALLEL_SECTIONS,
+        audio_options=audio_options(),
+        compaction_options=compaction_options(),
+        split_options=split_options(),
+    )
+    handlers = {'meeting': lambda state, checkpoint: run_meeting_job(pipeline, state, checkpoint)}
+    store = get_job_store(queue_url)
+    workers = [threading.Thread(target=JobWorker(store, handlers).run_forever, daemon=True) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def worker(args):
+    if not args.queue:
+        raise SystemExit('No job queue configured, set JOB_QUEUE_URL in config_file.py or pass --queue')
+    processes = {}
+    # Restart the worker processes that die, jobs they were running are retried once their lease expires
+    while True:
+        for index in range(args.processes):
+            process = processes.get(index)
+            if process is None or not process.is_alive():
+                if process is not None:
+                    logging.warning('Worker process %s exited with code %s, restarting it', index, process.exitcode)
+                # Spawned rather than forked, so that no client, lock or connection is inherited
+                metrics_port = args.metrics_port + 1 + index if args.metrics_port else None
+                process = multiprocessing.get_context('spawn').Process(
+                    target=run_worker_process, args=(args.queue, args.threads, metrics_port), name=f'worker-{index}',
+                    daemon=True)
+                process.start()
+                processes[index] = process
+        time.sleep(5)
+
+
+def live(args):
+    transcriber = make_transcriber(Config.LIVE_TRANSCRIBER)
+    # Every update is a new request, not worth keeping in the shared cache
+    summary = RollingSummary(make_llm(delete_files=True), user_prompt=args.prompt,
+                             attendees_agenda=args.agenda or '', meeting_notes=args.notes or '')
+
+    def on_notes(notes):
+        print(f'--- Notes at {time.strftime("%H:%M:%S")} ---\n{notes}\n', flush=True)
+
+    meeting = LiveMeeting(transcriber, summary, interval=args.interval,
+                          min_delta_chars=Config.LIVE_SUMMARY_MIN_DELTA_CHARS, on_notes=on_notes)
+    chunk_bytes = int(SAMPLE_RATE * CHUNK_SECONDS) * BYTES_PER_SAMPLE
+    if args.source == '-':
+        chunks = iter(lambda: sys.stdin.buffer.read(chunk_bytes), b'')
+    else:
+        chunks = iter_pcm(args.source, chunk_bytes=chunk_bytes, realtime=args.realtime)
+    meeting.start()
+    print('Listening, end the audio or press Ctrl-C when the meeting is over...', flush=True)
+    try:
+        for chunk in chunks:
+            meeting.send(chunk)
+    except KeyboardInterrupt:
+        pass
+    notes = meeting.end()
+    try:
+        content = render_markdown(parse_review(notes))
+    except NotesFormatError:
+        content = notes
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write(content)
+    if args.transcript:
+        with open(args.transcript, 'w', encoding='utf-8') as f:
+            f.write(summary.transcription() + '\n')
+    print(f'--- Final notes ({summary.updates} updates), written to {args.output} ---\n{notes}')
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    batch_parser = commands.add_parser('batch', help='Summarize a directory or S3 prefix of recordings')
+    batch_parser.add_argument('source', help='Local directory, or s3://bucket/prefix')
+    batch_parser.add_argument('--output', required=True, help='Directory receiving the notes')
+    batch_parser.add_argument('--prompt', default=USER_PROMPT, help='Instructions given to the model')
+    batch_parser.add_argument('--upload-concurrency', type=int, default=UPLOAD_CONCURRENCY,
+                              help='Recordings uploaded at once')
+    batch_parser.add_argument('--transcribe-concurrency', type=int, default=TRANSCRIBE_CONCURRENCY,
+                              help='Transcribe jobs running at once')
+    batch_parser.add_argument('--summarize-concurrency', type=int, default=SUMMARIZE_CONCURRENCY,
+                              help='Recordings summarized at once')
+    batch_parser.add_argument('--delete', action='store_true',
+                              help='Delete the uploaded recordings and transcripts once summarized')
+    batch_parser.add_argument('--skip-existing', action='store_true',
+                              help='Skip the recordings that already have notes in the output directory')
+    batch_parser.set_defaults(func=batch)
+
+    worker_parser = commands.add_parser('worker', help='Run the workers of the job queue')
+    worker_parser.add_argument('--queue', default=Config.JOB_QUEUE_URL, help='URL of the job queue')
+    worker_parser.add_argument('--processes', type=int, default=Config.JOB_WORKER_PROCESSES,
+                               help='Worker processes')
+    worker_parser.add_argument('--threads', type=int, default=Config.JOB_WORKER_THREADS,
+                               help='Jobs run at once by each process')
+    worker_parser.add_argument('--metrics-port', type=int, default=Config.METRICS_PORT,
+                               help='Worker process N serves its metrics on this port + 1 + N')
+    worker_parser.set_defaults(func=worker)
+
+    live_parser = commands.add_parser('live', help='Take the notes of a meeting while it happens')
+    live_parser.add_argument('source', help='Media file or stream read by ffmpeg, or - for raw PCM on stdin')
+    live_parser.add_argument('--output', required=True, help='Markdown file receiving the final notes')
+    live_parser.add_argument('--transcript', help='Text file receiving the transcript')
+    live_parser.add_argument('--prompt', default=USER_PROMPT, help='Instructions given to the model')
+    live_parser.add_argument('--agenda', help='Invitees, subject and agenda of the meeting')
+    live_parser.add_argument('--notes', help='Notes taken during the meeting')
+    live_parser.add_argument('--interval', type=float, default=Config.LIVE_SUMMARY_INTERVAL_SECONDS,
+                             help='Seconds between two updates of the notes')
+    live_parser.add_argument('--realtime', action='store_true',
+                             help='Read the source at the pace it plays at, e.g. to replay a recording')
+    live_parser.set_defaults(func=live)
+
+    args = parser.parse_args(argv)
+    if args.command == 'worker':
+        configure_logging(Config.LOG_LEVEL, Config.LOG_JSON)
+    else:
+        # The batch report goes to stdout, only problems are logged
+        logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,6 +13,134 @@ class Config:
     # to recreate it with the same STACK_NAME.
     SECRETS_MANAGER_ID = f"{STACK_NAME}ParamCognitoSecret12345"
 
+    # Seconds the Cognito secret is cached in memory. A rotated secret is
+    # picked up at most this long after the rotation.
+    SECRET_CACHE_TTL_SECONDS = 300
+
     # S3 Bucket name
     # Change this value if you want to create a new instance of the stack
-    S3_BUCKET_NAME = f"{STACK_NAME.lower()}-meeting-summarizer"
\ No newline at end of file
+    S3_BUCKET_NAME = f"{STACK_NAME.lower()}-meeting-summarizer"
+
+    # URL of an SQS queue receiving EventBridge "Transcribe Job State Change"
+    # events. When set, transcription jobs resolve on the event instead of
+    # waiting for the next poll. Leave to None to rely on polling only.
+    TRANSCRIBE_EVENTS_QUEUE_URL = None
+
+    # Stream Bedrock output into the page token by token. Set to False to
+    # wait for the full answer with a single invoke_model call.
+    LLM_STREAMING = True
+
+    # Transcriptions longer than this number of characters are split into
+    # overlapping chunks summarized in parallel, then merged by a final call.
+    MAP_REDUCE_THRESHOLD_CHARS = 40000
+    MAP_REDUCE_MAX_WORKERS = 4
+
+    # Generate each section of the notes (agenda, action items...) with its
+    # own prompt and token budget, MAP_REDUCE_MAX_WORKERS sections at once:
+    # the notes take about as long as their longest sections instead of the
+    # sum of them, but every section sends the transcript again, for about
+    # six times the input tokens of a single call.
+    PARALLEL_SECTIONS = False
+
+    # Default of the page option chaining the stages of a meeting processed
+    # in the page: the typed notes are drafted into a review at once, the
+    # recording is reviewed as soon as its transcription completes, and the
+    # notes are written to Quip when its token and location are filled in.
+    AUTO_PIPELINE = True
+    # The page shows the progress of the chained stages every this many seconds
+    CHAIN_REFRESH_SECONDS = 1.0
+
+    # Live meetings ("python cli.py live"): the audio is transcribed as it is
+    # captured by a streaming transcriber ("aws" for Amazon Transcribe
+    # streaming, others can be registered in utils/live.py), and the notes are
+    # updated every LIVE_SUMMARY_INTERVAL_SECONDS from what was said since the
+    # previous update, once that is at least LIVE_SUMMARY_MIN_DELTA_CHARS long.
+    LIVE_TRANSCRIBER = "aws"
+    LIVE_SUMMARY_INTERVAL_SECONDS = 30
+    LIVE_SUMMARY_MIN_DELTA_CHARS = 300
+
+    # Cache of deterministic model answers, keyed by a hash of the model id
+    # and the full request. The in-process LRU is backed by a persistent tier
+    # shared across tasks: "s3" (prefix next to the recordings), "disk"
+    # (LLM_CACHE_DIR) or None for memory only.
+    LLM_CACHE_STORE = "s3"
+    LLM_CACHE_DIR = "/tmp/llm-cache"
+    LLM_CACHE_MAX_ENTRIES = 256
+    LLM_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    LLM_CACHE_TTL_SECONDS = 24 * 3600
+
+    # Multipart upload of recordings: part size, parts sent in parallel, and
+    # hard cap on the part data a session holds in memory while uploading.
+    UPLOAD_PART_SIZE = 16 * 1024 * 1024
+    UPLOAD_MAX_CONCURRENCY = 8
+    UPLOAD_MAX_BUFFERED_BYTES = 64 * 1024 * 1024
+
+    # Let the browser upload recordings straight to S3 through presigned
+    # multipart URLs, so large files never go through the container memory.
+    # The bucket CORS rule allows the CloudFront domain, add the origins used
+    # for local development (e.g. "http://localhost:8080") to the list.
+    BROWSER_UPLOAD_ENABLED = True
+    BROWSER_UPLOAD_CONCURRENCY = 4
+    BROWSER_UPLOAD_EXTRA_ORIGINS = []
+
+    # Maximum number of speakers Transcribe distinguishes in a recording
+    TRANSCRIBE_MAX_SPEAKERS = 10
+
+    # Persistent queue of the meetings submitted by the page, run by worker
+    # processes so that they survive a closed tab, e.g.
+    # "sqlite:///tmp/meeting-summarizer/jobs.db". SQLite keeps the queue on
+    # the storage of the task: use it with a single web task only. Several
+    # tasks need a shared backend, registered in utils/jobs.py. None
+    # processes meetings inside the page.
+    JOB_QUEUE_URL = None
+
+    # Directory where the page leaves uploaded recordings for the workers
+    JOB_SPOOL_DIR = "/tmp/meeting-summarizer/spool"
+
+    # Start the workers from the web server when JOB_QUEUE_URL is set. Set to
+    # False when they run in their own container ("python cli.py worker").
+    JOB_START_WORKERS = True
+    JOB_WORKER_PROCESSES = 2
+    JOB_WORKER_THREADS = 4
+
+    # Attempts of a job before it is reported as failed
+    JOB_MAX_ATTEMPTS = 3
+
+    # Shrink recordings before upload when ffmpeg is installed: keep the
+    # audio track only, mono, 16 kHz, and cut the silences longer than
+    # AUDIO_MIN_SILENCE_SECONDS. Transcript times are mapped back to the
+    # original recording. AUDIO_OUTPUT_FORMAT is "flac" (lossless) or "ogg"
+    # (Opus, about 5 times smaller).
+    AUDIO_PREPROCESSING = True
+    AUDIO_OUTPUT_FORMAT = "flac"
+    AUDIO_TRIM_SILENCES = True
+    AUDIO_MIN_SILENCE_SECONDS = 2.0
+    AUDIO_SILENCE_THRESHOLD_DB = -45.0
+
+    # Recordings lasting more than TRANSCRIBE_SPLIT_MIN_SECONDS once
+    # preprocessed are cut at silences into segments of about
+    # TRANSCRIBE_SPLIT_SEGMENT_SECONDS, overlapping by
+    # TRANSCRIBE_SPLIT_OVERLAP_SECONDS, transcribed by parallel jobs and
+    # stitched back into one transcript. Needs AUDIO_PREPROCESSING. Set to
+    # None to transcribe every recording in a single job.
+    TRANSCRIBE_SPLIT_MIN_SECONDS = 3600
+    TRANSCRIBE_SPLIT_SEGMENT_SECONDS = 1200
+    TRANSCRIBE_SPLIT_OVERLAP_SECONDS = 20
+
+    # Remove fillers ("um", "you know,"), repeated words and crosstalk
+    # backchannels from the transcripts, and merge the consecutive turns of a
+    # speaker, before they are summarized. Words transcribed with a
+    # confidence under COMPACTION_MIN_CONFIDENCE (e.g. 0.4) are dropped too,
+    # None keeps them all.
+    TRANSCRIPT_COMPACTION = True
+    COMPACTION_MIN_CONFIDENCE = None
+
+    # Every stage is timed as a span, logged as one JSON line (CloudWatch
+    # Logs Insights can query the fields) and summed into Prometheus metrics
+    # served on METRICS_PORT at /metrics; worker process N serves
+    # METRICS_PORT + 1 + N. None disables the endpoint. Users listed in
+    # ADMIN_USERS see a timing panel in the sidebar.
+    LOG_LEVEL = "INFO"
+    LOG_JSON = True
+    METRICS_PORT = 9464
+    ADMIN_USERS = []
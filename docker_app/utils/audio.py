@@ -0,0 +1,464 @@
+import bisect
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Transcribe works on 16 kHz mono speech, more is not used
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+
+# Frames quieter than this (dBFS) are silent, unless the recording is noisy:
+# the threshold is then raised to just above its noise floor
+SILENCE_THRESHOLD_DB = -45.0
+NOISE_FLOOR_PERCENTILE = 10
+NOISE_FLOOR_MARGIN_DB = 6.0
+# ...but never so high that quiet speech would be cut
+MAX_THRESHOLD_DB = -30.0
+
+# Only silences longer than this are cut, keeping some padding on each side
+MIN_SILENCE_SECONDS = 2.0
+SILENCE_PADDING_SECONDS = 0.3
+
+# Long recordings can be transcribed in segments of about this length, cut at
+# the quietest moment within SEGMENT_SEARCH_SECONDS of each boundary, and
+# overlapping so that a word cut in one segment is whole in the next
+SEGMENT_SECONDS = 1200.0
+SEGMENT_OVERLAP_SECONDS = 20.0
+SEGMENT_SEARCH_SECONDS = 60.0
+# A cut is placed in the quietest stretch of this length, not a single quiet frame
+SEGMENT_CUT_SECONDS = 0.5
+
+# Decoded audio is streamed through temporary files in chunks of this size, about 30s at 16 kHz
+PCM_CHUNK_BYTES = 1024 * 1024
+
+# FLAC is lossless and always built in ffmpeg; "ogg" (Opus) is about 5x smaller
+OUTPUT_FORMAT = 'flac'
+OUTPUT_CODECS = {
+    'flac': ['-c:a', 'flac'],
+    'ogg': ['-c:a', 'libopus', '-b:a', '32k', '-application', 'voip'],
+    'wav': ['-c:a', 'pcm_s16le'],
+}
+
+
+class AudioProcessingError(RuntimeError):
+    pass
+
+
+def ffmpeg_available():
+    return shutil.which('ffmpeg') is not None
+
+
+class TimeMap:
+    """
+    Maps times of the processed audio back to the original recording. Each
+    kept span of the original is a (processed_start, original_start,
+    duration) segment, in seconds.
+    """
+
+    def __init__(self, segments):
+        self.segments = [tuple(segment) for segment in segments]
+        self._starts = [segment[0] for segment in self.segments]
+
+    @property
+    def duration(self):
+        if not self.segments:
+            return 0.0
+        processed_start, _, duration = self.segments[-1]
+        return processed_start + duration
+
+    def to_original(self, seconds):
+        index = max(0, bisect.bisect_right(self._starts, seconds) - 1)
+        if not self.segments:
+            return seconds
+        processed_start, original_start, duration = self.segments[index]
+        return original_start + min(max(seconds - processed_start, 0.0), duration)
+
+    def map_times(self, times):
+        """
+        Vectorized to_original() over a sequence of times.
+        """
+        import numpy as np
+
+        times = np.asarray(times, dtype=np.float64)
+        if not self.segments:
+            return times
+        segments = np.asarray(self.segments, dtype=np.float64)
+        index = np.clip(np.searchsorted(segments[:, 0], times, side='right') - 1, 0, len(segments) - 1)
+        offset = np.clip(times - segments[index, 0], 0.0, segments[index, 2])
+        return segments[index, 1] + offset
+
+    def to_json(self):
+        return json.dumps({'segments': self.segments})
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(json.loads(data)['segments'])
+
+
+def frame_levels(samples, sample_rate=SAMPLE_RATE, frame_seconds=FRAME_SECONDS):
+    """
+    RMS level of each frame in dBFS, for int16 or float samples.
+    """
+    import numpy as np
+
+    frame = max(1, int(sample_rate * frame_seconds))
+    count = len(samples) // frame
+    if count == 0:
+        return np.zeros(0)
+    frames = samples[:count * frame].reshape(count, frame).astype(np.float32)
+    if samples.dtype == np.int16:
+        frames /= 32768.0
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def detect_speech(samples, sample_rate=SAMPLE_RATE, frame_seconds=FRAME_SECONDS, **options):
+    """
+    Return the (start, end) sample ranges to keep: everything but the
+    silences longer than min_silence, each kept range being extended by
+    padding. Leading and trailing silences are dropped whatever their length.
+    """
+    return speech_ranges(frame_levels(samples, sample_rate, frame_seconds), len(samples), sample_rate,
+                         frame_seconds=frame_seconds, **options)
+
+
+def speech_ranges(levels, sample_count, sample_rate=SAMPLE_RATE, threshold_db=SILENCE_THRESHOLD_DB,
+                  min_silence=MIN_SILENCE_SECONDS, padding=SILENCE_PADDING_SECONDS, frame_seconds=FRAME_SECONDS):
+    """
+    detect_speech() from the frame_levels() of sample_count samples.
+    """
+    import numpy as np
+
+    if len(levels) == 0:
+        return [(0, sample_count)] if sample_count else []
+    frame = max(1, int(sample_rate * frame_seconds))
+    noise_floor = np.percentile(levels, NOISE_FLOOR_PERCENTILE)
+    threshold = min(max(threshold_db, noise_floor + NOISE_FLOOR_MARGIN_DB), max(threshold_db, MAX_THRESHOLD_DB))
+    voiced = levels > threshold
+    if not voiced.any():
+        return []
+
+    # Boundaries of the voiced runs, as frame indexes
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], voiced.view(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    # Merge runs separated by a silence too short to cut
+    gaps = (starts[1:] - ends[:-1]) * frame_seconds
+    keep_gap = gaps < min_silence
+    run_starts = np.concatenate(([starts[0]], starts[1:][~keep_gap]))
+    run_ends = np.concatenate((ends[:-1][~keep_gap], [ends[-1]]))
+
+    pad = int(padding * sample_rate)
+    ranges = []
+    for start, end in zip(run_starts * frame, run_ends * frame):
+        start = max(0, int(start) - pad)
+        end = min(sample_count, int(end) + pad)
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def trim_silences(samples, sample_rate=SAMPLE_RATE, **options):
+    """
+    Cut the long silences of the samples. Returns the kept samples and the
+    TimeMap of the cut.
+    """
+    import numpy as np
+
+    ranges = detect_speech(samples, sample_rate, **options)
+    if not ranges:
+        return samples[:0], TimeMap([])
+    return np.concatenate([samples[start:end] for start, end in ranges]), ranges_time_map(ranges, sample_rate)
+
+
+def ranges_time_map(ranges, sample_rate=SAMPLE_RATE):
+    """
+    TimeMap of the audio made of the (start, end) sample ranges put end to end.
+    """
+    segments = []
+    position = 0
+    for start, end in ranges:
+        segments.append((position / sample_rate, start / sample_rate, (end - start) / sample_rate))
+        position += end - start
+    return TimeMap(segments)
+
+
+def split_ranges(samples, sample_rate=SAMPLE_RATE, frame_seconds=FRAME_SECONDS, **options):
+    """
+    (start, end) sample ranges of the segments of a long recording, of
+    about segment_seconds each. Every cut is made at the quietest moment
+    within search seconds of its target, and the segments on both sides
+    extend overlap / 2 past it.
+    """
+    return segment_ranges(frame_levels(samples, sample_rate, frame_seconds), len(samples), sample_rate,
+                          frame_seconds=frame_seconds, **options)
+
+
+def segment_ranges(levels, sample_count, sample_rate=SAMPLE_RATE, segment_seconds=SEGMENT_SECONDS,
+                   overlap=SEGMENT_OVERLAP_SECONDS, search=SEGMENT_SEARCH_SECONDS, frame_seconds=FRAME_SECONDS):
+    """
+    split_ranges() from the frame_levels() of sample_count samples.
+    """
+    import numpy as np
+
+    count = max(1, int(round(sample_count / (segment_seconds * sample_rate))))
+    if count == 1:
+        return [(0, sample_count)] if sample_count else []
+    frame = max(1, int(sample_rate * frame_seconds))
+    width = max(1, int(SEGMENT_CUT_SECONDS / frame_seconds))
+    smoothed = np.convolve(levels, np.ones(width) / width, mode='same')
+    # Cuts stay in order whatever the search window
+    search_frames = int(min(search, segment_seconds / 4) / frame_seconds)
+    cuts = []
+    for k in range(1, count):
+        target = int(len(levels) * k / count)
+        low, high = max(0, target - search_frames), min(len(levels), target + search_frames + 1)
+        window = smoothed[low:high]
+        quiet = np.flatnonzero(window <= window.min() + 0.1)
+        # The middle of the first quietest stretch, away from the words on both sides
+        breaks = np.flatnonzero(np.diff(quiet) > 1)
+        run = quiet[:breaks[0] + 1] if len(breaks) else quiet
+        cuts.append((low + int(run[len(run) // 2])) * frame + frame // 2)
+    half = int(overlap * sample_rate / 2)
+    bounds = [0] + cuts + [sample_count]
+    return [(max(0, start - half), min(sample_count, end + half))
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+class DecodedAudio:
+    """
+    Mono int16 samples in a temporary raw file, with their frame_levels().
+    Hours of audio are hundreds of MB: they are written and read back in
+    chunks rather than held in memory. Remove the file with close().
+    """
+
+    def __init__(self, path, sample_count, levels, sample_rate=SAMPLE_RATE):
+        self.path = path
+        self.sample_count = sample_count
+        self.levels = levels
+        self.sample_rate = sample_rate
+
+    @property
+    def duration(self):
+        return self.sample_count / self.sample_rate
+
+    def iter_range(self, start, end, chunk_bytes=PCM_CHUNK_BYTES):
+        """
+        The samples from start to end, as chunks of PCM bytes.
+        """
+        with open(self.path, 'rb') as f:
+            f.seek(start * 2)
+            remaining = (end - start) * 2
+            while remaining > 0:
+                chunk = f.read(min(chunk_bytes, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def close(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_pcm(chunks, sample_rate=SAMPLE_RATE, frame_seconds=FRAME_SECONDS):
+    """
+    Write chunks of mono 16-bit PCM to a DecodedAudio, computing the levels
+    of its frames on the way. A frame split across chunks is measured once
+    whole.
+    """
+    import numpy as np
+
+    frame_bytes = max(1, int(sample_rate * frame_seconds)) * 2
+    fd, path = tempfile.mkstemp(suffix='.raw')
+    levels, pending, size = [], b'', 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+                pending += chunk
+                whole = len(pending) - len(pending) % frame_bytes
+                if whole:
+                    levels.append(frame_levels(np.frombuffer(pending[:whole], dtype=np.int16), sample_rate,
+                                               frame_seconds))
+                    pending = pending[whole:]
+    except BaseException:
+        os.remove(path)
+        raise
+    return DecodedAudio(path, size // 2, np.concatenate(levels) if levels else np.zeros(0), sample_rate)
+
+
+def decode(path, sample_rate=SAMPLE_RATE):
+    """
+    Decode the audio track of a media file, without the video track, into
+    a DecodedAudio.
+    """
+    return write_pcm(iter_pcm(path, sample_rate, chunk_bytes=PCM_CHUNK_BYTES), sample_rate)
+
+
+def iter_pcm(path, sample_rate=SAMPLE_RATE, chunk_bytes=3200, realtime=False):
+    """
+    Decode the audio track of a media file into chunks of mono 16-bit PCM
+    as ffmpeg produces them. With realtime, the file is read at the pace
+    it plays at, like a meeting being captured.
+    """
+    command = ['ffmpeg', '-nostdin', '-v', 'error', *(['-re'] if realtime else []), '-i', path, '-vn', '-sn', '-dn',
+               '-ac', '1', '-ar', str(sample_rate), '-f', 's16le', '-']
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    completed = False
+    try:
+        for chunk in iter(lambda: process.stdout.read(chunk_bytes), b''):
+            yield chunk
+        completed = True
+    finally:
+        if not completed:
+            process.kill()
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise AudioProcessingError(f'Could not decode {path}: {stderr.decode("utf-8", "replace").strip()}')
+
+
+def encode_pcm(chunks, output_path, sample_rate=SAMPLE_RATE, output_format=OUTPUT_FORMAT):
+    """
+    Encode chunks of mono 16-bit PCM into output_path, fed to ffmpeg as
+    they come.
+    """
+    command = ['ffmpeg', '-nostdin', '-v', 'error', '-y', '-f', 's16le', '-ar', str(sample_rate), '-ac', '1', '-i', '-',
+               *OUTPUT_CODECS[output_format], '-f', output_format, output_path]
+    # stderr goes to a file: a pipe nobody reads while stdin is written could fill up and block ffmpeg
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=errors)
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            # ffmpeg stopped, its error is reported below
+            pass
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            returncode = process.wait()
+        if returncode != 0:
+            errors.seek(0)
+            raise AudioProcessingError(f'Could not encode {output_path}: '
+                                       f'{errors.read().decode("utf-8", "replace").strip()}')
+
+
+def encode(samples, output_path, sample_rate=SAMPLE_RATE, output_format=OUTPUT_FORMAT):
+    import numpy as np
+
+    encode_pcm([samples.astype(np.int16).tobytes()], output_path, sample_rate, output_format)
+
+
+def write_segments(audio, output_format=OUTPUT_FORMAT, **options):
+    """
+    Cut a DecodedAudio into the overlapping segments of split_ranges(), each
+    written to a temporary file in output_format. Returns their (path,
+    offset seconds, duration seconds); the files are removed by the caller.
+    """
+    sample_rate = audio.sample_rate
+    segments = []
+    try:
+        for start, end in segment_ranges(audio.levels, audio.sample_count, sample_rate, **options):
+            fd, path = tempfile.mkstemp(suffix=f'.{output_format}')
+            os.close(fd)
+            segments.append((path, start / sample_rate, (end - start) / sample_rate))
+            encode_pcm(audio.iter_range(start, end), path, sample_rate, output_format)
+    except Exception:
+        for path, _, _ in segments:
+            os.remove(path)
+        raise
+    return segments
+
+
+def preprocess(input_path, output_path, sample_rate=SAMPLE_RATE, output_format=OUTPUT_FORMAT, trim=True, split=None,
+               **options):
+    """
+    Shrink a recording for transcription: audio only, mono, resampled to
+    sample_rate, long silences cut. Writes output_path (in output_format).
+
+    With split, the options of split_ranges() and min_seconds, an output of
+    at least min_seconds is also cut into segments, from the levels measured
+    while cutting the silences rather than by decoding it again.
+
+    Returns the TimeMap from the output back to the input, and the
+    segments of write_segments() or None.
+    """
+    decoded = decode(input_path, sample_rate)
+    kept = decoded
+    try:
+        ranges = speech_ranges(decoded.levels, decoded.sample_count, sample_rate, **options) if trim else []
+        if not ranges or ranges == [(0, decoded.sample_count)]:
+            # Nothing to cut, or nothing sounds like speech: let Transcribe decide on the full audio
+            ranges = [(0, decoded.sample_count)]
+        else:
+            kept = write_pcm((chunk for start, end in ranges for chunk in decoded.iter_range(start, end)), sample_rate)
+            decoded.close()
+        time_map = ranges_time_map(ranges, sample_rate)
+        encode_pcm(kept.iter_range(0, kept.sample_count), output_path, sample_rate, output_format)
+        logger.info('Preprocessed %s: %.0fs of audio kept out of %.0fs', input_path, time_map.duration,
+                    decoded.duration)
+        segments = None
+        if split is not None:
+            split = dict(split)
+            if time_map.duration >= split.pop('min_seconds', 0):
+                segments = write_segments(kept, output_format, **split)
+                logger.info('Split %s into %d segments', input_path, len(segments))
+    finally:
+        decoded.close()
+        kept.close()
+    return time_map, segments
+
+
+def preprocess_fileobj(fileobj, suffix, output_format=OUTPUT_FORMAT, chunk_bytes=8 * 1024 * 1024, **options):
+    """
+    preprocess() for a file object, e.g. a Streamlit upload, through temporary
+    files. Returns the path of the output, to be removed by the caller, the
+    TimeMap and the segments.
+    """
+    fileobj.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=suffix) as source:
+        for chunk in iter(lambda: fileobj.read(chunk_bytes), b''):
+            source.write(chunk)
+        source.flush()
+        fileobj.seek(0)
+        fd, output_path = tempfile.mkstemp(suffix=f'.{output_format}')
+        os.close(fd)
+        try:
+            time_map, segments = preprocess(source.name, output_path, output_format=output_format, **options)
+        except Exception:
+            os.remove(output_path)
+            raise
+    return output_path, time_map, segments
+
+
+def split_file(input_path, sample_rate=SAMPLE_RATE, output_format=OUTPUT_FORMAT, **options):
+    """
+    write_segments() of a recording. Returns their (path, offset seconds,
+    duration seconds); the files are removed by the caller.
+    """
+    with decode(input_path, sample_rate) as decoded:
+        segments = write_segments(decoded, output_format, **options)
+    logger.info('Split %s into %d segments', input_path, len(segments))
+    return segments
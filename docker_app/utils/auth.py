@@ -1,31 +1,145 @@
-import boto3
 import json
-from streamlit_cognito_auth import CognitoAuthenticator
+import logging
+import threading
+import time
+
+from .clients import get_client
+
+logger = logging.getLogger(__name__)
+
+# Longest time a rotated secret can go unnoticed
+SECRET_TTL_SECONDS = 300
+# Entries older than this are refreshed in the background while still served
+SECRET_REFRESH_AHEAD_SECONDS = 60
+
+SESSION_STATE_KEY = 'auth_authenticator'
+
+
+class SecretCache:
+    """
+    Process-wide cache of Secrets Manager values.
+
+    A value is fetched once, then served from memory for ttl seconds. In the
+    last refresh_ahead seconds of its life, a read triggers a background
+    refresh, so busy pages never wait on Secrets Manager. If a refresh
+    fails, the previous value is served until the next attempt.
+    """
+
+    def __init__(self, client=None, ttl=SECRET_TTL_SECONDS, refresh_ahead=SECRET_REFRESH_AHEAD_SECONDS):
+        self._client = client
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_client('secretsmanager')
+        return self._client
+
+    def get(self, secret_id):
+        """
+        Return (value, version_id) of the secret, value being the decoded JSON.
+        """
+        with self._lock:
+            entry = self._entries.get(secret_id)
+        if entry is None:
+            return self._refresh(secret_id)
+        value, version_id, fetched_at = entry
+        age = time.time() - fetched_at
+        if age >= self.ttl:
+            try:
+                return self._refresh(secret_id)
+            except Exception as e:
+                logger.warning('Error refreshing secret %s, serving the cached value: %s', secret_id, e)
+        elif age >= self.ttl - self.refresh_ahead:
+            self._refresh_in_background(secret_id)
+        return value, version_id
+
+    def invalidate(self, secret_id):
+        with self._lock:
+            self._entries.pop(secret_id, None)
+
+    def _refresh(self, secret_id):
+        response = self.client.get_secret_value(SecretId=secret_id)
+        value = json.loads(response['SecretString'])
+        version_id = response.get('VersionId')
+        with self._lock:
+            self._entries[secret_id] = (value, version_id, time.time())
+        return value, version_id
+
+    def _refresh_in_background(self, secret_id):
+        with self._lock:
+            if secret_id in self._refreshing:
+                return
+            self._refreshing.add(secret_id)
+
+        def refresh():
+            try:
+                self._refresh(secret_id)
+            except Exception as e:
+                logger.warning('Error refreshing secret %s: %s', secret_id, e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(secret_id)
+
+        threading.Thread(target=refresh, name='secret-refresh', daemon=True).start()
+
+
+_secret_cache = None
+_secret_cache_lock = threading.Lock()
+
+
+def get_secret_cache(ttl=SECRET_TTL_SECONDS):
+    """
+    Return the process-wide secret cache, creating it on first use.
+    """
+    global _secret_cache
+    with _secret_cache_lock:
+        if _secret_cache is None:
+            _secret_cache = SecretCache(ttl=ttl)
+        return _secret_cache
 
 
 class Auth:
 
     @staticmethod
-    def get_authenticator(secret_id):
+    def get_authenticator(secret_id, session_state=None, ttl=SECRET_TTL_SECONDS):
         """
         Get Cognito parameters from Secrets Manager and
         returns a CognitoAuthenticator object.
+
+        The secret is cached process-wide for ttl seconds. When session_state
+        is given, the authenticator is kept there and reused on every rerun
+        of the session, until the secret is rotated.
         """
         # Get Cognito parameters from Secrets Manager
-        secretsmanager_client = boto3.client("secretsmanager")
-        response = secretsmanager_client.get_secret_value(
-            SecretId=secret_id,
-        )
-        secret_string = json.loads(response['SecretString'])
+        secret_string, version_id = get_secret_cache(ttl).get(secret_id)
+
+        if session_state is not None:
+            cached = session_state.get(SESSION_STATE_KEY)
+            if cached is not None and cached[0] == version_id:
+                authenticator = cached[1]
+                # The cookie component must be rendered on every run to read fresh cookies
+                authenticator.cookie_manager.get_all(key='init')
+                return authenticator
+
         pool_id = secret_string['pool_id']
         app_client_id = secret_string['app_client_id']
         app_client_secret = secret_string['app_client_secret']
 
-        # Initialise CognitoAuthenticator
+        # Initialise CognitoAuthenticator, imported here since it brings in Streamlit
+        from streamlit_cognito_auth import CognitoAuthenticator
+
         authenticator = CognitoAuthenticator(
             pool_id=pool_id,
             app_client_id=app_client_id,
             app_client_secret=app_client_secret,
+            boto_client=get_client('cognito-idp', region_name=pool_id.split('_')[0]),
         )
 
+        if session_state is not None:
+            session_state[SESSION_STATE_KEY] = (version_id, authenticator)
         return authenticator
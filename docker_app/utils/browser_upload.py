@@ -0,0 +1,136 @@
+import json
+import time
+import uuid
+
+from .storage import media_extension
+from .streamlitutils import conform_to_regex
+
+MB = 1024 * 1024
+
+# Parts are pushed by the browser, so they can be large: 80 x 64 MiB = 5 GiB
+PART_SIZE = 64 * MB
+MAX_PARTS = 80
+CONCURRENCY = 4
+URL_EXPIRES_SECONDS = 3600
+
+# Media types the page accepts, like the uploads that go through the app
+MEDIA_FORMATS = ('mp3', 'mp4', 'm4a')
+
+UPLOAD_HTML = """
+<div style="font-family: sans-serif; font-size: 14px;">
+    <input type="file" id="file" accept="__ACCEPT__">
+    <button id="start">Upload to S3</button>
+    <progress id="progress" value="0" max="1" style="width: 100%; margin-top: 8px;"></progress>
+    <div id="status"></div>
+</div>
+<script>
+const upload = __UPLOAD__;
+const status = document.getElementById("status");
+const progress = document.getElementById("progress");
+
+async function putPart(url, blob, retries) {
+    for (let attempt = 0; ; attempt++) {
+        try {
+            const response = await fetch(url, {method: "PUT", body: blob});
+            if (!response.ok) throw new Error("HTTP " + response.status);
+            return response.headers.get("ETag");
+        } catch (error) {
+            if (attempt >= retries) throw error;
+            await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+        }
+    }
+}
+
+document.getElementById("start").onclick = async () => {
+    const file = document.getElementById("file").files[0];
+    if (!file) { status.textContent = "Please choose a recording first."; return; }
+    if (file.name.split(".").pop().toLowerCase() !== upload.extension) {
+        status.textContent = "Please choose a ." + upload.extension + " recording."; return;
+    }
+    const count = Math.ceil(file.size / upload.part_size);
+    if (count > upload.part_urls.length) { status.textContent = "This recording is too large."; return; }
+    const etags = new Array(count);
+    let next = 0, done = 0;
+    async function worker() {
+        while (next < count) {
+            const index = next++;
+            const blob = file.slice(index * upload.part_size, Math.min(file.size, (index + 1) * upload.part_size));
+            etags[index] = await putPart(upload.part_urls[index], blob, 3);
+            done += blob.size;
+            progress.value = done / file.size;
+            status.textContent = "Uploading... " + Math.round(done / 1048576) + " of " + Math.round(file.size / 1048576) + " MB";
+        }
+    }
+    try {
+        await Promise.all(Array.from({length: upload.concurrency}, worker));
+        const parts = etags.map((etag, index) =>
+            "<Part><PartNumber>" + (index + 1) + "</PartNumber><ETag>" + etag + "</ETag></Part>").join("");
+        const response = await fetch(upload.complete_url, {
+            method: "POST", body: "<CompleteMultipartUpload>" + parts + "</CompleteMultipartUpload>"});
+        const body = await response.text();
+        if (!response.ok || body.includes("<Error>")) throw new Error(body);
+        status.textContent = "Upload complete, you can now click 'Submit for Analysis'.";
+    } catch (error) {
+        status.textContent = "Upload failed: " + error.message;
+    }
+};
+</script>
+"""
+
+
+def create_browser_upload(s3_client, bucket, prefix, filename, part_size=PART_SIZE, max_parts=MAX_PARTS,
+                          concurrency=CONCURRENCY, expires=URL_EXPIRES_SECONDS):
+    """
+    Start a multipart upload of the recording filename that the browser
+    performs itself, and presign the URL of every part and of the completion
+    request. The recording bytes never go through the container. The key
+    keeps the sanitized extension of filename, which must be one of
+    MEDIA_FORMATS.
+    """
+    extension = media_extension(conform_to_regex(filename))
+    if extension not in MEDIA_FORMATS:
+        raise ValueError(f'Unsupported media type .{extension}, expected one of {", ".join(MEDIA_FORMATS)}')
+    key = f'{prefix}media/direct-{uuid.uuid4().hex}.{extension}'
+    upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+    upload = {
+        'key': key,
+        'upload_id': upload_id,
+        'extension': extension,
+        'part_size': part_size,
+        'max_parts': max_parts,
+        'concurrency': concurrency,
+    }
+    return presign_browser_upload(s3_client, bucket, upload, expires)
+
+
+def presign_browser_upload(s3_client, bucket, upload, expires=URL_EXPIRES_SECONDS):
+    """
+    Presign the URLs of an upload again, e.g. before they expire. The upload
+    and its parts already sent are kept.
+    """
+    params = {'Bucket': bucket, 'Key': upload['key'], 'UploadId': upload['upload_id']}
+    part_urls = [s3_client.generate_presigned_url('upload_part', ExpiresIn=expires,
+                                                  Params=dict(params, PartNumber=part_number))
+                 for part_number in range(1, upload['max_parts'] + 1)]
+    complete_url = s3_client.generate_presigned_url('complete_multipart_upload', ExpiresIn=expires, HttpMethod='POST',
+                                                    Params=params)
+    return dict(upload, part_urls=part_urls, complete_url=complete_url, expires_at=time.time() + expires)
+
+
+def abort_browser_upload(s3_client, bucket, upload):
+    """
+    Abort an upload that will not be used, rather than leave its parts to
+    the lifecycle rule of the bucket.
+    """
+    s3_client.abort_multipart_upload(Bucket=bucket, Key=upload['key'], UploadId=upload['upload_id'])
+
+
+def render_browser_upload(upload):
+    """
+    Return the HTML of the upload widget for a prepared browser upload.
+    """
+    # Escape "</" so the data can never close the script element
+    data = json.dumps({name: upload[name]
+                       for name in ('extension', 'part_size', 'concurrency', 'part_urls', 'complete_url')})
+    html = UPLOAD_HTML.replace('__ACCEPT__', '.' + upload['extension'])
+    return html.replace('__UPLOAD__', data.replace('</', '<\\/'))
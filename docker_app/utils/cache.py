@@ -0,0 +1,213 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Defaults of the in-process tier
+MAX_ENTRIES = 256
+MAX_BYTES = 32 * 1024 * 1024
+TTL_SECONDS = 24 * 3600
+
+
+def fingerprint(model_id, request_body):
+    """
+    Cache key of a model call: hash of the model id and the full request
+    body, which holds the request parameters and the prompt text.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_id.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(request_body.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class LruCache:
+    """
+    Thread-safe in-memory LRU, bounded by entry count and total size, whose
+    entries expire after a TTL.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, ttl=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, expires = entry
+            if expires < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, time.time() + self.ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskStore:
+    """
+    Persistent tier in a local directory, one JSON file per key.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        # Write then rename, so concurrent readers never see a partial file
+        tmp_path = f'{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+
+
+class S3Store:
+    """
+    Persistent tier in an S3 prefix, shared by every task of the service.
+    """
+
+    def __init__(self, s3_client, bucket, prefix):
+        self._s3_client = s3_client
+        self._bucket = bucket
+        self._prefix = prefix
+
+    def get(self, key):
+        try:
+            return self._s3_client.get_object(Bucket=self._bucket, Key=f'{self._prefix}{key}.json')['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def put(self, key, data):
+        self._s3_client.put_object(Bucket=self._bucket, Key=f'{self._prefix}{key}.json', Body=data,
+                                   ContentType='application/json')
+
+
+def make_store(kind, s3_client=None, bucket=None, prefix='', directory=None):
+    """
+    Persistent tier named by a setting: "s3", "disk", or None for memory only.
+    """
+    if kind == 's3':
+        return S3Store(s3_client, bucket, prefix)
+    if kind == 'disk':
+        return DiskStore(directory)
+    return None
+
+
+class ResponseCache:
+    """
+    Two-tier cache of model responses: an in-process LRU in front of an
+    optional persistent store. Values are JSON-serializable dicts.
+    """
+
+    def __init__(self, memory=None, store=None, ttl=TTL_SECONDS):
+        self.memory = memory or LruCache(ttl=ttl)
+        self.store = store
+        self.ttl = ttl
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return value
+        if self.store is not None:
+            try:
+                data = self.store.get(key)
+            except Exception as e:
+                logger.warning('Error reading response cache entry %s: %s', key, e)
+                data = None
+            if data is not None:
+                record = json.loads(data)
+                if record['created'] + self.ttl >= time.time():
+                    self.memory.put(key, record['value'], len(data))
+                    self._count('store_hits')
+                    return record['value']
+        self._count('misses')
+        return None
+
+    def put(self, key, value, persist=True):
+        data = json.dumps({'created': time.time(), 'value': value}).encode('utf-8')
+        self.memory.put(key, value, len(data))
+        if persist and self.store is not None:
+            try:
+                self.store.put(key, data)
+            except Exception as e:
+                # The persistent tier is best effort, the memory tier still serves
+                logger.warning('Error writing response cache entry %s: %s', key, e)
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.store_hits
+            total = hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'store_hits': self.store_hits,
+                'misses': self.misses,
+                'hit_ratio': hits / total if total else 0.0,
+                'entries': len(self.memory),
+            }
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache(store_factory=None, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, ttl=TTL_SECONDS):
+    """
+    Return the process-wide response cache, creating it on first use.
+    store_factory builds the persistent tier and is only called then.
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            store = store_factory() if store_factory is not None else None
+            _response_cache = ResponseCache(LruCache(max_entries, max_bytes, ttl), store, ttl)
+        return _response_cache
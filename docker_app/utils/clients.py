@@ -0,0 +1,66 @@
+import threading
+
+# Region of the services that are not activated everywhere (Bedrock, Transcribe)
+REGION_NAME = 'us-east-1'
+
+# Connections kept open per client: one per concurrent Streamlit session or
+# worker thread sharing the client (upload parts, chunk summaries...)
+MAX_POOL_CONNECTIONS = 50
+
+CLIENT_OPTIONS = {
+    'max_pool_connections': MAX_POOL_CONNECTIONS,
+    'tcp_keepalive': True,
+    'connect_timeout': 5,
+    'retries': {'mode': 'adaptive', 'max_attempts': 5},
+}
+
+# Long generations stream for minutes, keep reading instead of timing out
+SERVICE_OPTIONS = {
+    'bedrock-runtime': {'read_timeout': 300},
+}
+
+_session = None
+_clients = {}
+_lock = threading.Lock()
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        # boto3 takes a good part of the start-up time, it is only imported with the first client
+        import boto3
+
+        _session = boto3.session.Session()
+    return _session
+
+
+def client_config(service_name):
+    from botocore.config import Config as BotoConfig
+
+    return BotoConfig(**CLIENT_OPTIONS, **SERVICE_OPTIONS.get(service_name, {}))
+
+
+def get_client(service_name, region_name=None):
+    """
+    Return the process-wide client of a service. Clients are thread-safe,
+    built once, and keep their connections open between Streamlit reruns.
+    """
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        # Sessions are not thread-safe, build clients one at a time
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _get_session().client(service_name, region_name=region_name,
+                                               config=client_config(service_name))
+                _clients[key] = client
+    return client
+
+
+def register_client(service_name, client, region_name=None):
+    """
+    Replace the client of a service, e.g. with a local stand-in.
+    """
+    with _lock:
+        _clients[(service_name, region_name)] = client
@@ -0,0 +1,236 @@
+import math
+import re
+
+from .transcript import SEGMENT_PAUSE_SECONDS
+
+# Hesitations that never carry content
+FILLER_WORDS = frozenset(('um', 'umm', 'uh', 'uhh', 'uhm', 'er', 'erm', 'ah', 'eh', 'hmm', 'mm', 'mhm'))
+# Phrases that are fillers only when set off by a comma: "you know, the budget"
+# but not "you know the budget"
+FILLER_PHRASES = (('you', 'know'), ('i', 'mean'))
+
+# A turn made only of these words, cutting into someone else's turn, is
+# crosstalk rather than an answer
+BACKCHANNELS = frozenset(('mm-hmm', 'uh-huh', 'mhm', 'hmm', 'yeah', 'yep', 'right', 'okay', 'ok', 'sure', 'cool'))
+MAX_BACKCHANNEL_WORDS = 3
+# ...unless it follows a question or one of these requests: "Sure." to "Can
+# you own the budget? It is due Friday." is an answer
+REQUESTS = (('can', 'you'), ('could', 'you'), ('will', 'you'), ('would', 'you'), ('please',), ('let', 'me', 'know'))
+
+# Longest phrase collapsed when said twice in a row ("we need to, we need to")
+MAX_REPEAT_WORDS = 4
+
+# Words under this confidence are dropped when set, e.g. 0.4; None keeps them all
+MIN_CONFIDENCE = None
+
+# Claude averages about 4 characters per token on English text
+CHARS_PER_TOKEN = 4
+
+_SENTENCE_END = ('.', '?', '!')
+_TEXT_TOKEN = re.compile(r"[^\s.,?!;:]+|[.,?!;:]+")
+_STRIP = re.compile(r"^[^\w]+|[^\w]+$")
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class CompactionStats:
+    """
+    What the compaction of one transcript removed, and the estimated prompt
+    tokens before and after.
+    """
+    __slots__ = ('original_tokens', 'compacted_tokens', 'fillers', 'repeats', 'low_confidence', 'backchannels')
+
+    def __init__(self, original_tokens=0, compacted_tokens=0, fillers=0, repeats=0, low_confidence=0,
+                 backchannels=0):
+        self.original_tokens = original_tokens
+        self.compacted_tokens = compacted_tokens
+        self.fillers = fillers
+        self.repeats = repeats
+        self.low_confidence = low_confidence
+        self.backchannels = backchannels
+
+    @property
+    def reduction(self):
+        if not self.original_tokens:
+            return 0.0
+        return 1 - self.compacted_tokens / self.original_tokens
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, value):
+        return cls(**value)
+
+    def __str__(self):
+        return (f'{self.original_tokens} -> {self.compacted_tokens} tokens ({self.reduction:.0%} less): '
+                f'{self.fillers} fillers, {self.repeats} repeats, {self.low_confidence} low-confidence words '
+                f'and {self.backchannels} backchannels removed')
+
+
+def _key(word):
+    return _STRIP.sub('', word.lower())
+
+
+def _starts_sentence(units, index):
+    return index == 0 or units[index - 1][1].endswith(_SENTENCE_END)
+
+
+def _drop(units, start, end):
+    """
+    Remove units[start:end]. Their trailing punctuation survives when it ends
+    a sentence, and the capital of a sentence start moves to the next word.
+    """
+    punctuation = units[end - 1][1]
+    capitalized = _starts_sentence(units, start) and units[start][0][:1].isupper()
+    del units[start:end]
+    if start > 0:
+        if punctuation.endswith(_SENTENCE_END):
+            units[start - 1][1] = punctuation
+        elif punctuation == ',' and units[start - 1][1] == ',':
+            # "for, you know, joining": both commas only set the filler off
+            units[start - 1][1] = ''
+    if capitalized and start < len(units):
+        units[start][0] = units[start][0][:1].upper() + units[start][0][1:]
+
+
+def drop_fillers(units):
+    """
+    Remove hesitations, and the comma set phrases of FILLER_PHRASES, in place.
+    units are [word, trailing punctuation] pairs. Returns how many were removed.
+    """
+    removed = 0
+    i = 0
+    while i < len(units):
+        if _key(units[i][0]) in FILLER_WORDS:
+            _drop(units, i, i + 1)
+            removed += 1
+            continue
+        for phrase in FILLER_PHRASES:
+            end = i + len(phrase)
+            if end <= len(units) and units[end - 1][1] == ',' and \
+                    tuple(_key(word) for word, _ in units[i:end]) == phrase:
+                _drop(units, i, end)
+                removed += 1
+                break
+        else:
+            i += 1
+    return removed
+
+
+def collapse_repeats(units, max_words=MAX_REPEAT_WORDS):
+    """
+    Collapse phrases of up to max_words words said several times in a row
+    ("I I I think", "we should, we should go") into one, in place. Returns
+    how many repetitions were removed.
+    """
+    keys = [_key(word) for word, _ in units]
+    removed = 0
+    i = 0
+    while i < len(units):
+        for n in range(1, max_words + 1):
+            if i + 2 * n <= len(units) and keys[i:i + n] == keys[i + n:i + 2 * n] and any(keys[i:i + n]):
+                _drop(units, i, i + n)
+                del keys[i:i + n]
+                removed += 1
+                # The collapse may complete a longer repetition that started earlier
+                i = max(0, i - max_words)
+                break
+        else:
+            i += 1
+    return removed
+
+
+def _clean(units, stats):
+    stats.fillers += drop_fillers(units)
+    stats.repeats += collapse_repeats(units)
+    return units
+
+
+def _join(units):
+    return ' '.join(word + punctuation for word, punctuation in units)
+
+
+def _segment_units(transcript, segment, min_confidence, stats):
+    units = []
+    for i in range(segment.first, segment.last):
+        if transcript.punctuation[i]:
+            if units:
+                units[-1][1] += transcript.words[i]
+        elif min_confidence is not None and transcript.confidences[i] < min_confidence:
+            stats.low_confidence += 1
+        else:
+            units.append([transcript.words[i], ''])
+    return units
+
+
+def text_units(text):
+    """
+    Split plain text into [word, trailing punctuation] pairs.
+    """
+    units = []
+    for token in _TEXT_TOKEN.findall(text):
+        if token[0] in '.,?!;:':
+            if units:
+                units[-1][1] += token
+        else:
+            units.append([token, ''])
+    return units
+
+
+def _is_backchannel(units):
+    return len(units) <= MAX_BACKCHANNEL_WORDS and all(_key(word) in BACKCHANNELS for word, _ in units)
+
+
+def _asks(units):
+    """
+    Whether a turn asks a question or makes one of REQUESTS.
+    """
+    if any(punctuation.endswith('?') for _, punctuation in units):
+        return True
+    keys = [_key(word) for word, _ in units]
+    return any(tuple(keys[i:i + len(request)]) == request for request in REQUESTS for i in range(len(keys)))
+
+
+def compact_transcript(transcript, min_confidence=MIN_CONFIDENCE, max_pause=SEGMENT_PAUSE_SECONDS):
+    """
+    Shorten a Transcript before it goes into a prompt: fillers, repetitions
+    and, optionally, low-confidence words are removed, crosstalk
+    backchannels are dropped and consecutive turns of a speaker are merged
+    into one line. Returns the text, formatted like
+    Transcript.format_segments(), and its CompactionStats.
+    """
+    stats = CompactionStats(original_tokens=estimate_tokens(transcript.format_segments(max_pause)))
+    if not len(transcript):
+        text = _join(_clean(text_units(transcript.full_text), stats))
+        stats.compacted_tokens = estimate_tokens(text)
+        return text, stats
+
+    turns = []
+    for segment in transcript.segments(max_pause):
+        units = _clean(_segment_units(transcript, segment, min_confidence, stats), stats)
+        if units:
+            turns.append((segment.speaker, units))
+
+    if not transcript.speaker_names:
+        text = _join([unit for _, units in turns for unit in units])
+        stats.compacted_tokens = estimate_tokens(text)
+        return text, stats
+
+    lines = []
+    for index, (speaker, units) in enumerate(turns):
+        if lines and 0 < index < len(turns) - 1 and _is_backchannel(units):
+            previous_speaker, previous_units = turns[index - 1]
+            # "Mm-hmm" while someone else talks, but not "Yeah." answering a question or a request
+            if previous_speaker == turns[index + 1][0] != speaker and not _asks(previous_units):
+                stats.backchannels += 1
+                continue
+        if lines and lines[-1][0] == speaker:
+            lines[-1][1].extend(units)
+        else:
+            lines.append((speaker, list(units)))
+    text = '\n'.join(f'{speaker}: {_join(units)}' for speaker, units in lines)
+    stats.compacted_tokens = estimate_tokens(text)
+    return text, stats
@@ -0,0 +1,337 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import subprocess
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+from .telemetry import span
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+FINAL_STATUSES = (SUCCEEDED, FAILED)
+
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 30
+# A running job whose worker stops renewing its lease this long is run again
+LEASE_SECONDS = 120
+IDLE_POLL_SECONDS = 1.0
+
+
+class LeaseLostError(RuntimeError):
+    """
+    Raised by the checkpoint of a job whose lease went to another worker:
+    the job runs there now, and this worker stops it.
+    """
+
+
+class JobStore(ABC):
+    """
+    Persistent queue of jobs. Jobs are dicts with the keys id, kind, status,
+    stage, attempts, max_attempts, state, error, created_at and updated_at;
+    state holds the payload of the job and the checkpoints of its stages.
+
+    Backends implement the methods below, and are registered by URL scheme
+    with register_backend().
+    """
+
+    @abstractmethod
+    def submit(self, kind, state, idempotency_key=None, max_attempts=MAX_ATTEMPTS):
+        """
+        Queue a job and return its id. A job submitted again with the same
+        idempotency key is not queued twice: the id of the first one is
+        returned, and if it failed, it is queued again with new attempts,
+        from its last checkpoint.
+        """
+
+    @abstractmethod
+    def get(self, job_id):
+        pass
+
+    @abstractmethod
+    def claim(self, worker_id, lease_seconds=LEASE_SECONDS):
+        """
+        Lease the oldest job ready to run to a worker, or return None. A
+        running job whose lease expired is ready again, unless it has used
+        all its attempts: it is marked failed instead, so that a job that
+        brings its worker down is not run forever.
+        """
+
+    @abstractmethod
+    def renew(self, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        pass
+
+    @abstractmethod
+    def checkpoint(self, job_id, worker_id, stage, state):
+        """
+        Record the progress of a running job, so that a retry resumes from it.
+        Returns False when the worker lost the lease of the job.
+        """
+
+    @abstractmethod
+    def complete(self, job_id, worker_id, state):
+        pass
+
+    @abstractmethod
+    def fail(self, job_id, worker_id, error, retry_delay=RETRY_BACKOFF_SECONDS):
+        """
+        Queue the job again after retry_delay, or mark it failed once it has
+        used all its attempts.
+        """
+
+
+class SqliteJobStore(JobStore):
+    """
+    Job store in a SQLite database, shared by the processes of a host.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._transaction() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    idempotency_key TEXT UNIQUE,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    error TEXT,
+                    worker TEXT,
+                    lease_expires_at REAL,
+                    available_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at)')
+
+    def _connection(self):
+        # Connections cannot be shared between threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._connection()
+        # Take the write lock upfront, so that two workers never claim the same job
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    @staticmethod
+    def _job(row):
+        if row is None:
+            return None
+        return {
+            'id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'stage': row['stage'],
+            'attempts': row['attempts'],
+            'max_attempts': row['max_attempts'],
+            'state': json.loads(row['state']),
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+        }
+
+    def submit(self, kind, state, idempotency_key=None, max_attempts=MAX_ATTEMPTS):
+        now = time.time()
+        with self._transaction() as db:
+            if idempotency_key is not None:
+                row = db.execute('SELECT id, status FROM jobs WHERE idempotency_key = ?',
+                                 (idempotency_key,)).fetchone()
+                if row is not None:
+                    if row['status'] == FAILED:
+                        db.execute('UPDATE jobs SET status = ?, attempts = 0, max_attempts = ?, worker = NULL, '
+                                   'lease_expires_at = NULL, available_at = ?, updated_at = ? WHERE id = ?',
+                                   (QUEUED, max_attempts, now, now, row['id']))
+                    return row['id']
+            job_id = uuid.uuid4().hex
+            db.execute('INSERT INTO jobs (id, idempotency_key, kind, status, max_attempts, state, available_at, '
+                       'created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (job_id, idempotency_key, kind, QUEUED, max_attempts, json.dumps(state), now, now, now))
+            return job_id
+
+    def get(self, job_id):
+        return self._job(self._connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    def claim(self, worker_id, lease_seconds=LEASE_SECONDS):
+        now = time.time()
+        with self._transaction() as db:
+            # A job that took its worker down on every attempt (out of memory...) is not run again
+            db.execute('UPDATE jobs SET status = ?, error = ?, worker = NULL, lease_expires_at = NULL, updated_at = ? '
+                       'WHERE status = ? AND lease_expires_at < ? AND attempts >= max_attempts',
+                       (FAILED, 'The worker stopped during every attempt', now, RUNNING, now))
+            row = db.execute('SELECT * FROM jobs WHERE (status = ? AND available_at <= ?) '
+                             'OR (status = ? AND lease_expires_at < ?) ORDER BY available_at LIMIT 1',
+                             (QUEUED, now, RUNNING, now)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE jobs SET status = ?, worker = ?, lease_expires_at = ?, attempts = attempts + 1, '
+                       'updated_at = ? WHERE id = ?', (RUNNING, worker_id, now + lease_seconds, now, row['id']))
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone()
+        return self._job(row)
+
+    def _update(self, job_id, worker_id, **columns):
+        columns['updated_at'] = time.time()
+        assignments = ', '.join(f'{name} = ?' for name in columns)
+        with self._transaction() as db:
+            cursor = db.execute(f'UPDATE jobs SET {assignments} WHERE id = ? AND worker = ? AND status = ?',
+                                (*columns.values(), job_id, worker_id, RUNNING))
+            # False when the lease was lost to another worker
+            return cursor.rowcount == 1
+
+    def renew(self, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        return self._update(job_id, worker_id, lease_expires_at=time.time() + lease_seconds)
+
+    def checkpoint(self, job_id, worker_id, stage, state):
+        return self._update(job_id, worker_id, stage=stage, state=json.dumps(state))
+
+    def complete(self, job_id, worker_id, state):
+        return self._update(job_id, worker_id, status=SUCCEEDED, stage=None, state=json.dumps(state),
+                            error=None, lease_expires_at=None)
+
+    def fail(self, job_id, worker_id, error, retry_delay=RETRY_BACKOFF_SECONDS):
+        job = self.get(job_id)
+        if job is None:
+            return False
+        if job['attempts'] >= job['max_attempts']:
+            return self._update(job_id, worker_id, status=FAILED, error=error, lease_expires_at=None)
+        return self._update(job_id, worker_id, status=QUEUED, error=error, lease_expires_at=None,
+                            available_at=time.time() + retry_delay * 2 ** (job['attempts'] - 1))
+
+
+BACKENDS = {
+    'sqlite': lambda location: SqliteJobStore(location),
+}
+
+
+def register_backend(scheme, factory):
+    """
+    Make a job store available to get_job_store(), e.g. one backed by DynamoDB.
+    factory(location) receives the URL without its "scheme://" prefix.
+    """
+    BACKENDS[scheme] = factory
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_job_store(url):
+    """
+    Return the process-wide job store of a URL such as "sqlite:///data/jobs.db"
+    (absolute path) or "sqlite://data/jobs.db" (relative path).
+    """
+    with _stores_lock:
+        if url not in _stores:
+            scheme, _, location = url.partition('://')
+            if scheme not in BACKENDS:
+                raise ValueError(f'Unknown job store backend: {scheme}')
+            _stores[url] = BACKENDS[scheme](location)
+        return _stores[url]
+
+
+class JobWorker:
+    """
+    Run the jobs of a store one at a time. handlers maps a job kind to
+    handler(state, checkpoint), which may update state in place and call
+    checkpoint(stage) after each stage; its return value is the final state.
+    checkpoint raises LeaseLostError once another worker took the job over.
+    """
+
+    def __init__(self, store, handlers, worker_id=None, lease_seconds=LEASE_SECONDS,
+                 retry_delay=RETRY_BACKOFF_SECONDS):
+        self.store = store
+        self.handlers = handlers
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+
+    def run_forever(self):
+        while True:
+            if not self.run_once():
+                time.sleep(IDLE_POLL_SECONDS)
+
+    def run_once(self):
+        """
+        Run the next ready job, if any. Returns False when the queue was empty.
+        """
+        job = self.store.claim(self.worker_id, self.lease_seconds)
+        if job is None:
+            return False
+        stop_renewing = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(job['id'], stop_renewing), daemon=True)
+        renewer.start()
+        state = job['state']
+        try:
+            # The spans of every attempt of a job share its id as trace id
+            with span('job', trace_id=job['id'], kind=job['kind'], attempt=job['attempts'], worker=self.worker_id):
+                handler = self.handlers[job['kind']]
+                result = handler(state, lambda stage: self._checkpoint(job['id'], stage, state))
+            self.store.complete(job['id'], self.worker_id, result if result is not None else state)
+        except LeaseLostError as e:
+            logger.warning('Job %s stopped: %s', job['id'], e)
+        except Exception as e:
+            # The state saved by the last checkpoint is where the retry starts from
+            logger.warning('Job %s failed on attempt %s: %s', job['id'], job['attempts'], e)
+            self.store.fail(job['id'], self.worker_id, str(e), self.retry_delay)
+        finally:
+            stop_renewing.set()
+            renewer.join()
+        return True
+
+    def _checkpoint(self, job_id, stage, state):
+        if not self.store.checkpoint(job_id, self.worker_id, stage, state):
+            raise LeaseLostError(f'its lease was lost before the checkpoint of stage {stage}')
+        return True
+
+    def _renew(self, job_id, stop):
+        # Long stages (a Transcribe job can take an hour) keep their lease alive
+        while not stop.wait(self.lease_seconds / 3):
+            try:
+                self.store.renew(job_id, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.warning('Error renewing the lease of job %s: %s', job_id, e)
+
+
+_workers = None
+_workers_lock = threading.Lock()
+
+
+def start_worker_processes(command, cwd=None):
+    """
+    Start the worker command once per process (e.g. once per container for
+    the web server). The workers run outside the browser sessions, so jobs
+    go on when a tab is closed.
+    """
+    global _workers
+    with _workers_lock:
+        if _workers is None or _workers.poll() is not None:
+            _workers = subprocess.Popen(command, cwd=cwd)
+        return _workers
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+
+from .audio import SAMPLE_RATE
+from .clients import REGION_NAME
+from .streamlitutils import EXAMPLE_REVIEW, SYSTEM_PROMPT_REVIEW, TEMPLATE_FORMAT, USER_PROMPT
+from .telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# Streaming Transcribe takes 16-bit little-endian mono PCM, in chunks of 50 to 200 ms
+BYTES_PER_SAMPLE = 2
+CHUNK_SECONDS = 0.1
+
+# The notes are updated at most this often, and only once this much was said
+SUMMARY_INTERVAL_SECONDS = 30.0
+SUMMARY_MIN_DELTA_CHARS = 300
+SUMMARY_MAX_TOKENS = 4000
+
+SYSTEM_PROMPT_UPDATE = """The meeting is still going on. Below are the meeting notes written so far,
+                then what was said since they were written. Update the notes with it: add the new
+                items, merge them with the existing ones, and correct the items it contradicts.
+                Keep every item that is still valid, and answer with the complete notes. \n\n"""
+
+UPDATE_PROMPT_PREFIX = (SYSTEM_PROMPT_REVIEW + "\n" + SYSTEM_PROMPT_UPDATE + TEMPLATE_FORMAT + "\n"
+                        + EXAMPLE_REVIEW + "\n")
+
+
+class LiveTranscriptionError(RuntimeError):
+    pass
+
+
+class StreamingTranscriber:
+    """
+    Streaming speech to text. start(on_segment) is called once, then send()
+    with every chunk of PCM audio as it is captured, then finish(), which
+    returns once every segment was delivered. on_segment(speaker, start,
+    end, text) receives the final text of each segment, from any thread.
+    Backends are registered by name with register_transcriber().
+    """
+
+    def start(self, on_segment):
+        raise NotImplementedError
+
+    def send(self, chunk):
+        raise NotImplementedError
+
+    def finish(self):
+        raise NotImplementedError
+
+
+class AwsStreamingTranscriber(StreamingTranscriber):
+    """
+    Amazon Transcribe streaming, through the amazon-transcribe package. Its
+    asyncio client runs on a loop of its own thread.
+    """
+
+    def __init__(self, region_name=REGION_NAME, language_code='en-US', sample_rate=SAMPLE_RATE):
+        self.region_name = region_name
+        self.language_code = language_code
+        self.sample_rate = sample_rate
+        self._loop = None
+        self._thread = None
+        self._stream = None
+        self._events = None
+
+    def start(self, on_segment):
+        try:
+            from amazon_transcribe.client import TranscribeStreamingClient
+            from amazon_transcribe.handlers import TranscriptResultStreamHandler
+        except ImportError as e:
+            raise LiveTranscriptionError('Live transcription needs the amazon-transcribe package') from e
+
+        class Handler(TranscriptResultStreamHandler):
+
+            async def handle_transcript_event(self, event):
+                for result in event.transcript.results:
+                    # Partial results are revised until they are final
+                    if result.is_partial or not result.alternatives:
+                        continue
+                    alternative = result.alternatives[0]
+                    speakers = Counter(item.speaker for item in alternative.items or () if item.speaker is not None)
+                    speaker = f'spk_{speakers.most_common(1)[0][0]}' if speakers else None
+                    on_segment(speaker, result.start_time, result.end_time, alternative.transcript)
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='live-transcribe', daemon=True)
+        self._thread.start()
+        client = TranscribeStreamingClient(region=self.region_name)
+        self._stream = self._call(client.start_stream_transcription(
+            language_code=self.language_code, media_sample_rate_hz=self.sample_rate, media_encoding='pcm',
+            show_speaker_label=True))
+        self._events = asyncio.run_coroutine_threadsafe(Handler(self._stream.output_stream).handle_events(),
+                                                        self._loop)
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def send(self, chunk):
+        self._call(self._stream.input_stream.send_audio_event(audio_chunk=chunk))
+
+    def finish(self):
+        try:
+            self._call(self._stream.input_stream.end_stream())
+            self._events.result()
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+
+TRANSCRIBERS = {
+    'aws': AwsStreamingTranscriber,
+}
+
+
+def register_transcriber(name, factory):
+    """
+    Make a streaming transcriber available to make_transcriber(), e.g. a
+    local model, or a stand-in for tests. factory(**options) returns a
+    StreamingTranscriber.
+    """
+    TRANSCRIBERS[name] = factory
+
+
+def make_transcriber(name, **options):
+    if name not in TRANSCRIBERS:
+        raise ValueError(f'Unknown live transcriber: {name}')
+    return TRANSCRIBERS[name](**options)
+
+
+def build_update_prompt(notes, delta, user_prompt, attendees_agenda, meeting_notes):
+    # What does not change between updates comes first
+    return UPDATE_PROMPT_PREFIX + user_prompt + ": \n" + attendees_agenda + "\n" + meeting_notes + "\n" \
+        + f"<notes_so_far>\n{notes}\n</notes_so_far>\n<new_transcription>\n{delta}\n</new_transcription>"
+
+
+class RollingSummary:
+    """
+    Notes of a meeting that is still going on. Lines of transcript are
+    added as they are final, and update() sends the model the lines added
+    since the previous update with the notes it wrote then, never the whole
+    transcript again.
+    """
+
+    def __init__(self, llm, user_prompt=USER_PROMPT, attendees_agenda='', meeting_notes='',
+                 max_tokens=SUMMARY_MAX_TOKENS):
+        self.llm = llm
+        self.user_prompt = user_prompt
+        self.attendees_agenda = attendees_agenda
+        self.meeting_notes = meeting_notes
+        self.max_tokens = max_tokens
+        self.notes = ''
+        self.updates = 0
+        self.lines = []
+        self._summarized = 0
+        self._lock = threading.Lock()
+        # One update at a time, each one builds on the notes of the previous one
+        self._update_lock = threading.Lock()
+
+    def add(self, line):
+        with self._lock:
+            self.lines.append(line)
+
+    def pending_chars(self):
+        with self._lock:
+            return sum(len(line) + 1 for line in self.lines[self._summarized:])
+
+    def transcription(self):
+        with self._lock:
+            return '\n'.join(self.lines)
+
+    def update(self):
+        """
+        Fold the lines added since the previous update into the notes.
+        Returns the LlmResponse, or None when nothing new was said.
+        """
+        with self._update_lock:
+            with self._lock:
+                delta = self.lines[self._summarized:]
+                summarized = len(self.lines)
+            if not delta:
+                return None
+            delta = '\n'.join(delta)
+            with span('live.update', chars=len(delta)) as current:
+                response = self.llm.generate(build_update_prompt(self.notes, delta, self.user_prompt,
+                                                                 self.attendees_agenda, self.meeting_notes),
+                                             max_tokens=self.max_tokens)
+                current.set(input_tokens=response.input_tokens, output_tokens=response.output_tokens)
+            self.notes = response.text
+            self.updates += 1
+            with self._lock:
+                self._summarized = summarized
+            return response
+
+
+class LiveMeeting:
+    """
+    A meeting transcribed and summarized while it happens. Audio goes in
+    through send(); a background thread updates the notes every interval
+    seconds once min_delta_chars were said, and calls on_notes(notes) after
+    each update. end() returns the final notes, after one last update with
+    what was said since the previous one.
+    """
+
+    def __init__(self, transcriber, summary, interval=SUMMARY_INTERVAL_SECONDS,
+                 min_delta_chars=SUMMARY_MIN_DELTA_CHARS, on_notes=None):
+        self.transcriber = transcriber
+        self.summary = summary
+        self.interval = interval
+        self.min_delta_chars = min_delta_chars
+        self.on_notes = on_notes
+        self.audio_bytes = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.transcriber.start(self._on_segment)
+        self._thread = threading.Thread(target=self._run, name='live-summary', daemon=True)
+        self._thread.start()
+
+    def _on_segment(self, speaker, start, end, text):
+        text = text.strip()
+        if text:
+            self.summary.add(f'{speaker}: {text}' if speaker else text)
+
+    def send(self, chunk):
+        self.audio_bytes += len(chunk)
+        self.transcriber.send(chunk)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if self.summary.pending_chars() >= self.min_delta_chars:
+                self._update()
+
+    def _update(self):
+        try:
+            response = self.summary.update()
+        except Exception as e:
+            # The next update sends the same lines again
+            logger.warning('Error updating the live notes: %s', e)
+            return
+        if response is not None and self.on_notes is not None:
+            self.on_notes(response.text)
+
+    def end(self):
+        start = time.perf_counter()
+        self.transcriber.finish()
+        self._stopped.set()
+        self._thread.join()
+        self.summary.update()
+        logger.info('Final live notes ready %.1fs after the end of the audio, %d updates',
+                    time.perf_counter() - start, self.summary.updates)
+        return self.summary.notes
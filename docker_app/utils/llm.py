@@ -1,18 +1,98 @@
-import boto3
 import json
+import time
+
+from .cache import fingerprint
+from .clients import get_client, REGION_NAME
+from .telemetry import record_retries, span
+
+# Claude 3 Haiku, used by the meeting notes prompts
+MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+ANTHROPIC_VERSION = "bedrock-2023-05-31"
+
+# Minimum delay between two partial text refreshes while streaming, so the
+# page is not redrawn for every single token
+STREAM_REFRESH_SECONDS = 0.05
+
+
+def build_request(prompt, max_tokens=10000, temperature=0):
+    """
+    Build a Messages API request body for a single user prompt.
+    """
+    return json.dumps({
+        "anthropic_version": ANTHROPIC_VERSION,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "messages": [
+            {
+                "role": "user",
+                "content": [{"type": "text", "text": prompt}],
+            }
+        ],
+    })
+
+
+class LlmResponse:
+    """
+    Text generated by the model, with its timings and token usage.
+    """
+    __slots__ = ('text', 'time_to_first_token', 'total_time', 'input_tokens', 'output_tokens', 'cached')
+
+    def __init__(self, text, time_to_first_token=None, total_time=None, input_tokens=None, output_tokens=None,
+                 cached=False):
+        self.text = text
+        self.time_to_first_token = time_to_first_token
+        self.total_time = total_time
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cached = cached
+
+    def to_cache(self):
+        return {'text': self.text, 'input_tokens': self.input_tokens, 'output_tokens': self.output_tokens}
+
+    @classmethod
+    def from_cache(cls, value, elapsed):
+        return cls(value['text'], elapsed, elapsed, value['input_tokens'], value['output_tokens'], cached=True)
+
+
+def iter_stream_events(body):
+    """
+    Decode the chunks of an invoke_model_with_response_stream body into
+    Messages API events. Raises on error events sent in the stream.
+    """
+    for event in body:
+        if 'chunk' not in event:
+            # Stream errors are sent as events, e.g. throttlingException
+            error = next(iter(event.values()), {})
+            raise RuntimeError(f"{next(iter(event), 'error')}: {error.get('message', error)}")
+        yield json.loads(event['chunk']['bytes'])
 
 
 class Llm:
 
-    def __init__(self):
+    def __init__(self, client=None, model_id=MODEL_ID, cache=None, persist_cache=True):
         # Create Bedrock client
-        bedrock_client = boto3.client(
-            'bedrock-runtime',
-            # If Bedrock is not activated in us-east-1 in your account, set this value
-            # accordingly
-            region_name='us-east-1',
-        )
-        self.bedrock_client = bedrock_client
+        if client is None:
+            # If Bedrock is not activated in us-east-1 in your account, set
+            # REGION_NAME accordingly
+            client = get_client('bedrock-runtime', region_name=REGION_NAME)
+        self.bedrock_client = client
+        self.model_id = model_id
+        # Deterministic (temperature 0) answers are served from this cache when set
+        self.cache = cache
+        self.persist_cache = persist_cache
+
+    def _cache_key(self, body, temperature):
+        if self.cache is None or temperature != 0:
+            return None
+        return fingerprint(self.model_id, body)
+
+    def _cached(self, cache_key, start):
+        if cache_key is None:
+            return None
+        value = self.cache.get(cache_key)
+        if value is None:
+            return None
+        return LlmResponse.from_cache(value, time.perf_counter() - start)
 
     def invoke(self, input_text):
         """
@@ -39,3 +119,78 @@ class Llm:
         )
 
         return response
+
+    def generate(self, prompt, max_tokens=10000, temperature=0):
+        """
+        Generate the full answer to a prompt with a single blocking call.
+        """
+        with span('bedrock.generate', model=self.model_id, streaming=False) as current:
+            result = self._generate(prompt, max_tokens, temperature)
+            current.set(cached=result.cached, input_tokens=result.input_tokens, output_tokens=result.output_tokens)
+            return result
+
+    def _generate(self, prompt, max_tokens, temperature):
+        start = time.perf_counter()
+        body = build_request(prompt, max_tokens, temperature)
+        cache_key = self._cache_key(body, temperature)
+        result = self._cached(cache_key, start)
+        if result is not None:
+            return result
+
+        response = self.bedrock_client.invoke_model(modelId=self.model_id, body=body)
+        record_retries(response)
+        model_response = json.loads(response["body"].read())
+        elapsed = time.perf_counter() - start
+        usage = model_response.get("usage", {})
+        result = LlmResponse(model_response["content"][0]["text"], elapsed, elapsed,
+                             usage.get("input_tokens"), usage.get("output_tokens"))
+        if cache_key is not None:
+            self.cache.put(cache_key, result.to_cache(), self.persist_cache)
+        return result
+
+    def generate_stream(self, prompt, on_text, max_tokens=10000, temperature=0):
+        """
+        Generate the answer to a prompt token by token. on_text is called with
+        the text accumulated so far as it arrives, and once more at the end.
+        """
+        with span('bedrock.generate', model=self.model_id, streaming=True) as current:
+            result = self._generate_stream(prompt, on_text, max_tokens, temperature)
+            current.set(cached=result.cached, input_tokens=result.input_tokens, output_tokens=result.output_tokens,
+                        time_to_first_token=result.time_to_first_token)
+            return result
+
+    def _generate_stream(self, prompt, on_text, max_tokens, temperature):
+        start = time.perf_counter()
+        body = build_request(prompt, max_tokens, temperature)
+        cache_key = self._cache_key(body, temperature)
+        result = self._cached(cache_key, start)
+        if result is not None:
+            on_text(result.text)
+            return result
+
+        response = self.bedrock_client.invoke_model_with_response_stream(modelId=self.model_id, body=body)
+        record_retries(response)
+
+        parts = []
+        result = LlmResponse("")
+        last_refresh = 0
+        for event in iter_stream_events(response["body"]):
+            if event["type"] == "message_start":
+                result.input_tokens = event["message"].get("usage", {}).get("input_tokens")
+            elif event["type"] == "content_block_delta" and event["delta"].get("type") == "text_delta":
+                if result.time_to_first_token is None:
+                    result.time_to_first_token = time.perf_counter() - start
+                parts.append(event["delta"]["text"])
+                now = time.perf_counter()
+                if now - last_refresh >= STREAM_REFRESH_SECONDS:
+                    on_text("".join(parts))
+                    last_refresh = now
+            elif event["type"] == "message_delta":
+                result.output_tokens = event.get("usage", {}).get("output_tokens")
+
+        result.text = "".join(parts)
+        result.total_time = time.perf_counter() - start
+        on_text(result.text)
+        if cache_key is not None:
+            self.cache.put(cache_key, result.to_cache(), self.persist_cache)
+        return result
@@ -0,0 +1,144 @@
+import html
+import re
+
+# Sections of the meeting notes, in the order the prompts ask for them
+SECTIONS = ('DATE/TIME/LOCATION', 'INVITEES', 'AGENDA', 'ACTION ITEMS', 'DECISIONS', 'MEETING NOTES')
+
+# A review is only trusted when the model kept to the template
+MIN_SECTIONS = 3
+
+# Spaces per nesting level in the rendered review
+INDENT = 4
+
+# "**AGENDA**", "## Agenda:", "<b>AGENDA</b>", "AGENDA"...
+_HEADING = re.compile(r'^\s*(?:#+\s*)?(?:\*\*|__|<b>)?\s*(?P<name>[A-Za-z/ ]+?)\s*:?\s*(?:\*\*|__|</b>)?\s*:?\s*$')
+_BULLET = re.compile(r'^(?P<indent>\s*)(?:[*\-•+]|\d+[.)])\s+(?P<text>.*)$')
+_BOLD = re.compile(r'\*\*(.+?)\*\*')
+_SECTION_NAMES = {re.sub(r'\s+', ' ', name): name for name in SECTIONS}
+
+
+class NotesFormatError(ValueError):
+    pass
+
+
+class MeetingNotes:
+    """
+    Structured meeting notes: for each section, a list of (level, text)
+    items, level 0 being a top-level bullet.
+    """
+    __slots__ = ('sections',)
+
+    def __init__(self, sections=None):
+        self.sections = {name: [] for name in SECTIONS}
+        if sections:
+            for name, items in sections.items():
+                self.sections[name] = list(items)
+
+    def __eq__(self, other):
+        return isinstance(other, MeetingNotes) and self.sections == other.sections
+
+    def __repr__(self):
+        return f'MeetingNotes({self.sections!r})'
+
+    def items(self, name):
+        return self.sections[name]
+
+
+def section_name(line):
+    """
+    Name of the section a heading line opens, or None.
+    """
+    match = _HEADING.match(line)
+    if match is None:
+        return None
+    return _SECTION_NAMES.get(re.sub(r'\s+', ' ', match.group('name').strip().upper()))
+
+
+def parse_review(text, min_sections=MIN_SECTIONS):
+    """
+    Parse the bulleted review produced by the model into MeetingNotes.
+    Raises NotesFormatError when the text does not follow the template.
+    """
+    notes = MeetingNotes()
+    found = set()
+    current = None
+    indents = []
+    for line in text.splitlines():
+        if not line.strip() or line.strip() in ('<example>', '</example>'):
+            continue
+        name = section_name(line)
+        if name is not None:
+            current = name
+            found.add(name)
+            indents = []
+            continue
+        if current is None:
+            # Preamble such as "Here are the meeting notes:"
+            continue
+        match = _BULLET.match(line)
+        if match is None:
+            # A line without a bullet marker is an item of its own
+            notes.sections[current].append((0, line.strip()))
+            continue
+        indent = len(match.group('indent').expandtabs(INDENT))
+        # Nesting is relative to the indentation of the enclosing bullets
+        while indents and indent < indents[-1]:
+            indents.pop()
+        if not indents or indent > indents[-1]:
+            indents.append(indent)
+        notes.sections[current].append((len(indents) - 1, match.group('text').strip()))
+    if len(found) < min_sections:
+        raise NotesFormatError(f'Found {len(found)} of the {len(SECTIONS)} sections in the review')
+    return notes
+
+
+def render_review(notes):
+    """
+    Plain text bullets, as shown on the page.
+    """
+    blocks = []
+    for name in SECTIONS:
+        lines = [name]
+        for level, text in notes.items(name):
+            lines.append(' ' * INDENT * (level + 1) + '* ' + text)
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks)
+
+
+def _inline_html(text):
+    return _BOLD.sub(r'<b>\1</b>', html.escape(text, quote=False))
+
+
+def render_html(notes):
+    """
+    HTML document accepted by Quip: bold section names followed by lists.
+    """
+    parts = ['<html><body>']
+    for name in SECTIONS:
+        parts.append(f'<b>{html.escape(name)}</b>')
+        depth = 0
+        for level, text in notes.items(name):
+            level = min(level, depth)
+            while depth <= level:
+                parts.append('<ul>')
+                depth += 1
+            while depth > level + 1:
+                parts.append('</ul>')
+                depth -= 1
+            parts.append(f'<li>{_inline_html(text)}</li>')
+        parts.extend(['</ul>'] * depth)
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+
+def render_markdown(notes):
+    """
+    Markdown document, e.g. for a download or a wiki page.
+    """
+    blocks = []
+    for name in SECTIONS:
+        lines = [f'## {name.title()}', '']
+        for level, text in notes.items(name):
+            lines.append('  ' * level + '- ' + text)
+        blocks.append('\n'.join(lines).rstrip())
+    return '\n\n'.join(blocks) + '\n'
@@ -0,0 +1,747 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .audio import TimeMap, preprocess
+from .compaction import CompactionStats, compact_transcript
+from .llm import LlmResponse
+from .notes import SECTIONS, NotesFormatError, parse_review, render_html, render_markdown
+from .storage import (TRANSCRIBE_MEDIA_FORMATS, get_manifest, hash_fileobj, media_extension, media_key,
+                      object_exists, segment_media_key, segment_transcript_key, time_map_key,
+                      transcribe_media_format, transcript_key)
+from .streamlitutils import HTML_PROMPT_PREFIX, REVIEW_PROMPT_PREFIX, USER_PROMPT, write_to_quip
+from .summarize import MAX_WORKERS, generate_sections, regenerate_sections, summarize_transcript
+from .telemetry import record_retries, span
+from .transcript import dump_transcript, parse_transcript, stitch_transcripts
+from .transcription import transcription_job_name
+from .upload import MultipartUploader
+
+logger = logging.getLogger(__name__)
+
+# Transcriptions longer than this are summarized with map-reduce
+MAP_REDUCE_THRESHOLD_CHARS = 40000
+
+# Default number of recordings in each stage at once
+UPLOAD_CONCURRENCY = 4
+TRANSCRIBE_CONCURRENCY = 20
+SUMMARIZE_CONCURRENCY = 4
+
+TRANSCRIBE_TIMEOUT_SECONDS = 4 * 3600
+MAX_SPEAKERS = 10
+
+STAGES = ('upload', 'transcribe', 'summarize')
+
+
+def build_review_prompt(user_prompt, attendees_agenda, transcription, meeting_notes):
+    return REVIEW_PROMPT_PREFIX + user_prompt + ": \n" + attendees_agenda + "\n" + transcription + "\n" + meeting_notes
+
+
+def generate_review(llm, transcription, user_prompt, attendees_agenda, meeting_notes, on_text=None,
+                    map_reduce_threshold=MAP_REDUCE_THRESHOLD_CHARS, max_workers=MAX_WORKERS, parallel_sections=False,
+                    state=None):
+    """
+    Generate the meeting notes, with map-reduce for long transcriptions, and
+    one concurrent call per section with parallel_sections. Partial text is
+    streamed through on_text when given. With the ReviewState of the previous
+    review of the meeting, only the sections affected by what was edited
+    since are generated again, with a single call unless parallel_sections,
+    and the chunks of a long transcription are not summarized twice.
+    """
+    keep = None
+    if state is not None:
+        keep = state.reusable_sections(transcription, user_prompt, attendees_agenda, meeting_notes)
+        if len(keep) == len(SECTIONS):
+            # Nothing that matters changed
+            if on_text is not None:
+                on_text(state.review)
+            return LlmResponse(state.review, 0.0, 0.0, 0, 0, cached=True)
+    with span('summarize.review', reused_sections=len(keep or ())):
+        response = _generate_review(llm, transcription, user_prompt, attendees_agenda, meeting_notes, on_text,
+                                    map_reduce_threshold, max_workers, parallel_sections, keep,
+                                    state.chunk_summaries if state is not None else None)
+    if state is not None:
+        state.record(transcription, user_prompt, attendees_agenda, meeting_notes, response.text)
+    return response
+
+
+def _generate_review(llm, transcription, user_prompt, attendees_agenda, meeting_notes, on_text, map_reduce_threshold,
+                     max_workers, parallel_sections, keep, chunk_summaries):
+    if len(transcription) > map_reduce_threshold:
+        return summarize_transcript(llm, transcription, user_prompt, attendees_agenda, meeting_notes,
+                                    on_text=on_text, max_workers=max_workers, parallel_sections=parallel_sections,
+                                    keep=keep, chunk_summaries=chunk_summaries)
+    if parallel_sections:
+        return generate_sections(llm, transcription, user_prompt, attendees_agenda, meeting_notes, on_text, keep=keep,
+                                 max_workers=max_workers)
+    if keep:
+        # Only the sections an edit affects, in one call
+        return regenerate_sections(llm, transcription, user_prompt, attendees_agenda, meeting_notes, keep, on_text)
+    prompt = build_review_prompt(user_prompt, attendees_agenda, transcription, meeting_notes)
+    if on_text is not None:
+        return llm.generate_stream(prompt, on_text)
+    return llm.generate(prompt)
+
+
+def read_transcript(s3_client, bucket, key, time_map=None):
+    """
+    Parse a Transcribe output as it streams from S3. With the TimeMap of a
+    preprocessed recording, item times refer to the original recording.
+    """
+    with span('s3.read_transcript') as current:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        record_retries(response)
+        current.set(bytes=response.get('ContentLength'))
+        transcript = parse_transcript(response['Body'])
+        current.set(items=len(transcript))
+    if time_map is not None:
+        transcript.map_times(time_map.map_times)
+    return transcript
+
+
+def load_transcription(s3_client, bucket, prefix, digest, key, compaction_options=None):
+    """
+    Text of the transcript of a recording, as it goes into the prompt, and
+    the CompactionStats of its compaction, None when compaction_options is.
+    """
+    time_map = get_time_map(s3_client, bucket, prefix, digest)
+    transcript = read_transcript(s3_client, bucket, key, time_map)
+    if compaction_options is None:
+        return transcript.format_segments(), None
+    return compact_transcript(transcript, **compaction_options)
+
+
+def put_time_map(s3_client, bucket, prefix, digest, time_map):
+    s3_client.put_object(Bucket=bucket, Key=time_map_key(prefix, digest), Body=time_map.to_json().encode('utf-8'),
+                         ContentType='application/json')
+
+
+def get_time_map(s3_client, bucket, prefix, digest):
+    """
+    Return the TimeMap of a recording, or None if it was not preprocessed.
+    """
+    key = time_map_key(prefix, digest)
+    if not digest or not object_exists(s3_client, bucket, key):
+        return None
+    return TimeMap.from_json(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+
+def upload_segments(uploader, bucket, prefix, digest, segment_files, on_progress=None):
+    """
+    Upload the segment files written by audio.write_segments(), and remove them.
+    Returns the (media key, offset seconds, duration seconds) of each
+    segment. on_progress(done, total) follows the bytes of all the segments.
+    """
+    sizes = [os.path.getsize(path) for path, _, _ in segment_files]
+    total = sum(sizes)
+    segments = []
+    try:
+        for index, (path, offset, duration) in enumerate(segment_files):
+            key = segment_media_key(prefix, digest, index, path)
+            progress = None
+            if on_progress is not None:
+                done = sum(sizes[:index])
+                progress = lambda sent, _, done=done: on_progress(done + sent, total)
+            with open(path, 'rb') as fileobj:
+                uploader.upload(fileobj, bucket, key, sizes[index], on_progress=progress)
+            segments.append((key, offset, duration))
+    finally:
+        for path, _, _ in segment_files:
+            os.remove(path)
+    return segments
+
+
+def merge_segment_transcripts(s3_client, bucket, output_key, segments, job_name=''):
+    """
+    Stitch the transcripts of the segments of a recording, given as
+    (transcript key, media key, offset seconds, duration seconds), into one
+    Transcribe output at output_key. The segments are deleted once merged.
+    Returns the URI of the output.
+    """
+    parts = [(read_transcript(s3_client, bucket, key), offset, duration) for key, _, offset, duration in segments]
+    transcript = stitch_transcripts(parts)
+    s3_client.put_object(Bucket=bucket, Key=output_key, Body=dump_transcript(transcript, job_name).encode('utf-8'),
+                         ContentType='application/json')
+    for key, segment_media, _, _ in segments:
+        s3_client.delete_object(Bucket=bucket, Key=key)
+        s3_client.delete_object(Bucket=bucket, Key=segment_media)
+    logger.info('Merged %d segment transcripts into %s', len(segments), output_key)
+    return f's3://{bucket}/{output_key}'
+
+
+def start_split_transcription(tracker, s3_client, bucket, prefix, digest, segments, output_key,
+                              max_speakers=MAX_SPEAKERS):
+    """
+    Start one Transcribe job per segment of a recording, as returned by
+    upload_segments(). Returns the name of the job completing once their
+    transcripts are stitched into output_key, and its snapshot.
+    """
+    parts = []
+    merged = []
+    for index, (key, offset, duration) in enumerate(segments):
+        job_args = dict(
+            Media={'MediaFileUri': f's3://{bucket}/{key}'},
+            LanguageCode='en-US',
+            OutputBucketName=bucket,
+            Settings={'ShowSpeakerLabels': True, 'MaxSpeakerLabels': max_speakers},
+            **transcribe_media_format(key)
+        )
+        part_key = segment_transcript_key(prefix, digest, index)
+        parts.append((transcription_job_name(digest, job_args), part_key, job_args))
+        merged.append((part_key, key, offset, duration))
+    job_name = transcription_job_name(digest, {'Parts': [name for name, _, _ in parts]})
+    job = tracker.start_split_job(
+        job_name, parts, lambda _: merge_segment_transcripts(s3_client, bucket, output_key, merged, job_name),
+        output_key)
+    return job_name, job
+
+
+def delete_recording(s3_client, bucket, prefix, digest=None, media_key=None, transcript_key=None, tracker=None):
+    """
+    Delete the customer data of a recording: manifest entry, transcript and
+    media. The tracker, when given, forgets the job of the transcript.
+    """
+    if digest:
+        get_manifest(s3_client, bucket, prefix).delete(digest)
+        s3_client.delete_object(Bucket=bucket, Key=time_map_key(prefix, digest))
+    if transcript_key:
+        s3_client.delete_object(Bucket=bucket, Key=transcript_key)
+        if tracker is not None:
+            tracker.forget(transcript_key)
+    if media_key:
+        s3_client.delete_object(Bucket=bucket, Key=media_key)
+
+
+class LocalRecording:
+
+    def __init__(self, path, name=None):
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self.size = os.path.getsize(path)
+
+    def __repr__(self):
+        return f'LocalRecording({self.path!r})'
+
+
+class S3Recording:
+    """
+    A recording already in S3. It is transcribed in place, and identified by
+    its location and ETag since hashing it would mean downloading it.
+    """
+
+    def __init__(self, bucket, key, size, etag):
+        self.bucket = bucket
+        self.key = key
+        self.name = key.rsplit('/', 1)[-1]
+        self.size = size
+        self.digest = hashlib.sha256(f's3://{bucket}/{key}@{etag}'.encode('utf-8')).hexdigest()
+
+    def __repr__(self):
+        return f'S3Recording({self.bucket!r}, {self.key!r})'
+
+
+def list_local_recordings(directory):
+    paths = sorted(os.path.join(root, name) for root, _, names in os.walk(directory) for name in names)
+    return [LocalRecording(path) for path in paths if media_extension(path) in TRANSCRIBE_MEDIA_FORMATS]
+
+
+def list_s3_recordings(s3_client, bucket, prefix):
+    recordings = []
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if media_extension(obj['Key']) in TRANSCRIBE_MEDIA_FORMATS:
+                recordings.append(S3Recording(bucket, obj['Key'], obj['Size'], obj['ETag']))
+    return recordings
+
+
+class StageStats:
+    """
+    Latencies of one pipeline stage.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, failed=False):
+        with self._lock:
+            self.latencies.append(seconds)
+            if failed:
+                self.failures += 1
+
+    def percentile(self, fraction):
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+    def summary(self):
+        count = len(self.latencies)
+        return {
+            'count': count,
+            'failures': self.failures,
+            'mean': sum(self.latencies) / count if count else 0.0,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'max': max(self.latencies, default=0.0),
+        }
+
+
+class RecordingResult:
+    __slots__ = ('recording', 'digest', 'media_key', 'transcript_key', 'reused_transcript', 'output_path',
+                 'error', 'timings', 'compaction', 'segments')
+
+    def __init__(self, recording):
+        self.recording = recording
+        self.digest = None
+        self.media_key = None
+        self.transcript_key = None
+        self.reused_transcript = False
+        self.output_path = None
+        self.error = None
+        self.timings = {}
+        self.compaction = None
+        # (media key, offset, duration) of the segments of a recording transcribed in parts
+        self.segments = None
+
+
+class MeetingPipeline:
+    """
+    Upload, transcribe and summarize recordings without the web page.
+
+    Each recording goes through the stages in order on its own thread, and
+    a semaphore per stage bounds how many recordings are in that stage at
+    once: e.g. a few uploads and model calls, but many Transcribe jobs.
+    """
+
+    def __init__(self, s3_client, llm, tracker, bucket, prefix, output_dir, user_prompt=USER_PROMPT,
+                 upload_concurrency=UPLOAD_CONCURRENCY, transcribe_concurrency=TRANSCRIBE_CONCURRENCY,
+                 summarize_concurrency=SUMMARIZE_CONCURRENCY, uploader=None, delete_files=False,
+                 max_speakers=MAX_SPEAKERS, map_reduce_threshold=MAP_REDUCE_THRESHOLD_CHARS,
+                 transcribe_timeout=TRANSCRIBE_TIMEOUT_SECONDS, audio_options=None, compaction_options=None,
+                 split_options=None, parallel_sections=False):
+        self.s3_client = s3_client
+        self.llm = llm
+        self.tracker = tracker
+        self.bucket = bucket
+        self.prefix = prefix
+        self.output_dir = output_dir
+        self.user_prompt = user_prompt
+        self.uploader = uploader or MultipartUploader(s3_client)
+        self.delete_files = delete_files
+        self.max_speakers = max_speakers
+        self.map_reduce_threshold = map_reduce_threshold
+        self.transcribe_timeout = transcribe_timeout
+        # Options of audio.preprocess() for local recordings, None to upload them as they are
+        self.audio_options = audio_options
+        # Options of compact_transcript(), None to summarize the transcripts as they are
+        self.compaction_options = compaction_options
+        # The split option of audio.preprocess(): min_seconds, the length from which a
+        # preprocessed recording is transcribed in parallel segments; None for one job
+        self.split_options = split_options
+        # Generate the sections of the notes with concurrent calls
+        self.parallel_sections = parallel_sections
+        self.manifest = get_manifest(s3_client, bucket, prefix)
+        self.limits = {'upload': upload_concurrency, 'transcribe': transcribe_concurrency,
+                       'summarize': summarize_concurrency}
+        self._semaphores = {stage: threading.BoundedSemaphore(limit) for stage, limit in self.limits.items()}
+        self.stats = {stage: StageStats() for stage in STAGES}
+
+    def run(self, recordings, on_result=None):
+        """
+        Process every recording and return their results. on_result(result)
+        is called as each recording finishes.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        # Enough threads to keep every stage full
+        with ThreadPoolExecutor(max_workers=max(1, sum(self.limits.values()))) as executor:
+            futures = [executor.submit(self.process, recording) for recording in recordings]
+            for future in as_completed(futures):
+                if on_result is not None:
+                    on_result(future.result())
+        return [future.result() for future in futures]
+
+    def process(self, recording):
+        result = RecordingResult(recording)
+        with span('meeting', recording=recording.name) as current:
+            try:
+                self._stage('upload', result, self.upload)
+                self._stage('transcribe', result, self.transcribe)
+                self._stage('summarize', result, self.summarize)
+            except Exception as e:
+                logger.warning('Error processing %s: %s', recording.name, e)
+                result.error = current.error = str(e)
+        if self.delete_files:
+            try:
+                uploaded_media = result.media_key if isinstance(recording, LocalRecording) else None
+                delete_recording(self.s3_client, self.bucket, self.prefix, result.digest, uploaded_media,
+                                 result.transcript_key, self.tracker)
+            except Exception as e:
+                logger.warning('Error deleting the files of %s: %s', recording.name, e)
+        return result
+
+    def _stage(self, stage, result, func):
+        with span(f'stage.{stage}') as current:
+            waiting = time.perf_counter()
+            with self._semaphores[stage]:
+                start = time.perf_counter()
+                # Time spent queued behind the other recordings in this stage
+                current.set(wait_seconds=start - waiting)
+                failed = True
+                try:
+                    func(result)
+                    failed = False
+                finally:
+                    elapsed = time.perf_counter() - start
+                    result.timings[stage] = elapsed
+                    self.stats[stage].record(elapsed, failed)
+
+    def upload(self, result):
+        recording = result.recording
+        if isinstance(recording, S3Recording):
+            # Transcribed in place, nothing to upload
+            result.digest = recording.digest
+            result.media_key = recording.key
+            result.transcript_key = transcript_key(self.prefix, result.digest)
+            self._reuse_transcript(result)
+            return
+        with open(recording.path, 'rb') as fileobj:
+            result.digest = hash_fileobj(fileobj)
+            result.transcript_key = transcript_key(self.prefix, result.digest)
+            if self._reuse_transcript(result):
+                return
+            if self.audio_options is None:
+                result.media_key = media_key(self.prefix, result.digest, recording.name)
+                if not object_exists(self.s3_client, self.bucket, result.media_key):
+                    self.uploader.upload(fileobj, self.bucket, result.media_key, recording.size)
+                return
+        self._upload_preprocessed(result)
+
+    def _upload_preprocessed(self, result):
+        options = dict(self.audio_options)
+        output_format = options.setdefault('output_format', 'flac')
+        result.media_key = media_key(self.prefix, result.digest, f'audio.{output_format}')
+        if object_exists(self.s3_client, self.bucket, result.media_key):
+            return
+        fd, output_path = tempfile.mkstemp(suffix=f'.{output_format}')
+        os.close(fd)
+        try:
+            time_map, segment_files = preprocess(result.recording.path, output_path, split=self.split_options,
+                                                 **options)
+            # Written first, so that the map exists whenever the media does
+            put_time_map(self.s3_client, self.bucket, self.prefix, result.digest, time_map)
+            if segment_files is not None:
+                result.segments = upload_segments(self.uploader, self.bucket, self.prefix, result.digest,
+                                                  segment_files)
+                return
+            with open(output_path, 'rb') as processed:
+                self.uploader.upload(processed, self.bucket, result.media_key, os.path.getsize(output_path))
+        finally:
+            os.remove(output_path)
+
+    def _reuse_transcript(self, result):
+        entry = self.manifest.get(result.digest)
+        if entry is not None and object_exists(self.s3_client, self.bucket, entry['transcript_key']):
+            result.media_key = entry['media_key']
+            result.transcript_key = entry['transcript_key']
+            result.reused_transcript = True
+        return result.reused_transcript
+
+    def transcribe(self, result, job_name=None, on_started=None):
+        """
+        Transcribe the recording, or wait for job_name when a previous attempt
+        already started it. on_started(job_name) is called once a job starts.
+        """
+        if result.reused_transcript:
+            return
+        recording = result.recording
+        if job_name is not None and object_exists(self.s3_client, self.bucket, result.transcript_key):
+            return
+        if result.segments:
+            # Started again on a retry: the segment jobs still running or tracked are attached to
+            job_name, _ = start_split_transcription(self.tracker, self.s3_client, self.bucket, self.prefix,
+                                                    result.digest, result.segments, result.transcript_key,
+                                                    self.max_speakers)
+            if on_started is not None:
+                on_started(job_name)
+        elif job_name is not None:
+            self.tracker.track(job_name, result.transcript_key)
+        else:
+            bucket = recording.bucket if isinstance(recording, S3Recording) else self.bucket
+            job_args = dict(
+                Media={'MediaFileUri': f's3://{bucket}/{result.media_key}'},
+                LanguageCode='en-US',
+                OutputBucketName=self.bucket,
+                Settings={'ShowSpeakerLabels': True, 'MaxSpeakerLabels': self.max_speakers},
+                **transcribe_media_format(result.media_key)
+            )
+            # The same recording in another batch, or from the page, shares the job
+            job_name = transcription_job_name(result.digest, job_args)
+            self.tracker.start_job(job_name, output_key=result.transcript_key, **job_args)
+            if on_started is not None:
+                on_started(job_name)
+        job = self.tracker.wait(job_name, self.transcribe_timeout)
+        if job is None or job['status'] != 'COMPLETED':
+            reason = job['failure_reason'] if job is not None and job['status'] == 'FAILED' else 'timed out'
+            raise RuntimeError(f'Transcription job {job_name} failed: {reason}')
+        if not self.delete_files:
+            self.manifest.put(result.digest, result.media_key, result.transcript_key, recording.name)
+
+    def transcription(self, result):
+        """
+        Text of the transcript of a recording, as it goes into the prompt.
+        """
+        text, result.compaction = load_transcription(self.s3_client, self.bucket, self.prefix, result.digest,
+                                                     result.transcript_key, self.compaction_options)
+        if result.compaction is not None:
+            logger.info('Compacted the transcript of %s: %s', result.recording.name, result.compaction)
+        return text
+
+    def summarize(self, result):
+        transcription = self.transcription(result)
+        response = generate_review(self.llm, transcription, self.user_prompt, '', '',
+                                   map_reduce_threshold=self.map_reduce_threshold,
+                                   parallel_sections=self.parallel_sections)
+        try:
+            content = render_markdown(parse_review(response.text))
+        except NotesFormatError:
+            content = response.text
+        result.output_path = os.path.join(self.output_dir, os.path.splitext(result.recording.name)[0] + '.md')
+        with open(result.output_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+
+def quip_html(llm, review, user_prompt=USER_PROMPT):
+    """
+    Quip document of a review, rendered locally unless the review does not
+    follow the template.
+    """
+    try:
+        return render_html(parse_review(review))
+    except NotesFormatError:
+        prompt = HTML_PROMPT_PREFIX + user_prompt + ": \n" + review
+        return llm.generate(prompt).text
+
+
+def run_meeting_job(pipeline, state, checkpoint, quip_token=None):
+    """
+    Job handler running upload, transcribe, summarize and Quip for one
+    meeting. state holds the inputs of the job (spool_path or media_key,
+    filename, user_prompt, attendees_agenda, meeting_notes, delete_files and
+    optionally the quip location and doc_name) and receives the output of
+    each stage. A stage whose output is already in state is skipped, so a
+    retried job resumes where the previous attempt stopped. The notes are
+    written to Quip only when quip_token is given; workers get none, and
+    the page writes them with the token of the session. The checkpoint of
+    JobWorker raises LeaseLostError when another worker took the job over,
+    which stops it between stages.
+    """
+    if state.get('spool_path'):
+        recording = LocalRecording(state['spool_path'], state.get('filename'))
+    else:
+        recording = S3Recording(pipeline.bucket, state['media_key'], None, '')
+    result = RecordingResult(recording)
+
+    if 'transcript_key' not in state:
+        with span('stage.upload'):
+            pipeline.upload(result)
+        state.update(digest=result.digest, media_key=result.media_key, transcript_key=result.transcript_key,
+                     reused_transcript=result.reused_transcript, segments=result.segments)
+        checkpoint('upload')
+        if state.get('spool_path'):
+            os.remove(state['spool_path'])
+            state['spool_path'] = None
+    result.digest = state['digest']
+    result.media_key = state['media_key']
+    result.transcript_key = state['transcript_key']
+    result.reused_transcript = state['reused_transcript']
+    result.segments = state.get('segments')
+
+    if 'transcription' not in state:
+        def on_started(job_name):
+            state['transcription_job'] = job_name
+            checkpoint('transcribe')
+        with span('stage.transcribe'):
+            pipeline.transcribe(result, state.get('transcription_job'), on_started)
+            state['transcription'] = pipeline.transcription(result)
+        if result.compaction is not None:
+            state['compaction'] = result.compaction.to_dict()
+        checkpoint('transcribe')
+
+    if 'review' not in state:
+        with span('stage.summarize'):
+            response = generate_review(pipeline.llm, state['transcription'], state['user_prompt'],
+                                       state.get('attendees_agenda', ''), state.get('meeting_notes', ''),
+                                       map_reduce_threshold=pipeline.map_reduce_threshold,
+                                       parallel_sections=pipeline.parallel_sections)
+        state['review'] = response.text
+        checkpoint('summarize')
+
+    # The access token is never part of the state, which is persisted
+    quip = state.get('quip')
+    if quip and quip_token and 'quip_result' not in state:
+        with span('stage.quip'):
+            html = quip_html(pipeline.llm, state['review'], state['user_prompt'])
+            state['quip_result'] = write_to_quip(quip_token, quip.get('doc_name', ''), html, quip['location'])
+        checkpoint('quip')
+
+    if state.get('delete_files'):
+        delete_recording(pipeline.s3_client, pipeline.bucket, pipeline.prefix, result.digest, result.media_key,
+                         result.transcript_key, pipeline.tracker)
+    return state
+
+
+class MeetingChain:
+    """
+    The stages of a meeting run by the page, chained in the background so
+    that each starts as soon as its input is ready rather than on the next
+    click: a draft review of the typed notes while the recording is still
+    uploaded and transcribed, the review once the transcript is ready, then
+    finish(review), e.g. writing the Quip document.
+
+    The draft is speculative: it is the review of an empty transcription,
+    so a meeting without a transcript keeps it instead of another call.
+    summarize(transcription, on_text) returns an LlmResponse, and the page
+    follows the chain through snapshot(). Both calls record their review in
+    the ReviewState of the meeting, so the review only starts once the draft
+    has finished, usually long before the transcript is ready.
+    """
+
+    def __init__(self, summarize, trace_id=None):
+        self._summarize = summarize
+        self.trace_id = trace_id
+        self._lock = threading.Lock()
+        self._drafting = False
+        self._drafted = threading.Event()
+        # Set once a review is started or waits for its transcript
+        self._reviewing = False
+        self._threads = []
+        self._state = {
+            'stage': 'waiting',
+            'draft': None,
+            'draft_text': '',
+            'transcription': None,
+            'compaction': None,
+            'review': None,
+            'review_text': '',
+            'result': None,
+            'error': None,
+        }
+
+    def snapshot(self):
+        """
+        Copy of the state, 'busy' while a model call or finish() runs, and
+        'running' until the chain has nothing left to produce: also while a
+        review waits for its transcript, e.g. between the draft and the end
+        of the Transcribe job.
+        """
+        with self._lock:
+            snapshot = dict(self._state)
+            snapshot['busy'] = any(thread.is_alive() for thread in self._threads)
+            snapshot['running'] = snapshot['busy'] or (self._reviewing and
+                                                       snapshot['stage'] not in ('done', 'failed'))
+        return snapshot
+
+    def join(self, timeout=None):
+        for thread in list(self._threads):
+            thread.join(timeout)
+
+    def _set(self, **values):
+        with self._lock:
+            self._state.update(values)
+
+    def _start(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        with self._lock:
+            self._threads.append(thread)
+        thread.start()
+
+    def start_draft(self):
+        self._drafting = True
+        self._start(self._run_draft)
+
+    def _run_draft(self):
+        try:
+            with span('stage.draft', trace_id=self.trace_id):
+                response = self._summarize('', lambda text: self._set(draft_text=text))
+            self._set(draft=response, draft_text=response.text)
+        except Exception as e:
+            logger.warning('Error drafting the review: %s', e)
+        finally:
+            self._drafted.set()
+
+    def start_review(self, load_transcription, finish=None):
+        """
+        Summarize the text returned by load_transcription(), along with the
+        CompactionStats of the transcript or None, then call finish(review)
+        and keep what it returns as the result.
+        """
+        self._reviewing = True
+        self._set(stage='transcribe')
+        self._start(self._run_review, load_transcription, finish)
+
+    def on_transcribed(self, load_transcription, finish=None):
+        """
+        Tracker callback starting the review the moment the Transcribe job completes.
+        """
+        self._reviewing = True
+
+        def callback(job):
+            if job['status'] == 'COMPLETED':
+                self.start_review(load_transcription, finish)
+            else:
+                self._set(stage='failed', error=f"Transcription failed: {job['failure_reason']}")
+        return callback
+
+    def _run_review(self, load_transcription, finish):
+        try:
+            with span('stage.read_transcript', trace_id=self.trace_id):
+                transcription, compaction = load_transcription()
+            self._set(stage='summarize', transcription=transcription, compaction=compaction)
+            response = None
+            if self._drafting:
+                # The draft hands the ReviewState over, and is this very review without a transcript
+                self._drafted.wait()
+                if not transcription.strip():
+                    response = self.snapshot()['draft']
+            if response is None:
+                with span('stage.summarize', trace_id=self.trace_id):
+                    response = self._summarize(transcription, lambda text: self._set(review_text=text))
+            self._set(review=response, review_text=response.text)
+            if finish is not None:
+                self._set(stage='finish')
+                self._set(result=finish(response.text))
+            self._set(stage='done')
+        except Exception as e:
+            logger.warning('Error in the meeting chain: %s', e)
+            self._set(stage='failed', error=str(e))
+
+
+def format_report(results, stats, elapsed):
+    """
+    Throughput and per-stage latency of a batch run, as text.
+    """
+    succeeded = sum(1 for result in results if result.error is None)
+    lines = [
+        f'{succeeded} of {len(results)} recordings summarized in {elapsed:.1f}s '
+        f'({succeeded / elapsed * 3600 if elapsed else 0:.1f} recordings/hour)',
+        f"{'stage':<12} {'count':>6} {'failed':>7} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8}",
+    ]
+    for stage in STAGES:
+        summary = stats[stage].summary()
+        lines.append(f"{stage:<12} {summary['count']:>6} {summary['failures']:>7} {summary['mean']:>7.1f}s "
+                     f"{summary['p50']:>7.1f}s {summary['p95']:>7.1f}s {summary['max']:>7.1f}s")
+    compacted = [result.compaction for result in results if result.compaction is not None]
+    if compacted:
+        total = CompactionStats(original_tokens=sum(compaction.original_tokens for compaction in compacted),
+                                compacted_tokens=sum(compaction.compacted_tokens for compaction in compacted))
+        lines.append(f'Transcript tokens: {total.original_tokens} -> {total.compacted_tokens} after compaction '
+                     f'({total.reduction:.0%} less)')
+    for result in results:
+        if result.error is not None:
+            lines.append(f'FAILED {result.recording.name}: {result.error}')
+    return '\n'.join(lines)
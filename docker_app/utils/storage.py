@@ -0,0 +1,153 @@
+import hashlib
+import json
+import threading
+
+from botocore.exceptions import ClientError
+
+TRANSCRIBE_MEDIA_FORMATS = ('amr', 'flac', 'm4a', 'mp3', 'mp4', 'ogg', 'wav', 'webm')
+
+# Read size used when hashing recordings, keeps memory flat for large files
+HASH_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def hash_fileobj(fileobj, chunk_bytes=HASH_CHUNK_BYTES):
+    """
+    Return the SHA-256 hex digest of a file object, read in chunks. The file
+    position is restored to the start so the object can be uploaded next.
+    """
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(chunk_bytes), b''):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def media_extension(filename):
+    return filename.rsplit('.', 1)[-1].lower()
+
+
+def transcribe_media_format(key):
+    """
+    MediaFormat argument of a Transcribe job for a media key. Keys without a
+    known extension let Transcribe detect the format.
+    """
+    extension = media_extension(key)
+    if extension in TRANSCRIBE_MEDIA_FORMATS:
+        return {'MediaFormat': extension}
+    return {}
+
+
+def media_key(prefix, digest, filename):
+    """
+    S3 key of a recording, derived from its content rather than its name.
+    """
+    return f'{prefix}media/{digest}.{media_extension(filename)}'
+
+
+def transcript_key(prefix, digest):
+    return f'{prefix}transcripts/{digest}.json'
+
+
+def segment_media_key(prefix, digest, index, filename):
+    """
+    Key of one segment of a recording transcribed in parts.
+    """
+    return f'{prefix}media/{digest}.part{index:02d}.{media_extension(filename)}'
+
+
+def segment_transcript_key(prefix, digest, index):
+    return f'{prefix}transcripts/{digest}.part{index:02d}.json'
+
+
+def time_map_key(prefix, digest):
+    """
+    Key of the map from the preprocessed audio of a recording back to its
+    original timeline.
+    """
+    return f'{prefix}media/{digest}.timemap.json'
+
+
+def object_exists(s3_client, bucket, key):
+    try:
+        s3_client.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+
+class TranscriptManifest:
+    """
+    Maps the hash of a recording to the location of its media and transcript.
+
+    Entries are stored as one small S3 object per hash, so concurrent writers
+    never overwrite each other, and are cached in process once seen.
+    """
+
+    def __init__(self, s3_client, bucket, prefix):
+        self._s3_client = s3_client
+        self._bucket = bucket
+        self._prefix = f'{prefix}manifest/'
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _key(self, digest):
+        return f'{self._prefix}{digest}.json'
+
+    def get(self, digest):
+        """
+        Return the manifest entry of a recording, or None if it was never transcribed.
+        """
+        with self._lock:
+            if digest in self._entries:
+                return self._entries[digest]
+        try:
+            body = self._s3_client.get_object(Bucket=self._bucket, Key=self._key(digest))['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        entry = json.loads(body)
+        with self._lock:
+            self._entries[digest] = entry
+        return entry
+
+    def put(self, digest, media_key, transcript_key, filename=None):
+        entry = {'media_key': media_key, 'transcript_key': transcript_key, 'filename': filename}
+        self._s3_client.put_object(Bucket=self._bucket, Key=self._key(digest), Body=json.dumps(entry).encode('utf-8'),
+                                   ContentType='application/json')
+        with self._lock:
+            self._entries[digest] = entry
+        return entry
+
+    def record_when_completed(self, digest, media_key, transcript_key, filename=None):
+        """
+        Return a transcription tracker callback that adds the entry once the
+        job has completed, i.e. once the transcript exists.
+        """
+        def callback(job):
+            if job['status'] == 'COMPLETED':
+                self.put(digest, media_key, transcript_key, filename)
+        return callback
+
+    def delete(self, digest):
+        with self._lock:
+            self._entries.pop(digest, None)
+        self._s3_client.delete_object(Bucket=self._bucket, Key=self._key(digest))
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(s3_client, bucket, prefix):
+    """
+    Return the process-wide manifest of a bucket prefix, so its cache is
+    shared by every session.
+    """
+    with _manifests_lock:
+        if (bucket, prefix) not in _manifests:
+            _manifests[(bucket, prefix)] = TranscriptManifest(s3_client, bucket, prefix)
+        return _manifests[(bucket, prefix)]
@@ -1,7 +1,11 @@
 from datetime import datetime
-import pytz
+import json
+import logging
 import re
-import quipclient
+
+from .telemetry import span
+
+logger = logging.getLogger(__name__)
 
 BUCKET_NAME = "streamlit-meeting-summarizer"
 KEY = "ml_test/"
@@ -136,26 +140,31 @@ EXAMPLE_HTML = """ <example>
 <example>
 """
 
+# Fixed beginning of the prompts, joined once rather than on every call
+REVIEW_PROMPT_PREFIX = SYSTEM_PROMPT_REVIEW + "\n" + TEMPLATE_FORMAT + "\n" + EXAMPLE_REVIEW + "\n"
+HTML_PROMPT_PREFIX = SYSTEM_PROMPT_HTML + "\n" + TEMPLATE_FORMAT + "\n" + EXAMPLE_HTML + "\n"
+
 BASE_QUIP_URL = 'https://platform.quip-amazon.com'
 
 # define a function to convert current datetime in the format of mm-dd-yyyy-hh24-min-sec
 def get_current_datetime():
+    import pytz
+
     utc_dt = datetime.now(pytz.utc)
     return utc_dt.strftime("%m-%d-%Y-%H-%M-%S")
 
+# Characters and length S3 keys written by the app may have
+_S3_KEY_PATTERN = re.compile(r'^[a-zA-Z0-9-_.!*\'()/]{1,1024}$')
+_S3_KEY_DISALLOWED = re.compile(r'[^a-zA-Z0-9\-_.!*\'()/]+')
+
 # define a function to satisfy regular expression pattern: [a-zA-Z0-9-_.!*'()/]{1,1024}
 def conform_to_regex(input_string):
-    # Define the regular expression pattern
-    pattern = r'^[a-zA-Z0-9-_.!*\'()/]{1,1024}$'
     # Check if the input string matches the pattern
-    if re.match(pattern, input_string):
+    if _S3_KEY_PATTERN.match(input_string):
         return input_string
-    else:
-        # Remove characters that don't match the pattern
-        cleaned_string = ''.join(char for char in input_string if re.match(r'[a-zA-Z0-9-_.!*\'()/]', char))
-        # Truncate the string if it exceeds the maximum length
-        cleaned_string = cleaned_string[:1024]
-        return cleaned_string
+    # Remove characters that don't match the pattern, in one pass, and truncate the string
+    # if it exceeds the maximum length
+    return _S3_KEY_DISALLOWED.sub('', input_string)[:1024]
 
 # define a function to check filetype and return a boolean based on following filetypes 'mp3', 'mp4', 'm4a', 'x-m4a'
 def check_filetype(filetype):
@@ -166,33 +175,85 @@ def check_filetype(filetype):
     
 # define a function to return current time in the format of Jun, 28, 2024, 5:45 PM PT
 def get_current_time():
+    import pytz
+
     utc_dt = datetime.now(pytz.timezone('America/Los_Angeles'))
     return utc_dt.strftime("%b, %d, %Y, %I:%M %p %Z")
 
+# define a function to describe the latency of a model call, e.g. "First token after 0.8s, generated in 12.4s"
+def format_llm_timings(response):
+    if response.cached:
+        return f"Served from cache in {response.total_time:.2f}s"
+    timings = f"Generated in {response.total_time:.1f}s"
+    if response.time_to_first_token is not None:
+        timings = f"First token after {response.time_to_first_token:.1f}s, generated in {response.total_time:.1f}s"
+    if response.output_tokens is not None:
+        timings += f" ({response.output_tokens} tokens)"
+    return timings
+
+# define a function to describe the progress of an upload, e.g. "Uploading... 48 of 512 MB"
+def format_upload_progress(done, total):
+    return f"Uploading... {done / (1024 * 1024):.0f} of {total / (1024 * 1024):.0f} MB"
+
+# define a function returning the HTML of a timer that clicks the button labelled label after seconds,
+# so that the browser reruns the script and no script thread waits in between
+def render_rerun_timer(label, seconds, nonce):
+    # A new nonce on every run mounts a new timer, Streamlit keeps identical components as they are
+    label = json.dumps(label).replace('</', '<\\/')
+    return f"""<script>
+// {nonce}
+setTimeout(() => {{
+  const button = Array.from(window.parent.document.querySelectorAll('button'))
+    .find((button) => button.innerText.trim() === {label});
+  if (button) button.click();
+}}, {int(seconds * 1000)});
+</script>"""
+
 # Function to extract folder from quip location string
 def get_quip_folder(location):
     folder = location.split("/")[-2]
     return folder
 
-# Define a function to write the output of LLM to a new document in the quip folder / append to an existing document
-def write_to_quip(token, docname, content, quiplocation):
-    quip_location = get_quip_folder(quiplocation)
-    try:
-        quip_client = quipclient.QuipClient(access_token = token, base_url = BASE_QUIP_URL)
-        user = quip_client.get_authenticated_user()
-        if docname == "":
-            docname = "Meeting Notes"
+# define a function to return the Quip client of an access token, reused across the reruns of a session
+# through clients, e.g. a dict in its session state: no process-wide cache keeps the token after the session
+# quipclient is only imported by the pages that write to Quip
+def get_quip_client(token, clients=None):
+    import quipclient
 
+    if clients is None:
+        return quipclient.QuipClient(access_token = token, base_url = BASE_QUIP_URL)
+    if clients.get('token') != token:
+        # A single client per session, the one of its current token
+        clients.clear()
+        clients.update(token=token, client=quipclient.QuipClient(access_token = token, base_url = BASE_QUIP_URL))
+    return clients['client']
+
+# Define a function to write the output of LLM to a new document in the quip folder / append to an existing document
+def write_to_quip(token, docname, content, quiplocation, clients=None):
+    with span('quip.write', bytes=len(content.encode('utf-8'))) as current:
+        quip_location = get_quip_folder(quiplocation)
         try:
-            doc_location = quip_client.new_document(content, format="html", title=docname, member_ids=[quip_location])
-            doc_link = doc_location['thread']['link']
-            return "New meeting doc created: " + doc_link
-        except Exception as e:
+            quip_client = get_quip_client(token, clients)
+            user = quip_client.get_authenticated_user()
+            if docname == "":
+                docname = "Meeting Notes"
+
             try:
-                quip_client.edit_document(quip_location, content, operation="APPEND", format="html", section_id = None)
-                return "Quip doc has been updated with the notes: " + quiplocation
+                doc_location = quip_client.new_document(content, format="html", title=docname, member_ids=[quip_location])
+                doc_link = doc_location['thread']['link']
+                current.set(outcome="created")
+                return "New meeting doc created: " + doc_link
             except Exception as e:
-                print(e)
-                return "Please enter a valid quip folder or file location"
-    except Exception as e:
-        return "Please enter a valid quip access token"
+                # Not a folder, try the location as a document to append to
+                current.add("retries")
+                try:
+                    quip_client.edit_document(quip_location, content, operation="APPEND", format="html", section_id = None)
+                    current.set(outcome="appended")
+                    return "Quip doc has been updated with the notes: " + quiplocation
+                except Exception as e:
+                    logger.warning("Error writing to Quip location %s: %s", quiplocation, e)
+                    current.error = f"Invalid location: {e}"
+                    return "Please enter a valid quip folder or file location"
+        except Exception as e:
+            current.error = f"Invalid token: {e}"
+            return "Please enter a valid quip access token"
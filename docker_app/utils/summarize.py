@@ -0,0 +1,383 @@
+import contextvars
+import difflib
+import hashlib
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .llm import STREAM_REFRESH_SECONDS, LlmResponse
+from .notes import SECTIONS, section_name
+from .streamlitutils import SYSTEM_PROMPT_REVIEW, TEMPLATE_FORMAT, EXAMPLE_REVIEW
+from .telemetry import span
+
+# Size of the transcript chunks summarized in parallel
+CHUNK_CHARS = 12000
+CHUNK_OVERLAP_CHARS = 800
+CHUNK_MAX_TOKENS = 1500
+MAX_WORKERS = 4
+
+SYSTEM_PROMPT_CHUNK = """You are an expert in writing high quality meeting notes. You are given
+                one part of a longer meeting transcription. Extract, as concise bullets, every
+                date, time, location, participant name, agenda topic, action item (with its
+                owner and due date), decision and key discussion point found in this part.
+                Do not invent details that are not in the text, and do not add any preamble. \n\n"""
+
+SYSTEM_PROMPT_REDUCE = """The meeting transcription was too long to be read at once, so it has been
+                summarized part by part. The partial summaries below are in chronological order
+                and consecutive parts overlap slightly: merge duplicated items. \n\n"""
+
+# Output tokens of each section when the sections are generated concurrently,
+# instead of one budget for the whole review
+SECTION_MAX_TOKENS = {
+    'DATE/TIME/LOCATION': 200,
+    'INVITEES': 500,
+    'AGENDA': 600,
+    'ACTION ITEMS': 1500,
+    'DECISIONS': 1000,
+    'MEETING NOTES': 3000,
+}
+
+SECTION_INSTRUCTIONS = {
+    'DATE/TIME/LOCATION': 'the date and time of the meeting and where it took place',
+    'INVITEES': 'the people who attended or were invited, one per bullet',
+    'AGENDA': 'the topics discussed, in the order they came up',
+    'ACTION ITEMS': 'every task agreed on, with its owner and due date when they are mentioned',
+    'DECISIONS': 'every decision that was made',
+    'MEETING NOTES': 'the key points of the discussion, with as much detail as possible',
+}
+
+SECTION_PROMPT = """
+    Write only the {name} section of the meeting notes: {instructions}. Answer with
+    its bullets (* contents), without the section name, any other section or a preamble.
+    If the transcription and notes have no details for this section, answer with nothing.
+"""
+
+# Several sections regenerated by one call, after an edit of the notes
+SECTIONS_PROMPT = """
+    Write only these sections of the meeting notes, in this order, each under its name in
+    bold (**NAME**) followed by its bullets (* contents), without any other section or a preamble:
+{sections}
+    If the transcription and notes have no details for a section, leave it blank.
+"""
+
+# Fixed parts of the prompts, built once rather than on every call
+REDUCE_PROMPT_PREFIX = (SYSTEM_PROMPT_REVIEW + "\n" + SYSTEM_PROMPT_REDUCE + TEMPLATE_FORMAT + "\n"
+                        + EXAMPLE_REVIEW + "\n")
+SECTION_PROMPTS = {name: SECTION_PROMPT.format(name=name, instructions=instructions)
+                   for name, instructions in SECTION_INSTRUCTIONS.items()}
+
+# Words of an edited line of the notes that tie it to a section; an edited
+# line naming none of them affects the UNMATCHED_SECTIONS of its input
+SECTION_KEYWORDS = {
+    'DATE/TIME/LOCATION': ('date', 'time', 'when', 'where', 'location', 'room', 'venue', 'monday', 'tuesday',
+                           'wednesday', 'thursday', 'friday', 'saturday', 'sunday'),
+    'INVITEES': ('invitee', 'attendee', 'attended', 'participant', 'present', 'absent', 'joined'),
+    'AGENDA': ('agenda', 'topic', 'subject'),
+    'ACTION ITEMS': ('action', 'todo', 'to-do', 'to do', 'follow up', 'follow-up', 'owner', 'deadline', 'due',
+                     'assign', 'task', 'next step'),
+    'DECISIONS': ('decide', 'decision', 'agreed', 'approve', 'resolved', 'chose'),
+    'MEETING NOTES': ('discussion', 'discussed', 'key point', 'detail'),
+}
+
+# Sections any edit of an input affects, whatever it says: the prompt
+# instructs every section, so an edit of it regenerates them all
+INPUT_SECTIONS = {
+    'user_prompt': SECTIONS,
+    'attendees_agenda': ('INVITEES', 'AGENDA'),
+    'meeting_notes': ('MEETING NOTES',),
+}
+
+# Sections an edited line of the notes may change when it names none: a
+# typed note without a keyword can be a task
+UNMATCHED_SECTIONS = {
+    'attendees_agenda': ('INVITEES', 'AGENDA'),
+    'meeting_notes': ('ACTION ITEMS', 'DECISIONS', 'MEETING NOTES'),
+}
+
+# A speaker turn or transcript segment starts a new line; otherwise split on sentences
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+# The name or a keyword of a section, at the start of a word
+_SECTION_WORDS = {name: re.compile(r'\b(?:' + '|'.join(map(re.escape, (name, *keywords))) + ')', re.IGNORECASE)
+                  for name, keywords in SECTION_KEYWORDS.items()}
+
+
+def split_units(transcript):
+    """
+    Split a transcript into the smallest units a chunk boundary may fall
+    between: lines (speaker turns / segments) when present, sentences otherwise.
+    """
+    lines = [line for line in transcript.splitlines() if line.strip()]
+    if len(lines) > 1:
+        return lines
+    return [unit for unit in _SENTENCE_END.split(transcript) if unit]
+
+
+def chunk_transcript(transcript, chunk_chars=CHUNK_CHARS, overlap_chars=CHUNK_OVERLAP_CHARS):
+    """
+    Pack transcript units into chunks of about chunk_chars characters. Each
+    chunk repeats the trailing units of the previous one, up to overlap_chars,
+    so that no statement loses its context at a boundary.
+    """
+    chunks = []
+    current, size = [], 0
+    for unit in split_units(transcript):
+        if current and size + len(unit) > chunk_chars:
+            chunks.append(" ".join(current))
+            overlap, overlap_size = [], 0
+            for previous in reversed(current):
+                if overlap_size + len(previous) > overlap_chars:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += len(previous) + 1
+            current, size = overlap, overlap_size
+        current.append(unit)
+        size += len(unit) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def build_chunk_prompt(chunk, index, count):
+    return SYSTEM_PROMPT_CHUNK + f"Part {index + 1} of {count} of the transcription:\n" + chunk
+
+
+def format_partial_summaries(partial_summaries):
+    return "\n\n".join(f"<part{i + 1}>\n{summary}\n</part{i + 1}>" for i, summary in enumerate(partial_summaries))
+
+
+def build_reduce_prompt(partial_summaries, user_prompt, attendees_agenda, meeting_notes):
+    parts = format_partial_summaries(partial_summaries)
+    return REDUCE_PROMPT_PREFIX + user_prompt + ": \n" + attendees_agenda + "\n" + parts + "\n" + meeting_notes
+
+
+def summarize_chunks(llm, chunks, max_workers=MAX_WORKERS, max_tokens=CHUNK_MAX_TOKENS, summaries=None):
+    """
+    Summarize every chunk concurrently in a bounded thread pool. Returns the
+    summaries in transcript order. summaries, a dict keyed by the hash of
+    the chunk prompts, provides the summaries of earlier runs and receives
+    the new ones.
+    """
+    count = len(chunks)
+    summaries = {} if summaries is None else summaries
+    prompts = [build_chunk_prompt(chunk, i, count) for i, chunk in enumerate(chunks)]
+    keys = [hashlib.sha256(prompt.encode('utf-8')).hexdigest() for prompt in prompts]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Each call runs in a copy of the caller's context, so its span joins the caller's trace
+        futures = {key: executor.submit(contextvars.copy_context().run, llm.generate, prompt, max_tokens)
+                   for key, prompt in zip(keys, prompts) if key not in summaries}
+        for key, future in futures.items():
+            summaries[key] = future.result().text
+    return [summaries[key] for key in keys]
+
+
+def summarize_transcript(llm, transcript, user_prompt, attendees_agenda, meeting_notes, on_text=None,
+                         max_workers=MAX_WORKERS, chunk_chars=CHUNK_CHARS, overlap_chars=CHUNK_OVERLAP_CHARS,
+                         parallel_sections=False, keep=None, chunk_summaries=None):
+    """
+    Map-reduce summary of a long transcript: chunks are summarized in
+    parallel, then merged into the TEMPLATE_FORMAT sections by a final call
+    (one call per section with parallel_sections, or for the sections
+    missing from keep), streamed through on_text when given. See
+    generate_sections() for keep, and summarize_chunks() for chunk_summaries.
+    """
+    chunks = chunk_transcript(transcript, chunk_chars, overlap_chars)
+    with span('summarize.map', chunks=len(chunks)):
+        partial_summaries = summarize_chunks(llm, chunks, max_workers, summaries=chunk_summaries)
+    if parallel_sections:
+        return generate_sections(llm, SYSTEM_PROMPT_REDUCE + format_partial_summaries(partial_summaries),
+                                 user_prompt, attendees_agenda, meeting_notes, on_text, keep=keep,
+                                 max_workers=max_workers)
+    if keep:
+        return regenerate_sections(llm, SYSTEM_PROMPT_REDUCE + format_partial_summaries(partial_summaries),
+                                   user_prompt, attendees_agenda, meeting_notes, keep, on_text)
+    prompt = build_reduce_prompt(partial_summaries, user_prompt, attendees_agenda, meeting_notes)
+    if on_text is not None:
+        return llm.generate_stream(prompt, on_text)
+    return llm.generate(prompt)
+
+
+def build_section_prompt(name, user_prompt, attendees_agenda, transcription, meeting_notes):
+    # The instructions come last, so that the prompts of the sections share their beginning
+    return SYSTEM_PROMPT_REVIEW + "\n" + user_prompt + ": \n" + attendees_agenda + "\n" + transcription + "\n" \
+        + meeting_notes + "\n" + SECTION_PROMPTS[name]
+
+
+def build_sections_prompt(names, user_prompt, attendees_agenda, transcription, meeting_notes):
+    # Same beginning as the prompts of build_section_prompt()
+    sections = '\n'.join(f'    **{name}**: {SECTION_INSTRUCTIONS[name]}' for name in names)
+    return SYSTEM_PROMPT_REVIEW + "\n" + user_prompt + ": \n" + attendees_agenda + "\n" + transcription + "\n" \
+        + meeting_notes + "\n" + SECTIONS_PROMPT.format(sections=sections)
+
+
+def assemble_sections(texts):
+    """
+    Review in the layout of EXAMPLE_REVIEW from the text of each section. A
+    heading the model repeated despite the instructions is dropped.
+    """
+    blocks = []
+    for name in SECTIONS:
+        lines = texts.get(name, '').strip().splitlines()
+        if lines and section_name(lines[0]) == name:
+            lines = lines[1:]
+        blocks.append('\n'.join([f'**{name}**'] + lines).rstrip())
+    return '\n\n'.join(blocks)
+
+
+def split_sections(review):
+    """
+    Text of each section found in a review, by name, without its heading.
+    """
+    texts = {}
+    name = None
+    for line in review.splitlines():
+        heading = section_name(line)
+        if heading is not None:
+            name = heading
+            texts[name] = []
+        elif name is not None:
+            texts[name].append(line)
+    return {name: '\n'.join(lines).strip() for name, lines in texts.items()}
+
+
+def _edited_lines(previous, current):
+    return [line[2:] for line in difflib.ndiff(previous.splitlines(), current.splitlines())
+            if line[:2] in ('- ', '+ ') and line[2:].strip()]
+
+
+def affected_sections(previous, current):
+    """
+    Sections of the review that an edit of its inputs may change. previous
+    and current map user_prompt, attendees_agenda and meeting_notes to their
+    text. An edit affects the sections of INPUT_SECTIONS, every one for the
+    prompt. An edited line of the notes also affects the sections its words
+    are tied to in SECTION_KEYWORDS, or the UNMATCHED_SECTIONS of its input
+    when it names none of them.
+    """
+    affected = set()
+    for field in ('user_prompt', 'attendees_agenda', 'meeting_notes'):
+        lines = _edited_lines(previous[field], current[field])
+        if not lines:
+            continue
+        affected.update(INPUT_SECTIONS.get(field, ()))
+        for line in lines:
+            named = {name for name in SECTIONS if _SECTION_WORDS[name].search(line)}
+            affected.update(named or UNMATCHED_SECTIONS.get(field, SECTIONS))
+    return tuple(name for name in SECTIONS if name in affected)
+
+
+class ReviewState:
+    """
+    What the last review of a meeting was generated from, along with the
+    summaries of its transcript chunks, so that the next review only
+    regenerates the sections that an edit of the notes or of the prompt
+    affects. The transcription itself is only kept as a hash.
+    """
+    __slots__ = ('inputs', 'review', 'chunk_summaries')
+
+    def __init__(self):
+        self.inputs = None
+        self.review = None
+        self.chunk_summaries = {}
+
+    @staticmethod
+    def _inputs(transcription, user_prompt, attendees_agenda, meeting_notes):
+        return {'transcription': hashlib.sha256(transcription.encode('utf-8')).hexdigest(),
+                'user_prompt': user_prompt, 'attendees_agenda': attendees_agenda, 'meeting_notes': meeting_notes}
+
+    def reusable_sections(self, transcription, user_prompt, attendees_agenda, meeting_notes):
+        """
+        Text of the sections of the last review that are still valid for
+        these inputs, by name. None of them is once the transcription changed.
+        """
+        inputs = self._inputs(transcription, user_prompt, attendees_agenda, meeting_notes)
+        if self.inputs is None or self.inputs['transcription'] != inputs['transcription']:
+            return {}
+        affected = affected_sections(self.inputs, inputs)
+        return {name: text for name, text in split_sections(self.review).items() if name not in affected}
+
+    def record(self, transcription, user_prompt, attendees_agenda, meeting_notes, review):
+        self.inputs = self._inputs(transcription, user_prompt, attendees_agenda, meeting_notes)
+        self.review = review
+
+
+def generate_sections(llm, transcription, user_prompt, attendees_agenda, meeting_notes, on_text=None,
+                      max_tokens=SECTION_MAX_TOKENS, keep=None, max_workers=MAX_WORKERS):
+    """
+    Generate each section of the review with its own prompt and token budget,
+    max_workers at a time like the chunks of summarize_chunks(), and assemble
+    them in the order of SECTIONS: the review takes about as long as its
+    longest sections rather than the sum of them. With
+    on_text, the sections stream concurrently and on_text receives the
+    assembled text on the calling thread, e.g. the Streamlit script thread.
+    Sections whose text is given in keep are not generated again.
+    """
+    start = time.perf_counter()
+    keep = keep or {}
+    texts = {name: keep.get(name, '') for name in SECTIONS}
+    changed = threading.Event()
+
+    def generate(name):
+        prompt = build_section_prompt(name, user_prompt, attendees_agenda, transcription, meeting_notes)
+        with span('summarize.section', section=name):
+            if on_text is None:
+                return llm.generate(prompt, max_tokens[name])
+
+            def on_section_text(text):
+                texts[name] = text
+                changed.set()
+            return llm.generate_stream(prompt, on_section_text, max_tokens[name])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(contextvars.copy_context().run, generate, name)
+                   for name in SECTIONS if name not in keep}
+        pending = set(futures.values())
+        while pending:
+            _, pending = wait(pending, timeout=STREAM_REFRESH_SECONDS, return_when=FIRST_COMPLETED)
+            if changed.is_set():
+                changed.clear()
+                on_text(assemble_sections(texts))
+        responses = {name: future.result() for name, future in futures.items()}
+
+    text = assemble_sections({**keep, **{name: response.text for name, response in responses.items()}})
+    if on_text is not None:
+        on_text(text)
+    responses = list(responses.values())
+    first_tokens = [response.time_to_first_token for response in responses if response.time_to_first_token is not None]
+    return LlmResponse(text, min(first_tokens, default=None), time.perf_counter() - start,
+                       _total(response.input_tokens for response in responses),
+                       _total(response.output_tokens for response in responses),
+                       cached=all(response.cached for response in responses))
+
+
+def regenerate_sections(llm, transcription, user_prompt, attendees_agenda, meeting_notes, keep, on_text=None,
+                        max_tokens=SECTION_MAX_TOKENS):
+    """
+    Generate the sections missing from keep with a single call, within the
+    sum of their budgets, and assemble them with the kept ones: an edit
+    that affects several sections sends the transcription once rather than
+    once per section. With on_text, the assembled text is streamed.
+    """
+    names = [name for name in SECTIONS if name not in keep]
+    prompt = build_sections_prompt(names, user_prompt, attendees_agenda, transcription, meeting_notes)
+
+    def assemble(text):
+        texts = split_sections(text)
+        return assemble_sections({**keep, **{name: texts.get(name, '') for name in names}})
+
+    with span('summarize.sections', sections=len(names)):
+        if on_text is None:
+            response = llm.generate(prompt, sum(max_tokens[name] for name in names))
+        else:
+            response = llm.generate_stream(prompt, lambda text: on_text(assemble(text)),
+                                           sum(max_tokens[name] for name in names))
+    text = assemble(response.text)
+    if on_text is not None:
+        on_text(text)
+    return LlmResponse(text, response.time_to_first_token, response.total_time, response.input_tokens,
+                       response.output_tokens, cached=response.cached)
+
+
+def _total(counts):
+    counts = list(counts)
+    return None if None in counts else sum(counts)
\ No newline at end of file
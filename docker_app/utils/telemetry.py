@@ -0,0 +1,329 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+# One JSON line per finished span, queryable with CloudWatch Logs Insights
+span_logger = logging.getLogger('meeting_summarizer.spans')
+
+# Upper bounds of the duration histograms, from a cached model call to a long Transcribe job
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+# Numeric span attributes summed into counters
+COUNTED_ATTRIBUTES = ('bytes', 'input_tokens', 'output_tokens', 'retries')
+# Traces kept in memory for the timing panel
+RECENT_TRACES = 100
+MAX_SPANS_PER_TRACE = 500
+
+METRICS_PREFIX = 'meeting_summarizer'
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """
+    One timed operation: a stage of a meeting, a model call, an S3 read...
+    Spans opened while another one is current on the same thread (or in a
+    context copied from it) are its children and share its trace id.
+    """
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start', 'duration', 'attributes', 'error', '_lock')
+
+    def __init__(self, name, trace_id=None, parent_id=None, start=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id or new_trace_id()
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start = time.time() if start is None else start
+        self.duration = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self._lock = threading.Lock()
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update((name, value) for name, value in attributes.items() if value is not None)
+
+    def add(self, name, value=1):
+        """
+        Increment a numeric attribute, e.g. retries, from any thread.
+        """
+        with self._lock:
+            self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration': self.duration,
+            'error': self.error,
+            **self.attributes,
+        }
+
+
+def current_span():
+    return _current_span.get()
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class Telemetry:
+    """
+    Records spans: each one is logged as JSON, added to the per-stage
+    metrics exported in the Prometheus text format, and kept with its trace
+    for the timing panel.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS, recent_traces=RECENT_TRACES):
+        self.buckets = tuple(buckets)
+        self.recent_traces = recent_traces
+        self._lock = threading.Lock()
+        # name -> [count per bucket..., +Inf count, sum of durations]
+        self._durations = {}
+        self._errors = {}
+        self._counters = {}
+        self._traces = OrderedDict()
+
+    @contextmanager
+    def span(self, name, trace_id=None, **attributes):
+        """
+        Time the block as a span, yielded so that attributes can be set once
+        known. Errors are recorded on the span and raised again.
+        """
+        parent = _current_span.get()
+        if trace_id is None and parent is not None:
+            trace_id = parent.trace_id
+        span = Span(name, trace_id, parent.span_id if parent is not None and parent.trace_id == trace_id else None,
+                    attributes=attributes)
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            _current_span.reset(token)
+            self.record(span)
+
+    def record_span(self, name, start, duration, trace_id=None, parent_id=None, error=None, **attributes):
+        """
+        Record an operation timed elsewhere, e.g. a Transcribe job seen
+        finishing by the tracker thread.
+        """
+        span = Span(name, trace_id, parent_id, start, attributes)
+        span.duration = duration
+        span.error = error
+        self.record(span)
+        return span
+
+    def record(self, span):
+        value = span.to_dict()
+        with self._lock:
+            durations = self._durations.get(span.name)
+            if durations is None:
+                durations = self._durations[span.name] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if span.duration <= bound:
+                    durations[i] += 1
+            durations[-2] += 1
+            durations[-1] += span.duration
+            if span.error is not None:
+                self._errors[span.name] = self._errors.get(span.name, 0) + 1
+            for attribute in COUNTED_ATTRIBUTES:
+                amount = span.attributes.get(attribute)
+                if isinstance(amount, (int, float)) and amount:
+                    key = (attribute, span.name)
+                    self._counters[key] = self._counters.get(key, 0) + amount
+            spans = self._traces.pop(span.trace_id, None) or []
+            if len(spans) < MAX_SPANS_PER_TRACE:
+                spans.append(value)
+            self._traces[span.trace_id] = spans
+            while len(self._traces) > self.recent_traces:
+                self._traces.popitem(last=False)
+        span_logger.info('span %s %.3fs', span.name, span.duration, extra={'span': value})
+
+    def trace(self, trace_id):
+        """
+        The spans of a recent trace, in start order.
+        """
+        with self._lock:
+            spans = list(self._traces.get(trace_id, ()))
+        return sorted(spans, key=lambda span: span['start'])
+
+    def stage_summary(self):
+        """
+        Count, errors, mean and the bucket holding the p50 and p95 of each
+        span name, for a quick look without a metrics backend.
+        """
+        with self._lock:
+            durations = {name: list(values) for name, values in self._durations.items()}
+            errors = dict(self._errors)
+        rows = []
+        for name, values in sorted(durations.items()):
+            count = values[-2]
+            rows.append({
+                'stage': name,
+                'count': count,
+                'errors': errors.get(name, 0),
+                'mean_seconds': round(values[-1] / count, 3) if count else 0.0,
+                'p50_under_seconds': self._quantile_bound(values, count, 0.5),
+                'p95_under_seconds': self._quantile_bound(values, count, 0.95),
+            })
+        return rows
+
+    def _quantile_bound(self, values, count, fraction):
+        for bound, cumulative in zip(self.buckets, values):
+            if cumulative >= fraction * count:
+                return bound
+        return float('inf')
+
+    def prometheus(self):
+        """
+        Metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            durations = {name: list(values) for name, values in self._durations.items()}
+            errors = dict(self._errors)
+            counters = dict(self._counters)
+        lines = [f'# HELP {METRICS_PREFIX}_stage_duration_seconds Duration of the meeting processing stages',
+                 f'# TYPE {METRICS_PREFIX}_stage_duration_seconds histogram']
+        for name, values in sorted(durations.items()):
+            for bound, cumulative in zip(self.buckets, values):
+                lines.append(f'{METRICS_PREFIX}_stage_duration_seconds_bucket{_labels(stage=name, le=bound)} '
+                             f'{cumulative}')
+            lines.append(f'{METRICS_PREFIX}_stage_duration_seconds_bucket{_labels(stage=name, le="+Inf")} {values[-2]}')
+            lines.append(f'{METRICS_PREFIX}_stage_duration_seconds_sum{_labels(stage=name)} {values[-1]}')
+            lines.append(f'{METRICS_PREFIX}_stage_duration_seconds_count{_labels(stage=name)} {values[-2]}')
+        lines += [f'# HELP {METRICS_PREFIX}_stage_errors_total Stages that raised an error',
+                  f'# TYPE {METRICS_PREFIX}_stage_errors_total counter']
+        for name, count in sorted(errors.items()):
+            lines.append(f'{METRICS_PREFIX}_stage_errors_total{_labels(stage=name)} {count}')
+        for attribute in COUNTED_ATTRIBUTES:
+            metric = f'{METRICS_PREFIX}_{attribute}_total'
+            lines += [f'# HELP {metric} Sum of the {attribute} attribute of the stages', f'# TYPE {metric} counter']
+            for (counted, name), amount in sorted(counters.items()):
+                if counted == attribute:
+                    lines.append(f'{metric}{_labels(stage=name)} {amount}')
+        return '\n'.join(lines) + '\n'
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry():
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            _telemetry = Telemetry()
+        return _telemetry
+
+
+def span(name, trace_id=None, **attributes):
+    return get_telemetry().span(name, trace_id, **attributes)
+
+
+def record_retries(response, target=None):
+    """
+    Add the retries botocore made for a response to a span (the current one
+    by default).
+    """
+    target = target or _current_span.get()
+    retries = response.get('ResponseMetadata', {}).get('RetryAttempts', 0) if isinstance(response, dict) else 0
+    if target is not None and retries:
+        target.add('retries', retries)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, with the fields of the span when there is one.
+    """
+    converter = time.gmtime
+
+    def format(self, record):
+        value = {
+            'timestamp': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'span', None) is not None:
+            value['span'] = record.span
+        if record.exc_info:
+            value['exception'] = self.formatException(record.exc_info)
+        return json.dumps(value, default=str)
+
+
+_logging_configured = False
+
+
+def configure_logging(level=logging.INFO, json_format=True):
+    """
+    Log to stderr, as JSON lines by default, once per process. Spans are
+    logged at INFO level.
+    """
+    global _logging_configured
+    with _telemetry_lock:
+        if _logging_configured:
+            return
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter() if json_format
+                             else logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(level)
+        _logging_configured = True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = get_telemetry().prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not worth a log line each
+        pass
+
+
+_metrics_servers = {}
+
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """
+    Serve /metrics on a port from a background thread, once per process.
+    """
+    with _telemetry_lock:
+        if port not in _metrics_servers:
+            server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name=f'metrics-{port}', daemon=True).start()
+            _metrics_servers[port] = server
+            logger.info('Serving metrics on port %s', port)
+        return _metrics_servers[port]
@@ -0,0 +1,482 @@
+import bisect
+import codecs
+import json
+import re
+import sys
+from array import array
+from collections import Counter
+from difflib import SequenceMatcher
+from json import JSONDecodeError, JSONDecoder
+
+# Bytes read from the transcript body at a time
+READ_CHUNK_BYTES = 64 * 1024
+
+# A new segment starts on a speaker change or after a pause this long (seconds)
+SEGMENT_PAUSE_SECONDS = 1.5
+
+NO_SPEAKER = -1
+
+# Transcripts of overlapping segments are spliced on a run of at least this
+# many shared words; shorter matches are chance, the overlap is then cut in
+# the middle
+MIN_OVERLAP_MATCH_ITEMS = 4
+
+_WHITESPACE = re.compile(r'\s*')
+# Characters that matter when skipping over a value without decoding it
+_STRUCTURAL = re.compile(r'["\[\]{}]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+class TranscriptFormatError(ValueError):
+    pass
+
+
+class _JsonStream:
+    """
+    Minimal pull parser over a file object holding JSON. Values can be
+    decoded one at a time, or skipped without being built, so a document can
+    be walked while only a small window of it is held in memory.
+    """
+
+    def __init__(self, fileobj, chunk_bytes=READ_CHUNK_BYTES):
+        self._fileobj = fileobj
+        self._chunk_bytes = chunk_bytes
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=None):
+        """
+        Append at least one more chunk to the buffer, dropping consumed text.
+        """
+        if self.eof:
+            return False
+        data = self._fileobj.read(size or self._chunk_bytes)
+        if not data:
+            self.eof = True
+            text = self._decoder.decode(b'', final=True)
+        elif isinstance(data, str):
+            text = data
+        else:
+            text = self._decoder.decode(data)
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise TranscriptFormatError(f'Expected {char!r} at offset {self.pos}')
+        self.pos += 1
+
+    def accept(self, char):
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def value(self):
+        """
+        Decode the next value. The read size grows on each attempt, so a large
+        value costs a logarithmic number of decoding passes.
+        """
+        self.peek()
+        size = self._chunk_bytes
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buf, self.pos)
+                # A number may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except JSONDecodeError:
+                if self.eof:
+                    raise TranscriptFormatError(f'Invalid JSON value at offset {self.pos}')
+            size *= 2
+            self.fill(size)
+
+    def skip(self):
+        """
+        Skip the next value without building it.
+        """
+        if self.peek() not in '[{"':
+            self.value()
+            return
+        depth = 0
+        while True:
+            if self.pos >= len(self.buf) and not self.fill():
+                raise TranscriptFormatError('Unexpected end of transcript')
+            match = _STRUCTURAL.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+                continue
+            char = match.group()
+            self.pos = match.end()
+            if char == '"':
+                self._skip_string_body()
+                if depth == 0:
+                    return
+            elif char in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _skip_string_body(self):
+        while True:
+            match = _STRING_SPECIAL.search(self.buf, self.pos)
+            if match is None or (match.group() == '\\' and match.end() >= len(self.buf)):
+                if not self.fill():
+                    raise TranscriptFormatError('Unterminated string in transcript')
+                continue
+            if match.group() == '"':
+                self.pos = match.end()
+                return
+            # Skip the escaped character
+            self.pos = match.end() + 1
+
+    def members(self):
+        """
+        Iterate over the keys of the object at the current position. The
+        caller must consume or skip the value of each key.
+        """
+        self.expect('{')
+        if self.accept('}'):
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.accept('}'):
+                return
+            self.expect(',')
+
+    def elements(self):
+        """
+        Iterate over the elements of the array at the current position.
+        """
+        self.expect('[')
+        if self.accept(']'):
+            return
+        while True:
+            yield self.value()
+            if self.accept(']'):
+                return
+            self.expect(',')
+
+
+class Segment:
+    """
+    Consecutive words of one speaker, without a long pause.
+    """
+    __slots__ = ('speaker', 'start', 'end', 'first', 'last', 'text')
+
+    def __init__(self, speaker, start, end, first, last, text):
+        self.speaker = speaker
+        self.start = start
+        self.end = end
+        self.first = first
+        self.last = last
+        self.text = text
+
+    def __repr__(self):
+        return f'Segment({self.speaker!r}, {self.start:.2f}-{self.end:.2f}, {self.text!r})'
+
+
+class Transcript:
+    """
+    Compact, column-oriented view of an Amazon Transcribe output.
+
+    Each item (word or punctuation mark) is a position in parallel arrays,
+    so a multi-hour meeting costs a few dozen bytes per word. Words are
+    interned and speakers are stored as indexes into speaker_names.
+    """
+    __slots__ = ('words', 'starts', 'ends', 'confidences', 'speakers', 'punctuation', 'speaker_names',
+                 '_speaker_index', 'full_text')
+
+    def __init__(self):
+        self.words = []
+        self.starts = array('d')
+        self.ends = array('d')
+        self.confidences = array('f')
+        self.speakers = array('h')
+        self.punctuation = array('b')
+        self.speaker_names = []
+        self._speaker_index = {}
+        # Text of results.transcripts, kept only when there are no items
+        self.full_text = ''
+
+    def __len__(self):
+        return len(self.words)
+
+    def speaker_id(self, label):
+        if label is None:
+            return NO_SPEAKER
+        index = self._speaker_index.get(label)
+        if index is None:
+            index = self._speaker_index[label] = len(self.speaker_names)
+            self.speaker_names.append(label)
+        return index
+
+    def append(self, word, start, end, confidence, speaker=NO_SPEAKER, punctuation=False):
+        self.words.append(sys.intern(word))
+        self.starts.append(start)
+        self.ends.append(end)
+        self.confidences.append(confidence)
+        self.speakers.append(speaker)
+        self.punctuation.append(1 if punctuation else 0)
+
+    def extend(self, other, first=0, last=None, speakers=None):
+        """
+        Append the items first..last of another transcript, renaming its
+        speaker labels through speakers (label -> label) when given.
+        """
+        last = len(other) if last is None else last
+        speakers = speakers or {}
+        ids = {NO_SPEAKER: NO_SPEAKER}
+        for i in range(first, last):
+            speaker = other.speakers[i]
+            if speaker not in ids:
+                label = other.speaker_names[speaker]
+                ids[speaker] = self.speaker_id(speakers.get(label, label))
+            self.append(other.words[i], other.starts[i], other.ends[i], other.confidences[i], ids[speaker],
+                        other.punctuation[i])
+
+    def truncate(self, count):
+        """
+        Drop the items after the first count.
+        """
+        del self.words[count:]
+        for column in (self.starts, self.ends, self.confidences, self.speakers, self.punctuation):
+            del column[count:]
+
+    def map_times(self, to_original):
+        """
+        Replace the item times by to_original(times), e.g. TimeMap.map_times
+        when the audio was trimmed before transcription.
+        """
+        self.starts = array('d', to_original(self.starts))
+        self.ends = array('d', to_original(self.ends))
+
+    def join(self, first=0, last=None):
+        """
+        Text of the items first..last, without spaces before punctuation.
+        """
+        last = len(self.words) if last is None else last
+        parts = []
+        for i in range(first, last):
+            if parts and not self.punctuation[i]:
+                parts.append(' ')
+            parts.append(self.words[i])
+        return ''.join(parts)
+
+    def text(self):
+        if not self.words:
+            return self.full_text
+        return self.join()
+
+    def segments(self, max_pause=SEGMENT_PAUSE_SECONDS):
+        """
+        Group the items into speaker turns, split on long pauses.
+        """
+        segments = []
+        first = 0
+        count = len(self.words)
+        for i in range(1, count + 1):
+            if i < count:
+                if self.punctuation[i]:
+                    continue
+                same_speaker = self.speakers[i] == self.speakers[first]
+                if same_speaker and self.starts[i] - self.ends[i - 1] <= max_pause:
+                    continue
+            speaker = self.speakers[first]
+            segments.append(Segment(self.speaker_names[speaker] if speaker != NO_SPEAKER else None,
+                                    self.starts[first], self.ends[i - 1], first, i, self.join(first, i)))
+            first = i
+        return segments
+
+    def format_segments(self, max_pause=SEGMENT_PAUSE_SECONDS):
+        """
+        One line per speaker turn ("spk_0: ..."), or the plain text when the
+        job was run without speaker identification.
+        """
+        if not self.speaker_names:
+            return self.text()
+        lines = []
+        for segment in self.segments(max_pause):
+            if lines and lines[-1][0] == segment.speaker:
+                lines[-1][1].append(segment.text)
+            else:
+                lines.append((segment.speaker, [segment.text]))
+        return '\n'.join(f'{speaker}: {" ".join(texts)}' for speaker, texts in lines)
+
+
+def _read_items(stream, transcript):
+    for item in stream.elements():
+        alternative = item['alternatives'][0]
+        speaker = transcript.speaker_id(item.get('speaker_label'))
+        if item['type'] == 'punctuation':
+            # Punctuation has no timing, it takes the end of the previous word
+            at = transcript.ends[-1] if len(transcript) else 0.0
+            transcript.append(alternative['content'], at, at, 1.0,
+                              transcript.speakers[-1] if len(transcript) else speaker, punctuation=True)
+        else:
+            transcript.append(alternative['content'], float(item['start_time']), float(item['end_time']),
+                              float(alternative.get('confidence', 1.0)), speaker)
+
+
+def _read_speaker_segments(stream):
+    """
+    Map item start times to speakers from the older results.speaker_labels
+    layout, for outputs whose items carry no speaker_label.
+    """
+    speakers = {}
+    for member in stream.members():
+        if member != 'segments':
+            stream.skip()
+            continue
+        for segment in stream.elements():
+            for item in segment.get('items', []):
+                speakers[float(item['start_time'])] = item['speaker_label']
+    return speakers
+
+
+def parse_transcript(fileobj, chunk_bytes=READ_CHUNK_BYTES):
+    """
+    Parse an Amazon Transcribe output from a file object (e.g. an S3
+    StreamingBody) incrementally, without loading the document in memory.
+    """
+    stream = _JsonStream(fileobj, chunk_bytes)
+    transcript = Transcript()
+    speaker_segments = None
+    full_text = ''
+    found_results = False
+    for member in stream.members():
+        if member != 'results':
+            stream.skip()
+            continue
+        found_results = True
+        for result_member in stream.members():
+            if result_member == 'items':
+                _read_items(stream, transcript)
+            elif result_member == 'transcripts':
+                transcripts = stream.value()
+                full_text = ' '.join(entry.get('transcript', '') for entry in transcripts)
+            elif result_member == 'speaker_labels':
+                speaker_segments = _read_speaker_segments(stream)
+            else:
+                stream.skip()
+    if not found_results:
+        raise TranscriptFormatError('No results in transcript')
+
+    if len(transcript) == 0:
+        transcript.full_text = full_text
+    elif speaker_segments and not transcript.speaker_names:
+        for i in range(len(transcript)):
+            if not transcript.punctuation[i]:
+                transcript.speakers[i] = transcript.speaker_id(speaker_segments.get(transcript.starts[i]))
+            elif i > 0:
+                transcript.speakers[i] = transcript.speakers[i - 1]
+    return transcript
+
+
+def dump_transcript(transcript, job_name=''):
+    """
+    Amazon Transcribe output of a transcript, as JSON text that
+    parse_transcript() reads back.
+    """
+    items = []
+    for i in range(len(transcript)):
+        speaker = transcript.speakers[i]
+        item = {'type': 'punctuation' if transcript.punctuation[i] else 'pronunciation'}
+        if not transcript.punctuation[i]:
+            item['start_time'] = f'{transcript.starts[i]:.3f}'
+            item['end_time'] = f'{transcript.ends[i]:.3f}'
+        if speaker != NO_SPEAKER:
+            item['speaker_label'] = transcript.speaker_names[speaker]
+        item['alternatives'] = [{'confidence': f'{transcript.confidences[i]:.4f}', 'content': transcript.words[i]}]
+        items.append(item)
+    return json.dumps({'jobName': job_name, 'results': {'transcripts': [{'transcript': transcript.text()}],
+                                                        'items': items}, 'status': 'COMPLETED'})
+
+
+def _splice(stitched, part, overlap_start, overlap_end):
+    """
+    Where the items of part take over from those of stitched, which both
+    cover overlap_start..overlap_end: returns the number of items of
+    stitched to keep, the first item of part to append, and the pairs of
+    speakers heard saying the same words on both sides.
+    """
+    first = bisect.bisect_left(stitched.starts, overlap_start)
+    last = bisect.bisect_right(part.starts, overlap_end)
+    ours = [word.lower() for word in stitched.words[first:]]
+    theirs = [word.lower() for word in part.words[:last]]
+    matcher = SequenceMatcher(None, ours, theirs, autojunk=False)
+    match = matcher.find_longest_match(0, len(ours), 0, len(theirs))
+    if match.size >= MIN_OVERLAP_MATCH_ITEMS:
+        # Both sides heard these words, cut in the middle of them
+        keep, start = first + match.a + match.size // 2, match.b + match.size // 2
+    else:
+        middle = (overlap_start + overlap_end) / 2
+        keep, start = bisect.bisect_left(stitched.starts, middle, first), bisect.bisect_left(part.starts, middle)
+        # Punctuation belongs with the word before it
+        while start < len(part) and part.punctuation[start]:
+            start += 1
+    pairs = Counter()
+    for block in matcher.get_matching_blocks():
+        if block.size >= MIN_OVERLAP_MATCH_ITEMS:
+            for offset in range(block.size):
+                pairs[part.speakers[block.b + offset], stitched.speakers[first + block.a + offset]] += 1
+    return keep, start, pairs
+
+
+def stitch_transcripts(parts):
+    """
+    Join the transcripts of consecutive, overlapping segments of a
+    recording, given as (transcript, offset seconds, duration seconds) with
+    item times relative to their segment. Words transcribed on both sides of
+    an overlap are kept once.
+
+    Transcribe labels the speakers of each job independently, so the labels
+    of a segment are matched to those of the previous ones by who said the
+    words both sides share; speakers not heard in an overlap get new labels.
+    """
+    stitched = Transcript()
+    overlap_end = None
+    for part, offset, duration in parts:
+        part.map_times(lambda times: (time + offset for time in times))
+        keep, start, speakers = 0, 0, {}
+        if overlap_end is not None and len(stitched) and len(part):
+            keep, start, pairs = _splice(stitched, part, offset, overlap_end)
+            taken = set()
+            for (theirs, ours), _ in pairs.most_common():
+                if NO_SPEAKER in (theirs, ours) or part.speaker_names[theirs] in speakers or ours in taken:
+                    continue
+                speakers[part.speaker_names[theirs]] = stitched.speaker_names[ours]
+                taken.add(ours)
+            stitched.truncate(keep)
+        used = set(stitched.speaker_names)
+        for label in part.speaker_names:
+            if label not in speakers and label in used:
+                # A speaker of this segment only, who must not be merged with an earlier one
+                index = len(stitched.speaker_names)
+                while f'spk_{index}' in used or f'spk_{index}' in part.speaker_names:
+                    index += 1
+                speakers[label] = f'spk_{index}'
+                used.add(speakers[label])
+        stitched.extend(part, start, speakers=speakers)
+        stitched.full_text = ' '.join(text for text in (stitched.full_text, part.full_text) if text)
+        overlap_end = offset + duration
+    if len(stitched):
+        stitched.full_text = ''
+    return stitched
@@ -0,0 +1,498 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from .clients import get_client, REGION_NAME
+from .telemetry import current_span, get_telemetry, record_retries, span
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('COMPLETED', 'FAILED')
+
+# Adaptive polling: start fast for short jobs, back off for long ones
+POLL_MIN_INTERVAL = 2.0
+POLL_MAX_INTERVAL = 30.0
+POLL_BACKOFF = 1.5
+
+# When this many jobs are due at once, resolve them with a single
+# list_transcription_jobs call instead of one get_transcription_job each
+BATCH_POLL_THRESHOLD = 5
+
+# Keep finished jobs around long enough for every session to read them
+TERMINAL_RETENTION_SECONDS = 3600
+
+JOB_NAME_PREFIX = 'transcribe-media-'
+
+
+def transcription_job_name(digest, job_args, prefix=JOB_NAME_PREFIX):
+    """
+    Name of the Transcribe job of a recording, from the hash of its content
+    and of the job settings. A recording submitted twice with the same
+    settings, e.g. from two tabs, maps to one job instead of paying for two.
+    """
+    settings = hashlib.sha256(json.dumps(job_args, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return f'{prefix}{digest[:32]}-{settings[:12]}'
+
+
+class TranscriptionJob:
+    """
+    State of a single Transcribe job, as seen by the tracker.
+    """
+    __slots__ = ('name', 'status', 'failure_reason', 'transcript_uri', 'output_key',
+                 'submitted_at', 'completed_at', 'next_poll', 'interval', 'polls', 'callbacks',
+                 'queue_seconds', 'run_seconds', 'trace', 'requesters', 'parts')
+
+    def __init__(self, name, output_key=None, status='IN_PROGRESS'):
+        self.name = name
+        self.status = status
+        self.failure_reason = None
+        self.transcript_uri = None
+        self.output_key = output_key
+        self.submitted_at = time.time()
+        self.completed_at = None
+        self.next_poll = self.submitted_at + POLL_MIN_INTERVAL
+        self.interval = POLL_MIN_INTERVAL
+        self.polls = 0
+        self.callbacks = []
+        # Time spent waiting for Transcribe capacity, then transcribing, when known
+        self.queue_seconds = None
+        self.run_seconds = None
+        # (trace id, span id) of the span that started the job
+        self.trace = None
+        # Sessions or pipelines that asked for this job
+        self.requesters = 1
+        # Names of the segment jobs of a recording transcribed in parts; such
+        # a job is not known to Transcribe and completes once they are merged
+        self.parts = None
+
+    @property
+    def done(self):
+        return self.status in TERMINAL_STATUSES
+
+    def snapshot(self):
+        return {
+            'name': self.name,
+            'status': self.status,
+            'failure_reason': self.failure_reason,
+            'transcript_uri': self.transcript_uri,
+            'output_key': self.output_key,
+            'submitted_at': self.submitted_at,
+            'completed_at': self.completed_at,
+            'polls': self.polls,
+            'queue_seconds': self.queue_seconds,
+            'run_seconds': self.run_seconds,
+            'requesters': self.requesters,
+            'parts': list(self.parts) if self.parts is not None else None,
+        }
+
+
+def job_durations(details):
+    """
+    Seconds a job waited in the Transcribe queue and then ran, from the
+    timestamps of a job description or summary (None when missing).
+    """
+    created, started, completed = (details.get(name) for name in ('CreationTime', 'StartTime', 'CompletionTime'))
+    queued = (started - created).total_seconds() if created and started else None
+    ran = (completed - started).total_seconds() if started and completed else None
+    return queued, ran
+
+
+class TranscriptionJobTracker:
+    """
+    Owns every in-flight Transcribe job of the process.
+
+    A single background thread polls the jobs with adaptive backoff and
+    publishes their state; Streamlit sessions only read from it, so no
+    script thread is blocked while a job runs. Completion events (for
+    example EventBridge notifications delivered via SQS) can be pushed
+    with notify(), which resolves a job without waiting for its next poll.
+    """
+
+    def __init__(self, client=None, region_name=REGION_NAME, job_name_prefix=JOB_NAME_PREFIX,
+                 delete_on_completion=True):
+        self._client = client
+        self._region_name = region_name
+        self._job_name_prefix = job_name_prefix
+        self._delete_on_completion = delete_on_completion
+        self._jobs = {}
+        self._lock = threading.Condition()
+        self._thread = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_client('transcribe', region_name=self._region_name)
+        return self._client
+
+    def start_job(self, job_name, output_key=None, **job_args):
+        """
+        Start a Transcribe job and track it until it reaches a terminal state.
+        When a job of that name is already tracked, or already exists in
+        Transcribe (started by another process), the caller attaches to it
+        instead. Only a failed job, or one forgotten with forget(), is
+        started again; a failed job left in Transcribe is deleted first.
+        """
+        with self._lock:
+            job = self._jobs.get(job_name)
+            if job is not None and job.status != 'FAILED':
+                job.requesters += 1
+                return job.snapshot()
+            # Registered before the call, so that concurrent requesters attach
+            # to it; not polled until started
+            job = self._add(job_name, output_key)
+            job.next_poll = time.time() + POLL_MAX_INTERVAL
+        try:
+            try:
+                self._start(job_name, output_key, job_args)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConflictException':
+                    raise
+                if not self._restart_failed(job_name, output_key, job_args):
+                    # Started by another process: follow it, starting with its current state
+                    logger.info('Transcription job %s already exists, attaching to it', job_name)
+                    job.interval = 0
+        except Exception as e:
+            self._finish(job, 'FAILED', None, str(e), delete=False)
+            raise
+        with self._lock:
+            job.next_poll = time.time() + job.interval
+            job.interval = job.interval or POLL_MIN_INTERVAL
+            self._lock.notify_all()
+            return job.snapshot()
+
+    def _start(self, job_name, output_key, job_args):
+        with span('transcribe.start', job=job_name):
+            record_retries(self.client.start_transcription_job(TranscriptionJobName=job_name,
+                                                               OutputKey=output_key, **job_args))
+
+    def _restart_failed(self, job_name, output_key, job_args):
+        """
+        Start again a job of that name that already exists in Transcribe and
+        failed, as it would otherwise be attached to and fail at once.
+        Returns False when the existing job is still alive or completed.
+        """
+        details = self.client.get_transcription_job(TranscriptionJobName=job_name)['TranscriptionJob']
+        if details['TranscriptionJobStatus'] != 'FAILED':
+            return False
+        logger.info('Transcription job %s failed before (%s), starting it again', job_name,
+                    details.get('FailureReason'))
+        self.client.delete_transcription_job(TranscriptionJobName=job_name)
+        self._start(job_name, output_key, job_args)
+        return True
+
+    def start_split_job(self, job_name, parts, merge, output_key=None):
+        """
+        Transcribe a recording cut into segments with one job per segment, in
+        parallel. parts holds the (job name, output key, job arguments) of
+        the segments; once they have all completed, merge(snapshots) runs on
+        its own thread, writes the joined transcript and returns its URI.
+        job_name then completes, and can be read, waited for and given
+        callbacks like any other job.
+        """
+        with self._lock:
+            job = self._jobs.get(job_name)
+            if job is not None and job.status != 'FAILED':
+                job.requesters += 1
+                return job.snapshot()
+            job = self._add(job_name, output_key)
+            job.parts = [name for name, _, _ in parts]
+        try:
+            for name, part_key, job_args in parts:
+                self.start_job(name, output_key=part_key, **job_args)
+        except Exception as e:
+            self._finish(job, 'FAILED', None, str(e), delete=False)
+            raise
+        remaining = set(job.parts)
+        snapshots = {}
+
+        def on_part_done(snapshot):
+            with self._lock:
+                snapshots[snapshot['name']] = snapshot
+                remaining.discard(snapshot['name'])
+                if job.done or (remaining and snapshot['status'] == 'COMPLETED'):
+                    return
+            if snapshot['status'] != 'COMPLETED':
+                self._finish(job, 'FAILED', None, f"Segment {snapshot['name']} failed: {snapshot['failure_reason']}",
+                             delete=False)
+                return
+            # Reading and writing transcripts must not hold up the poller thread
+            threading.Thread(target=self._merge, args=(job, merge, [snapshots[name] for name in job.parts]),
+                             name='transcription-merge', daemon=True).start()
+
+        for name in job.parts:
+            self.add_callback(name, on_part_done)
+        return self.get(job_name)
+
+    def _merge(self, job, merge, snapshots):
+        trace_id, _ = job.trace or (None, None)
+        try:
+            with span('transcribe.merge', trace_id, job=job.name, parts=len(snapshots)):
+                transcript_uri = merge(snapshots)
+        except Exception as e:
+            logger.warning('Error merging the segments of transcription job %s: %s', job.name, e)
+            self._finish(job, 'FAILED', None, f'Could not merge the segments: {e}', delete=False)
+            return
+        self._finish(job, 'COMPLETED', transcript_uri, None, delete=False)
+
+    def track(self, job_name, output_key=None):
+        """
+        Track an already running job. Tracking the same job twice is a no-op,
+        so concurrent sessions share a single poller entry.
+        """
+        with self._lock:
+            job = self._jobs.get(job_name)
+            if job is None:
+                job = self._add(job_name, output_key)
+            else:
+                job.requesters += 1
+            self._ensure_thread()
+            return job.snapshot()
+
+    def forget(self, output_key):
+        """
+        Stop tracking the finished jobs that wrote output_key, once it is
+        deleted: submitting the recording again then starts a new job
+        instead of attaching to one whose transcript is gone.
+        """
+        with self._lock:
+            for name in [name for name, job in self._jobs.items() if job.done and job.output_key == output_key]:
+                del self._jobs[name]
+
+    def _add(self, job_name, output_key):
+        job = TranscriptionJob(job_name, output_key)
+        parent = current_span()
+        if parent is not None:
+            job.trace = (parent.trace_id, parent.span_id)
+        self._jobs[job_name] = job
+        self._lock.notify_all()
+        self._ensure_thread()
+        return job
+
+    def get(self, job_name):
+        """
+        Return a snapshot of the job state, or None if the job is unknown.
+        """
+        with self._lock:
+            job = self._jobs.get(job_name)
+            return job.snapshot() if job is not None else None
+
+    def wait(self, job_name, timeout=None):
+        """
+        Block until the job reaches a terminal state or the timeout expires.
+        Meant for headless callers; the Streamlit page should use get().
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while True:
+                job = self._jobs.get(job_name)
+                if job is None or job.done:
+                    return job.snapshot() if job is not None else None
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return job.snapshot()
+                self._lock.wait(remaining)
+
+    def add_callback(self, job_name, callback):
+        """
+        Call callback(snapshot) once the job reaches a terminal state.
+        """
+        with self._lock:
+            job = self._jobs[job_name]
+            if not job.done:
+                job.callbacks.append(callback)
+                return
+            snapshot = job.snapshot()
+        callback(snapshot)
+
+    def notify(self, job_name, status, transcript_uri=None, failure_reason=None):
+        """
+        Record a job state reported by a completion event.
+        """
+        with self._lock:
+            job = self._jobs.get(job_name)
+            if job is None or job.done:
+                return
+        if status in TERMINAL_STATUSES:
+            self._finish(job, status, transcript_uri, failure_reason)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='transcription-tracker', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._prune()
+                now = time.time()
+                # Split jobs complete through their parts, there is nothing to poll
+                pending = [job for job in self._jobs.values() if not job.done and job.parts is None]
+                if not pending:
+                    self._lock.wait(POLL_MAX_INTERVAL)
+                    continue
+                due = [job for job in pending if job.next_poll <= now]
+                if not due:
+                    self._lock.wait(min(job.next_poll for job in pending) - now)
+                    continue
+            try:
+                self._poll(due)
+            except Exception as e:
+                logger.warning('Error polling transcription jobs: %s', e)
+            with self._lock:
+                now = time.time()
+                for job in due:
+                    if not job.done:
+                        job.interval = min(job.interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+                        job.next_poll = now + job.interval
+
+    def _poll(self, due):
+        if len(due) >= BATCH_POLL_THRESHOLD:
+            due = self._poll_batch(due)
+        for job in due:
+            job.polls += 1
+            try:
+                response = self.client.get_transcription_job(TranscriptionJobName=job.name)
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'BadRequestException':
+                    # Unknown to Transcribe, e.g. deleted once finished before a restart: it will never complete
+                    self._finish(job, 'FAILED', None, f'Transcription job not found: {e}', delete=False)
+                else:
+                    logger.warning('Error polling transcription job %s: %s', job.name, e)
+                continue
+            except Exception as e:
+                logger.warning('Error polling transcription job %s: %s', job.name, e)
+                continue
+            details = response['TranscriptionJob']
+            if details['TranscriptionJobStatus'] in TERMINAL_STATUSES:
+                self._finish(job, details['TranscriptionJobStatus'],
+                             details.get('Transcript', {}).get('TranscriptFileUri'),
+                             details.get('FailureReason'), details)
+
+    def _poll_batch(self, due):
+        """
+        Resolve many due jobs with one listing per terminal status. Returns
+        the jobs that still need an individual lookup.
+        """
+        by_name = {job.name: job for job in due}
+        for status in TERMINAL_STATUSES:
+            paginator = self.client.get_paginator('list_transcription_jobs')
+            pages = paginator.paginate(Status=status, JobNameContains=self._job_name_prefix,
+                                       PaginationConfig={'MaxItems': 500})
+            for page in pages:
+                for summary in page['TranscriptionJobSummaries']:
+                    job = by_name.pop(summary['TranscriptionJobName'], None)
+                    if job is None:
+                        continue
+                    if status == 'COMPLETED':
+                        # The summary carries no transcript URI, fetch it individually
+                        by_name[job.name] = job
+                        job.next_poll = 0
+                    else:
+                        self._finish(job, status, None, summary.get('FailureReason'), summary)
+        return [job for job in by_name.values() if job.next_poll == 0]
+
+    def _finish(self, job, status, transcript_uri, failure_reason, details=None, delete=True):
+        with self._lock:
+            if job.done:
+                return
+            job.status = status
+            job.transcript_uri = transcript_uri
+            job.failure_reason = failure_reason
+            job.completed_at = time.time()
+            if details is not None:
+                job.queue_seconds, job.run_seconds = job_durations(details)
+            callbacks, job.callbacks = job.callbacks, []
+            snapshot = job.snapshot()
+            self._lock.notify_all()
+        logger.info('Transcription job %s finished with status %s', job.name, status)
+        if delete and self._delete_on_completion:
+            try:
+                self.client.delete_transcription_job(TranscriptionJobName=job.name)
+            except Exception as e:
+                logger.warning('Error deleting transcription job %s: %s', job.name, e)
+        for callback in callbacks:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.warning('Error in transcription callback for %s: %s', job.name, e)
+        trace_id, parent_id = job.trace or (None, None)
+        get_telemetry().record_span('transcribe.job', job.submitted_at, job.completed_at - job.submitted_at,
+                                    trace_id, parent_id, error=failure_reason if status != 'COMPLETED' else None,
+                                    job=job.name, status=status, polls=job.polls, queue_seconds=job.queue_seconds,
+                                    run_seconds=job.run_seconds)
+
+    def _prune(self):
+        cutoff = time.time() - TERMINAL_RETENTION_SECONDS
+        for name in [name for name, job in self._jobs.items() if job.done and job.completed_at < cutoff]:
+            del self._jobs[name]
+
+
+class SqsEventSource:
+    """
+    Feed Transcribe "Job State Change" events from an SQS queue (targeted by
+    an EventBridge rule) into a tracker, so jobs resolve as soon as they finish.
+    """
+
+    def __init__(self, tracker, queue_url, client=None, region_name=REGION_NAME):
+        self._tracker = tracker
+        self._queue_url = queue_url
+        self._client = client or get_client('sqs', region_name=region_name)
+        self._thread = threading.Thread(target=self._run, name='transcription-events', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                response = self._client.receive_message(QueueUrl=self._queue_url, WaitTimeSeconds=20,
+                                                        MaxNumberOfMessages=10)
+            except Exception as e:
+                logger.warning('Error receiving transcription events: %s', e)
+                time.sleep(POLL_MAX_INTERVAL)
+                continue
+            for message in response.get('Messages', []):
+                # A bad message or a failed deletion must not stop the events of the other jobs
+                try:
+                    self._handle(message['Body'])
+                    self._client.delete_message(QueueUrl=self._queue_url, ReceiptHandle=message['ReceiptHandle'])
+                except Exception as e:
+                    logger.warning('Error handling transcription event %s: %s', message.get('MessageId'), e)
+
+    def _handle(self, body):
+        try:
+            detail = json.loads(body).get('detail', {})
+        except (ValueError, AttributeError):
+            logger.warning('Ignoring a transcription event that is not a JSON object: %.200s', body)
+            return
+        job_name = detail.get('TranscriptionJobName')
+        if job_name:
+            # Events carry no transcript URI; the output key is known to the tracker
+            self._tracker.notify(job_name, detail.get('TranscriptionJobStatus'),
+                                 failure_reason=detail.get('FailureReason'))
+
+
+_tracker = None
+_event_queue_urls = set()
+_tracker_lock = threading.Lock()
+
+
+def get_tracker(region_name=REGION_NAME, events_queue_url=None):
+    """
+    Return the process-wide tracker, creating it on first use. The events of
+    events_queue_url feed it from the first call that gives the queue, even
+    when the tracker was created by an earlier call without it.
+    """
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = TranscriptionJobTracker(region_name=region_name)
+        if events_queue_url and events_queue_url not in _event_queue_urls:
+            SqsEventSource(_tracker, events_queue_url, region_name=region_name).start()
+            _event_queue_urls.add(events_queue_url)
+        return _tracker
@@ -0,0 +1,174 @@
+import contextvars
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .telemetry import current_span, record_retries, span
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# S3 requires parts of at least 5 MiB (except the last one), and at most 10,000 parts
+MIN_PART_SIZE = 5 * MB
+MAX_PARTS = 10000
+
+PART_SIZE = 16 * MB
+MAX_CONCURRENCY = 8
+# Hard cap on the part data held in memory by one upload
+MAX_BUFFERED_BYTES = 64 * MB
+PART_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.5
+
+# One multipart upload of a key at a time in the process: two uploads of the
+# same recording would otherwise resume, then complete, the same upload id
+_key_locks = weakref.WeakValueDictionary()
+_key_locks_lock = threading.Lock()
+
+
+def _key_lock(bucket, key):
+    with _key_locks_lock:
+        lock = _key_locks.get((bucket, key))
+        if lock is None:
+            lock = _key_locks[(bucket, key)] = threading.Lock()
+        return lock
+
+
+class UploadError(Exception):
+    """
+    Raised when a part still fails after its retries. The multipart upload is
+    left open, so that uploading the same key again resumes it.
+    """
+
+    def __init__(self, message, upload_id):
+        super().__init__(message)
+        self.upload_id = upload_id
+
+
+class MultipartUploader:
+    """
+    Upload a file to S3 in parts sent concurrently by a thread pool.
+
+    Parts are read sequentially from the file object, and reading pauses
+    while the parts in flight reach max_buffered_bytes. A failed part is
+    retried on its own, and an upload interrupted for good is resumed from
+    its completed parts the next time the same key is uploaded. Uploads of
+    the same key by the threads of a process run one after the other.
+    """
+
+    def __init__(self, s3_client, part_size=PART_SIZE, max_concurrency=MAX_CONCURRENCY,
+                 max_buffered_bytes=MAX_BUFFERED_BYTES, retries=PART_RETRIES):
+        self.s3_client = s3_client
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_concurrency = max_concurrency
+        self.max_buffered_bytes = max(max_buffered_bytes, self.part_size)
+        self.retries = retries
+        # Exposed for benchmarks and tests
+        self.peak_buffered_bytes = 0
+
+    def upload(self, fileobj, bucket, key, size, on_progress=None):
+        """
+        Upload size bytes of fileobj to bucket/key. on_progress(done, total)
+        is called from the calling thread as parts complete; when an upload
+        is resumed, total only counts the parts still to send.
+        """
+        with span('s3.upload', bytes=size):
+            self._upload(fileobj, bucket, key, size, on_progress)
+
+    def _upload(self, fileobj, bucket, key, size, on_progress):
+        part_size = self.part_size
+        while size > part_size * MAX_PARTS:
+            part_size *= 2
+        if size <= part_size:
+            record_retries(self.s3_client.put_object(Bucket=bucket, Key=key, Body=fileobj.read()))
+            if on_progress is not None:
+                on_progress(size, size)
+            return
+
+        with _key_lock(bucket, key):
+            self._upload_parts(fileobj, bucket, key, size, part_size, on_progress)
+
+    def _upload_parts(self, fileobj, bucket, key, size, part_size, on_progress):
+        part_count = (size + part_size - 1) // part_size
+        upload_id, completed = self._resume_or_create(bucket, key, part_size)
+        completed = {number: etag for number, etag in completed.items() if number <= part_count}
+        current_span().set(parts=part_count, resumed_parts=len(completed))
+        # Progress of the parts still to send, the resumed ones are not counted again
+        total = size - sum(min(part_size, size - (number - 1) * part_size) for number in completed)
+        done = 0
+        if on_progress is not None and total:
+            on_progress(done, total)
+
+        in_flight = {}
+        buffered = 0
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for part_number in range(1, part_count + 1):
+                if part_number in completed:
+                    continue
+                length = min(part_size, size - (part_number - 1) * part_size)
+                # Bound the memory used by parts waiting to be sent
+                while in_flight and buffered + length > self.max_buffered_bytes:
+                    buffered, done = self._collect(in_flight, completed, buffered, done, total, on_progress)
+                fileobj.seek((part_number - 1) * part_size)
+                data = fileobj.read(length)
+                buffered += len(data)
+                self.peak_buffered_bytes = max(self.peak_buffered_bytes, buffered)
+                # The parts count their retries on the span of the upload
+                future = executor.submit(contextvars.copy_context().run, self._upload_part, bucket, key, upload_id,
+                                         part_number, data)
+                in_flight[future] = (part_number, len(data))
+            while in_flight:
+                buffered, done = self._collect(in_flight, completed, buffered, done, total, on_progress)
+
+        parts = [{'PartNumber': number, 'ETag': completed[number]} for number in sorted(completed)]
+        self.s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                 MultipartUpload={'Parts': parts})
+
+    def _collect(self, in_flight, completed, buffered, done, size, on_progress):
+        finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in finished:
+            part_number, length = in_flight.pop(future)
+            buffered -= length
+            completed[part_number] = future.result()
+            done += length
+        if on_progress is not None:
+            on_progress(done, size)
+        return buffered, done
+
+    def _upload_part(self, bucket, key, upload_id, part_number, data):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.s3_client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                      PartNumber=part_number, Body=data)
+                record_retries(response)
+                return response['ETag']
+            except Exception as e:
+                if attempt == self.retries:
+                    raise UploadError(f'Part {part_number} of {key} failed: {e}', upload_id) from e
+                if current_span() is not None:
+                    current_span().add('retries')
+                logger.warning('Retrying part %s of %s after error: %s', part_number, key, e)
+                time.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+    def _resume_or_create(self, bucket, key, part_size):
+        """
+        Return the id of an unfinished upload of the key and its completed
+        parts (number -> ETag), or of a new upload.
+        """
+        uploads = self.s3_client.list_multipart_uploads(Bucket=bucket, Prefix=key).get('Uploads', [])
+        uploads = sorted((upload for upload in uploads if upload['Key'] == key), key=lambda upload: upload['Initiated'])
+        if uploads:
+            upload_id = uploads[-1]['UploadId']
+            completed = {}
+            for page in self.s3_client.get_paginator('list_parts').paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+                for part in page.get('Parts', []):
+                    # Parts of an upload made with another part size cannot be reused
+                    if part['Size'] != part_size:
+                        continue
+                    completed[part['PartNumber']] = part['ETag']
+            logger.info('Resuming upload of %s with %s completed parts', key, len(completed))
+            return upload_id, completed
+        response = self.s3_client.create_multipart_upload(Bucket=bucket, Key=key)
+        return response['UploadId'], {}
@@ -0,0 +1,177 @@
+import io
+import json
+import os
+import wave
+
+import numpy as np
+import pytest
+
+from docker_app.utils import audio
+from docker_app.utils.audio import (SAMPLE_RATE, TimeMap, detect_speech, ffmpeg_available, frame_levels, preprocess,
+                                    preprocess_fileobj, split_file, split_ranges, trim_silences, write_pcm)
+from docker_app.utils.transcript import parse_transcript
+
+
+def tone(seconds, amplitude=0.3, frequency=220):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (amplitude * 32767 * np.sin(2 * np.pi * frequency * t)).astype(np.int16)
+
+
+def silence(seconds, noise=0.0):
+    samples = np.random.default_rng(0).normal(0, noise * 32767, int(seconds * SAMPLE_RATE)) if noise else \
+        np.zeros(int(seconds * SAMPLE_RATE))
+    return samples.astype(np.int16)
+
+
+def test_long_silences_are_cut_and_short_ones_kept():
+    samples = np.concatenate([silence(1), tone(2), silence(0.5), tone(1), silence(5), tone(2), silence(3)])
+    ranges = detect_speech(samples, min_silence=2.0, padding=0.2)
+    seconds = [(start / SAMPLE_RATE, end / SAMPLE_RATE) for start, end in ranges]
+    assert len(seconds) == 2
+    # The half-second pause stays inside the first range, with padding around the speech
+    assert seconds[0] == pytest.approx((0.8, 4.7), abs=0.05)
+    assert seconds[1] == pytest.approx((9.3, 11.7), abs=0.05)
+
+
+def test_threshold_follows_the_noise_floor():
+    noisy = np.concatenate([silence(3, noise=0.01), tone(2), silence(4, noise=0.01), tone(2)])
+    assert len(detect_speech(noisy, threshold_db=-60, min_silence=2.0, padding=0.0)) == 2
+
+
+def test_silence_only_keeps_nothing():
+    kept, time_map = trim_silences(silence(5))
+    assert len(kept) == 0
+    assert time_map.duration == 0
+
+
+def test_trim_time_map_points_back_to_the_original():
+    samples = np.concatenate([tone(2), silence(10), tone(3)])
+    kept, time_map = trim_silences(samples, min_silence=2.0, padding=0.0)
+    assert len(kept) / SAMPLE_RATE == pytest.approx(5.0, abs=0.05)
+    assert time_map.to_original(1.0) == pytest.approx(1.0, abs=0.05)
+    assert time_map.to_original(3.0) == pytest.approx(13.0, abs=0.05)
+
+
+def test_time_map():
+    time_map = TimeMap([(0.0, 5.0, 10.0), (10.0, 30.0, 5.0)])
+    assert time_map.duration == 15.0
+    assert [time_map.to_original(t) for t in (0.0, 9.0, 10.0, 12.5, 20.0)] == [5.0, 14.0, 30.0, 32.5, 35.0]
+    np.testing.assert_allclose(time_map.map_times([0.0, 9.0, 10.0, 12.5, 20.0]), [5.0, 14.0, 30.0, 32.5, 35.0])
+    assert TimeMap.from_json(time_map.to_json()).segments == time_map.segments
+    assert TimeMap([]).to_original(4.0) == 4.0
+
+
+def test_transcript_times_are_mapped():
+    items = [
+        {'start_time': '1.0', 'end_time': '1.5', 'type': 'pronunciation', 'speaker_label': 'spk_0',
+         'alternatives': [{'confidence': '0.99', 'content': 'Hello'}]},
+        {'start_time': '11.0', 'end_time': '11.5', 'type': 'pronunciation', 'speaker_label': 'spk_0',
+         'alternatives': [{'confidence': '0.99', 'content': 'again'}]},
+    ]
+    data = json.dumps({'results': {'transcripts': [{'transcript': 'Hello again'}], 'items': items}}).encode('utf-8')
+    transcript = parse_transcript(io.BytesIO(data))
+    transcript.map_times(TimeMap([(0.0, 0.0, 10.0), (10.0, 70.0, 5.0)]).map_times)
+    assert list(transcript.starts) == [1.0, 71.0]
+    assert list(transcript.ends) == [1.5, 71.5]
+
+
+def test_long_recordings_are_split_in_pauses_with_overlap():
+    # Speech with a pause a little after each 10 second mark
+    samples = np.concatenate([tone(11), silence(0.8), tone(9), silence(0.8), tone(9.4)])
+    ranges = split_ranges(samples, segment_seconds=10, overlap=1, search=2)
+    seconds = [(start / SAMPLE_RATE, end / SAMPLE_RATE) for start, end in ranges]
+    assert len(seconds) == 3
+    assert seconds[0][0] == 0 and seconds[-1][1] == len(samples) / SAMPLE_RATE
+    # Cut in the middle of the pauses, each segment running half the overlap past the cut
+    assert seconds[0][1] == pytest.approx(11.4 + 0.5, abs=0.1)
+    assert seconds[1] == pytest.approx((11.4 - 0.5, 21.2 + 0.5), abs=0.1)
+    assert split_ranges(samples, segment_seconds=60) == [(0, len(samples))]
+
+
+def chunked(samples, chunk_bytes):
+    data = samples.tobytes()
+    return [data[i:i + chunk_bytes] for i in range(0, len(data), chunk_bytes)]
+
+
+def test_levels_of_streamed_chunks_are_those_of_the_whole_audio():
+    samples = np.concatenate([tone(2), silence(1, noise=0.01), tone(1.37)])
+    # Chunks that do not end on frame boundaries
+    with write_pcm(chunked(samples, 1234)) as decoded:
+        assert decoded.sample_count == len(samples)
+        np.testing.assert_allclose(decoded.levels, frame_levels(samples))
+        assert b''.join(decoded.iter_range(100, 5000, chunk_bytes=1000)) == samples[100:5000].tobytes()
+
+
+def test_preprocess_streams_the_audio_and_splits_it_without_decoding_again(monkeypatch, tmp_path):
+    samples = np.concatenate([tone(6), silence(5), tone(3), silence(0.8), tone(9)])
+    decoded, encoded = [], {}
+    monkeypatch.setattr(audio, 'iter_pcm', lambda path, *args, **kwargs: decoded.append(path) or
+                        iter(chunked(samples, 10000)))
+    monkeypatch.setattr(audio, 'encode_pcm', lambda chunks, path, *args: encoded.update({path: b''.join(chunks)}))
+    output_path = str(tmp_path / 'audio.flac')
+
+    time_map, segments = preprocess('meeting.mp4', output_path, min_silence=2.0, padding=0.0,
+                                    split=dict(min_seconds=10, segment_seconds=9, overlap=1, search=2))
+
+    assert decoded == ['meeting.mp4']
+    kept = np.frombuffer(encoded.pop(output_path), dtype=np.int16)
+    assert len(kept) / SAMPLE_RATE == pytest.approx(18.8, abs=0.05)
+    assert time_map.to_original(7.0) == pytest.approx(12.0, abs=0.05)
+    # Cut in the short pause, which is kept
+    assert [value for _, offset, duration in segments for value in (offset, duration)] == \
+        pytest.approx([0, 9.9, 8.9, 9.9], abs=0.1)
+    assert [path for path, _, _ in segments] == list(encoded)
+    for path, offset, duration in segments:
+        start = int(round(offset * SAMPLE_RATE))
+        assert encoded[path] == kept[start:start + int(round(duration * SAMPLE_RATE))].tobytes()
+        os.remove(path)
+    assert not any(name.endswith('.raw') for name in os.listdir(audio.tempfile.gettempdir()))
+
+
+def test_preprocess_keeps_short_recordings_whole(monkeypatch, tmp_path):
+    samples = np.concatenate([tone(3), silence(1), tone(3)])
+    encoded = {}
+    monkeypatch.setattr(audio, 'iter_pcm', lambda *args, **kwargs: iter(chunked(samples, 4096)))
+    monkeypatch.setattr(audio, 'encode_pcm', lambda chunks, path, *args: encoded.update({path: b''.join(chunks)}))
+
+    time_map, segments = preprocess('short.mp4', str(tmp_path / 'audio.flac'), split=dict(min_seconds=60))
+
+    assert segments is None
+    assert time_map.duration == pytest.approx(7.0)
+    assert encoded[str(tmp_path / 'audio.flac')] == samples.tobytes()
+
+
+@pytest.mark.skipif(not ffmpeg_available(), reason='ffmpeg is not installed')
+def test_split_file(tmp_path):
+    path = str(tmp_path / 'audio.wav')
+    with wave.open(path, 'wb') as output:
+        output.setnchannels(1)
+        output.setsampwidth(2)
+        output.setframerate(SAMPLE_RATE)
+        output.writeframes(np.concatenate([tone(6), silence(1), tone(6)]).tobytes())
+    segments = split_file(path, output_format='flac', segment_seconds=6, overlap=1, search=2)
+    try:
+        assert [value for _, offset, duration in segments for value in (offset, duration)] == \
+            pytest.approx([0, 7, 6, 7], abs=0.1)
+        assert all(os.path.getsize(segment) > 0 for segment, _, _ in segments)
+    finally:
+        for segment, _, _ in segments:
+            os.remove(segment)
+
+
+@pytest.mark.skipif(not ffmpeg_available(), reason='ffmpeg is not installed')
+def test_preprocess_fileobj(tmp_path):
+    samples = np.concatenate([tone(2), silence(10), tone(2)])
+    source = io.BytesIO()
+    with wave.open(source, 'wb') as output:
+        output.setnchannels(1)
+        output.setsampwidth(2)
+        output.setframerate(SAMPLE_RATE)
+        output.writeframes(samples.tobytes())
+    output_path, time_map, segments = preprocess_fileobj(source, '.wav', 'flac', min_silence=2.0, padding=0.0)
+    try:
+        assert segments is None
+        assert time_map.duration == pytest.approx(4.0, abs=0.1)
+        assert time_map.to_original(3.0) == pytest.approx(13.0, abs=0.1)
+    finally:
+        os.remove(output_path)
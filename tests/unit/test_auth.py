@@ -0,0 +1,71 @@
+import json
+import threading
+
+from docker_app.utils import auth
+from docker_app.utils.auth import SecretCache
+
+
+class FakeSecretsManagerClient:
+
+    def __init__(self):
+        self.version = 1
+        self.calls = 0
+        self.refreshed = threading.Event()
+
+    def get_secret_value(self, SecretId):
+        self.calls += 1
+        self.refreshed.set()
+        return {'SecretString': json.dumps({'pool_id': f'us-east-1_v{self.version}'}),
+                'VersionId': f'v{self.version}'}
+
+
+def test_secret_is_fetched_once_within_ttl(monkeypatch):
+    client = FakeSecretsManagerClient()
+    cache = SecretCache(client=client, ttl=300, refresh_ahead=60)
+    now = [1000.0]
+    monkeypatch.setattr(auth.time, 'time', lambda: now[0])
+
+    assert cache.get('secret') == ({'pool_id': 'us-east-1_v1'}, 'v1')
+    now[0] += 100
+    cache.get('secret')
+    assert client.calls == 1
+
+    # A rotated secret is picked up once the entry expires
+    client.version = 2
+    now[0] += 300
+    assert cache.get('secret')[1] == 'v2'
+    assert client.calls == 2
+
+
+def test_secret_is_refreshed_in_the_background_before_expiry(monkeypatch):
+    client = FakeSecretsManagerClient()
+    cache = SecretCache(client=client, ttl=300, refresh_ahead=60)
+    now = [1000.0]
+    monkeypatch.setattr(auth.time, 'time', lambda: now[0])
+    cache.get('secret')
+    client.refreshed.clear()
+
+    client.version = 2
+    now[0] += 250
+    # Still served from memory while the refresh runs
+    assert cache.get('secret')[1] == 'v1'
+    assert client.refreshed.wait(5)
+    for _ in range(100):
+        if cache.get('secret')[1] == 'v2':
+            break
+        threading.Event().wait(0.01)
+    assert cache.get('secret')[1] == 'v2'
+
+
+def test_stale_secret_is_served_when_refresh_fails(monkeypatch):
+    client = FakeSecretsManagerClient()
+    cache = SecretCache(client=client, ttl=300, refresh_ahead=0)
+    now = [1000.0]
+    monkeypatch.setattr(auth.time, 'time', lambda: now[0])
+    cache.get('secret')
+
+    def fail(SecretId):
+        raise RuntimeError('throttled')
+    client.get_secret_value = fail
+    now[0] += 400
+    assert cache.get('secret')[1] == 'v1'
@@ -0,0 +1,28 @@
+import io
+
+import pytest
+
+from benchmarks.bench_hotpaths import CASES, compare, load_baselines, synthetic_transcript
+from docker_app.utils.transcript import parse_transcript
+
+
+def test_every_case_has_a_baseline():
+    assert sorted(load_baselines()) == sorted(CASES)
+
+
+def test_compare_flags_slowdowns_beyond_the_tolerance():
+    baselines = {'fast': 1.0, 'slow': 1.0}
+    assert compare({'fast': 1.4, 'slow': 2.5, 'new': 9.0}, baselines, tolerance=2.0) == ['slow']
+
+
+def test_synthetic_transcript_size_and_content():
+    data = synthetic_transcript(64 * 1024)
+    assert 64 * 1024 <= len(data) < 80 * 1024
+    transcript = parse_transcript(io.BytesIO(data))
+    assert len(transcript) > 200 and len(transcript.speaker_names) > 1
+
+
+@pytest.mark.parametrize('name', [name for name, (_, large) in CASES.items() if not large])
+def test_cases_run(name):
+    setup, _ = CASES[name]
+    assert setup()()
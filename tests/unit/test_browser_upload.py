@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from benchmarks.fakes import FakeS3Client
+from docker_app.utils.browser_upload import (abort_browser_upload, create_browser_upload, presign_browser_upload,
+                                             render_browser_upload)
+
+
+class PresigningS3Client(FakeS3Client):
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn, HttpMethod=None):
+        return f"https://s3/{Params['Key']}?{operation}&uploadId={Params['UploadId']}&part={Params.get('PartNumber')}"
+
+
+def test_browser_uploads_keep_the_extension_of_the_recording():
+    client = PresigningS3Client()
+
+    upload = create_browser_upload(client, 'bucket', 'meetings/', 'Weekly sync (1).M4A', max_parts=3)
+
+    assert upload['key'].startswith('meetings/media/direct-') and upload['key'].endswith('.m4a')
+    assert len(client.uploads) == 1 and len(upload['part_urls']) == 3
+    assert 'accept=".m4a"' in render_browser_upload(upload)
+    with pytest.raises(ValueError):
+        create_browser_upload(client, 'bucket', 'meetings/', 'notes.exe')
+    assert len(client.uploads) == 1
+
+
+def test_urls_are_presigned_again_for_the_same_upload():
+    client = PresigningS3Client()
+    upload = create_browser_upload(client, 'bucket', 'meetings/', 'meeting.mp3', max_parts=2, expires=10)
+
+    refreshed = presign_browser_upload(client, 'bucket', upload)
+
+    assert (refreshed['key'], refreshed['upload_id']) == (upload['key'], upload['upload_id'])
+    assert refreshed['expires_at'] > upload['expires_at'] and len(client.uploads) == 1
+    assert all(f"uploadId={upload['upload_id']}" in url for url in refreshed['part_urls'])
+    abort_browser_upload(client, 'bucket', refreshed)
+    assert client.uploads == {}
+
+
+def test_upload_data_cannot_close_the_script():
+    upload = {'extension': 'mp3', 'part_size': 1, 'concurrency': 1, 'part_urls': ['https://s3/</script>'],
+              'complete_url': ''}
+    html = render_browser_upload(upload)
+    data = html.split('const upload = ', 1)[1].split(';\n', 1)[0]
+    assert '</script>' not in data and json.loads(data)['part_urls'] == ['https://s3/</script>']
@@ -0,0 +1,38 @@
+from docker_app.utils.cache import DiskStore, LruCache, ResponseCache, fingerprint
+
+
+def test_lru_evicts_by_count_size_and_ttl():
+    cache = LruCache(max_entries=2, max_bytes=100, ttl=60)
+    cache.put('a', 1, 10)
+    cache.put('b', 2, 10)
+    cache.get('a')
+    cache.put('c', 3, 10)
+    assert cache.get('b') is None and cache.get('a') == 1
+
+    cache.put('d', 4, 95)
+    assert len(cache) == 1 and cache.get('d') == 4
+
+    expiring = LruCache(ttl=-1)
+    expiring.put('a', 1, 1)
+    assert expiring.get('a') is None
+
+
+def test_response_cache_falls_back_to_persistent_tier(tmp_path):
+    key = fingerprint('model', '{"prompt": "notes"}')
+    assert key != fingerprint('model', '{"prompt": "other notes"}')
+
+    ResponseCache(store=DiskStore(str(tmp_path))).put(key, {'text': 'cached notes'})
+    cache = ResponseCache(store=DiskStore(str(tmp_path)))
+
+    assert cache.get('unknown') is None
+    assert cache.get(key) == {'text': 'cached notes'}
+    assert cache.get(key) == {'text': 'cached notes'}
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['store_hits'] == 1
+    assert cache.stats()['memory_hits'] == 1
+
+
+def test_response_cache_skips_persistent_tier_when_asked(tmp_path):
+    ResponseCache(store=DiskStore(str(tmp_path))).put('key', {'text': 'private'}, persist=False)
+
+    assert ResponseCache(store=DiskStore(str(tmp_path))).get('key') is None
@@ -3,13 +3,53 @@ import aws_cdk.assertions as assertions
 
 from cdk.cdk_stack import CdkStack
 
-# example tests. To run these tests, uncomment this file along with the example
-# resource in cdk/cdk_stack.py
-def test_sqs_queue_created():
+def test_bucket_denies_insecure_transport_and_web_container_listens():
     app = core.App()
     stack = CdkStack(app, "cdk")
     template = assertions.Template.from_stack(stack)
 
-#     template.has_resource_properties("AWS::SQS::Queue", {
-#         "VisibilityTimeout": 300
-#     })
+    template.has_resource_properties("AWS::S3::BucketPolicy", {
+        "PolicyDocument": {
+            "Statement": assertions.Match.array_with([assertions.Match.object_like({
+                "Effect": "Deny",
+                "Condition": {"Bool": {"aws:SecureTransport": "false"}},
+            })])
+        },
+    })
+    template.has_resource_properties("AWS::ECS::TaskDefinition", {
+        "ContainerDefinitions": [assertions.Match.object_like({
+            "PortMappings": [assertions.Match.object_like({"ContainerPort": 8501, "Protocol": "tcp"})],
+        })],
+    })
+
+
+def test_bucket_accepts_browser_uploads():
+    app = core.App()
+    stack = CdkStack(app, "cdk")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::S3::Bucket", {
+        "CorsConfiguration": {
+            "CorsRules": [assertions.Match.object_like({
+                "AllowedMethods": ["PUT", "POST"],
+                "ExposedHeaders": ["ETag"],
+            })]
+        },
+        "LifecycleConfiguration": {
+            "Rules": [assertions.Match.object_like({
+                "AbortIncompleteMultipartUpload": {"DaysAfterInitiation": 1},
+            })]
+        },
+    })
+
+
+def test_target_group_checks_the_streamlit_health_endpoint():
+    app = core.App()
+    stack = CdkStack(app, "cdk")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::ElasticLoadBalancingV2::TargetGroup", {
+        "HealthCheckPath": "/_stcore/health",
+        "HealthCheckIntervalSeconds": 10,
+        "HealthyThresholdCount": 2,
+    })
@@ -0,0 +1,43 @@
+import threading
+
+from docker_app.utils import clients
+
+
+def test_get_client_builds_each_client_once():
+    built = []
+    results = []
+
+    class FakeSession:
+        def client(self, service_name, region_name=None, config=None):
+            built.append((service_name, region_name, config))
+            return object()
+
+    original_session, original_clients = clients._session, dict(clients._clients)
+    clients._session = FakeSession()
+    clients._clients.clear()
+    try:
+        threads = [threading.Thread(target=lambda: results.append(clients.get_client('s3')))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        clients.get_client('bedrock-runtime', region_name='us-east-1')
+    finally:
+        clients._session = original_session
+        clients._clients.clear()
+        clients._clients.update(original_clients)
+
+    assert len({id(client) for client in results}) == 1
+    assert [service for service, _, _ in built] == ['s3', 'bedrock-runtime']
+    assert built[0][2].max_pool_connections == clients.MAX_POOL_CONNECTIONS
+    assert built[1][2].read_timeout == 300
+
+
+def test_register_client_overrides_the_registry():
+    stand_in = object()
+    clients.register_client('transcribe', stand_in, region_name='eu-west-1')
+    try:
+        assert clients.get_client('transcribe', region_name='eu-west-1') is stand_in
+    finally:
+        clients._clients.pop(('transcribe', 'eu-west-1'))
@@ -0,0 +1,114 @@
+import io
+import json
+
+import pytest
+
+from benchmarks.eval_compaction import load_corpus, load_transcript, missing_keywords
+from docker_app.utils.compaction import (CompactionStats, collapse_repeats, compact_transcript, drop_fillers,
+                                         text_units)
+from docker_app.utils.transcript import parse_transcript
+
+
+def clean(text, step):
+    units = text_units(text)
+    step(units)
+    return ' '.join(word + punctuation for word, punctuation in units)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Um, so we ship on Friday.', 'So we ship on Friday.'),
+    ('We need to, you know, ship it.', 'We need to ship it.'),
+    ('You know the budget is fine.', 'You know the budget is fine.'),
+    ('Yes, uh, I will. Uh.', 'Yes I will.'),
+    ('And uh. Okay.', 'And. Okay.'),
+])
+def test_drop_fillers(text, expected):
+    assert clean(text, drop_fillers) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('I I I think so.', 'I think so.'),
+    ('We should, we should go.', 'We should go.'),
+    ('the the the plan', 'the plan'),
+    ('we we need we we need to', 'we need to'),
+    ('That is fine.', 'That is fine.'),
+])
+def test_collapse_repeats(text, expected):
+    assert clean(text, collapse_repeats) == expected
+
+
+def transcript_of(turns, confidences=None):
+    items = []
+    clock = 0.0
+    for speaker, text in turns:
+        for word, punctuation in text_units(text):
+            items.append({'type': 'pronunciation', 'start_time': str(clock), 'end_time': str(clock + 0.3),
+                          'speaker_label': speaker,
+                          'alternatives': [{'confidence': str((confidences or {}).get(word, 0.99)),
+                                            'content': word}]})
+            if punctuation:
+                items.append({'type': 'punctuation', 'alternatives': [{'confidence': '0.0', 'content': punctuation}]})
+            clock += 0.4
+        clock += 0.5
+    data = json.dumps({'results': {'transcripts': [{'transcript': ''}], 'items': items}}).encode('utf-8')
+    return parse_transcript(io.BytesIO(data))
+
+
+def test_crosstalk_is_dropped_and_turns_merged():
+    transcript = transcript_of([
+        ('spk_0', 'So the plan is to ship.'),
+        ('spk_1', 'Mm-hmm.'),
+        ('spk_0', 'Um, on Friday. Can we?'),
+        ('spk_1', 'Yeah.'),
+        ('spk_0', 'Great.'),
+    ])
+    text, stats = compact_transcript(transcript)
+    # The answer to a question is kept
+    assert text == 'spk_0: So the plan is to ship. On Friday. Can we?\nspk_1: Yeah.\nspk_0: Great.'
+    assert stats.backchannels == 1 and stats.fillers == 1
+    assert stats.compacted_tokens < stats.original_tokens
+
+
+def test_assent_to_a_request_is_kept():
+    transcript = transcript_of([
+        ('spk_0', 'Can you own the budget? It is due Friday.'),
+        ('spk_1', 'Sure.'),
+        ('spk_0', 'Thanks. Please send the deck to finance too.'),
+        ('spk_1', 'Okay.'),
+        ('spk_0', 'Great. The numbers look right'),
+        ('spk_1', 'Right.'),
+        ('spk_0', 'to me.'),
+    ])
+    text, stats = compact_transcript(transcript)
+    assert text == ('spk_0: Can you own the budget? It is due Friday.\nspk_1: Sure.\n'
+                    'spk_0: Thanks. Please send the deck to finance too.\nspk_1: Okay.\n'
+                    'spk_0: Great. The numbers look right to me.')
+    assert stats.backchannels == 1
+
+
+def test_low_confidence_words_are_optional():
+    transcript = transcript_of([('spk_0', 'Send the report blah by Monday.')], confidences={'blah': 0.2})
+    assert 'blah' in compact_transcript(transcript)[0]
+    text, stats = compact_transcript(transcript, min_confidence=0.4)
+    assert text == 'spk_0: Send the report by Monday.'
+    assert stats.low_confidence == 1
+
+
+def test_plain_text_transcript():
+    data = json.dumps({'results': {'transcripts': [{'transcript': 'Um, hello hello team.'}]}}).encode('utf-8')
+    text, _ = compact_transcript(parse_transcript(io.BytesIO(data)))
+    assert text == 'Hello team.'
+
+
+def test_stats_round_trip():
+    stats = CompactionStats(100, 75, fillers=3)
+    assert CompactionStats.from_dict(stats.to_dict()).to_dict() == stats.to_dict()
+    assert stats.reduction == 0.25
+    assert '100 -> 75 tokens (25% less)' in str(stats)
+
+
+@pytest.mark.parametrize('meeting', load_corpus(), ids=lambda meeting: meeting['name'])
+def test_corpus_keeps_action_items_and_decisions(meeting):
+    text, stats = compact_transcript(load_transcript(meeting), min_confidence=0.4)
+    assert missing_keywords(text, meeting['action_items'] + meeting['decisions']) == []
+    assert stats.reduction >= 0.15
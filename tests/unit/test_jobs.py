@@ -0,0 +1,160 @@
+import threading
+
+import pytest
+
+from docker_app.utils import jobs
+from docker_app.utils.jobs import FAILED, QUEUED, SUCCEEDED, JobWorker, SqliteJobStore, get_job_store
+
+
+def test_submit_is_idempotent(tmp_path):
+    store = SqliteJobStore(str(tmp_path / 'jobs.db'))
+
+    first = store.submit('meeting', {'n': 1}, idempotency_key='key')
+    second = store.submit('meeting', {'n': 2}, idempotency_key='key')
+
+    assert first == second
+    assert store.get(first)['state'] == {'n': 1}
+    assert store.submit('meeting', {'n': 3}) != first
+
+
+def test_each_job_is_claimed_by_one_worker(tmp_path):
+    store = SqliteJobStore(str(tmp_path / 'jobs.db'))
+    job_ids = {store.submit('meeting', {'n': i}) for i in range(20)}
+    claimed = []
+
+    def claim_all(worker_id):
+        while True:
+            job = store.claim(worker_id)
+            if job is None:
+                return
+            claimed.append(job['id'])
+
+    threads = [threading.Thread(target=claim_all, args=(f'worker-{i}',)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(job_ids)
+
+
+def test_expired_lease_is_claimed_again(tmp_path, monkeypatch):
+    store = SqliteJobStore(str(tmp_path / 'jobs.db'))
+    now = [1000.0]
+    monkeypatch.setattr(jobs.time, 'time', lambda: now[0])
+    store.submit('meeting', {})
+    store.submit('other', {})
+
+    first = store.claim('crashed', lease_seconds=60)
+    second = store.claim('alive', lease_seconds=60)
+    assert store.claim('late') is None
+    now[0] += 61
+
+    assert store.claim('late')['id'] == first['id'] != second['id']
+    # The crashed worker lost its lease and cannot overwrite the job anymore
+    assert not store.complete(first['id'], 'crashed', {})
+
+
+def test_worker_retries_from_the_last_checkpoint(tmp_path):
+    store = get_job_store(f"sqlite://{tmp_path / 'jobs.db'}")
+    job_id = store.submit('meeting', {'calls': []}, max_attempts=3)
+    runs = []
+
+    def handler(state, checkpoint):
+        runs.append(dict(state, calls=list(state['calls'])))
+        if 'uploaded' not in state:
+            state['uploaded'] = True
+            checkpoint('upload')
+        if len(runs) < 2:
+            raise RuntimeError('Bedrock throttled')
+        state['review'] = 'notes'
+        return state
+
+    worker = JobWorker(store, {'meeting': handler}, retry_delay=0)
+    assert worker.run_once()
+    job = store.get(job_id)
+    assert (job['status'], job['stage'], job['error']) == (QUEUED, 'upload', 'Bedrock throttled')
+
+    assert worker.run_once()
+    job = store.get(job_id)
+    assert job['status'] == SUCCEEDED and job['attempts'] == 2
+    assert job['state'] == {'calls': [], 'uploaded': True, 'review': 'notes'}
+    assert runs[1]['uploaded']
+    assert not worker.run_once()
+
+
+def test_job_fails_after_its_attempts(tmp_path):
+    store = SqliteJobStore(str(tmp_path / 'jobs.db'))
+    job_id = store.submit('meeting', {}, max_attempts=2)
+
+    def handler(state, checkpoint):
+        raise RuntimeError('Transcription failed')
+
+    worker = JobWorker(store, {'meeting': handler}, retry_delay=0)
+    worker.run_once()
+    worker.run_once()
+
+    job = store.get(job_id)
+    assert job['status'] == FAILED and job['error'] == 'Transcription failed'
+    assert not worker.run_once()
+
+
+def test_failed_job_is_queued_again_when_submitted_again(tmp_path):
+    store = SqliteJobStore(str(tmp_path / 'jobs.db'))
+    job_id = store.submit('meeting', {'n': 1}, idempotency_key='key', max_attempts=1)
+    store.claim('worker')
+    store.fail(job_id, 'worker', 'throttled')
+    assert store.get(job_id)['status'] == FAILED
+
+    assert store.submit('meeting', {'n': 2}, idempotency_key='key', max_attempts=1) == job_id
+
+    job = store.get(job_id)
+    assert (job['status'], job['attempts'], job['state']) == (QUEUED, 0, {'n': 1})
+    assert store.claim('worker')['id'] == job_id
+
+
+def test_job_that_stops_its_worker_fails_after_its_attempts(tmp_path, monkeypatch):
+    store = SqliteJobStore(str(tmp_path / 'jobs.db'))
+    now = [1000.0]
+    monkeypatch.setattr(jobs.time, 'time', lambda: now[0])
+    job_id = store.submit('meeting', {}, max_attempts=2)
+
+    # Each worker is killed by the job and never fails it
+    for worker_id in ('worker-1', 'worker-2'):
+        assert store.claim(worker_id, lease_seconds=60)['id'] == job_id
+        now[0] += 61
+
+    assert store.claim('worker-3') is None
+    job = store.get(job_id)
+    assert (job['status'], job['attempts']) == (FAILED, 2)
+
+
+def test_worker_stops_a_job_whose_lease_was_lost(tmp_path):
+    store = SqliteJobStore(str(tmp_path / 'jobs.db'))
+    job_id = store.submit('meeting', {})
+    stages = []
+
+    def handler(state, checkpoint):
+        # Another worker takes the job over during the first stage
+        store._update(job_id, 'slow', worker='other')
+        for stage in ('upload', 'transcribe'):
+            stages.append(stage)
+            checkpoint(stage)
+        return state
+
+    worker = JobWorker(store, {'meeting': handler}, worker_id='slow')
+    assert worker.run_once()
+
+    assert stages == ['upload']
+    job = store.get(job_id)
+    assert (job['status'], job['stage'], job['error']) == (jobs.RUNNING, None, None)
+
+
+def test_job_stores_implement_every_method():
+    class PartialStore(jobs.JobStore):
+
+        def get(self, job_id):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialStore()
@@ -0,0 +1,92 @@
+import re
+import time
+
+import pytest
+
+from benchmarks.fakes import FakeStreamingTranscriber
+from docker_app.utils import live
+from docker_app.utils.live import LiveMeeting, RollingSummary, make_transcriber, register_transcriber
+from docker_app.utils.llm import LlmResponse
+
+SECOND = FakeStreamingTranscriber.BYTES_PER_SECOND
+
+
+class FakeLlm:
+
+    def __init__(self, failures=0):
+        self.prompts = []
+        self.failures = failures
+
+    def generate(self, prompt, max_tokens=10000):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('ThrottlingException')
+        self.prompts.append(prompt)
+        return LlmResponse(f"notes {len(self.prompts)}")
+
+
+def new_transcription(prompt):
+    return re.search(r'<new_transcription>\n(.*)\n</new_transcription>', prompt, re.S).group(1).splitlines()
+
+
+def test_updates_send_the_new_lines_with_the_previous_notes():
+    llm = FakeLlm()
+    summary = RollingSummary(llm, attendees_agenda='Budget review')
+    summary.add('spk_0: Hello team.')
+    summary.add('spk_1: Alice sends the budget.')
+    summary.update()
+    summary.add('spk_0: Agreed.')
+    summary.update()
+
+    assert summary.update() is None
+    assert [new_transcription(prompt) for prompt in llm.prompts] == [
+        ['spk_0: Hello team.', 'spk_1: Alice sends the budget.'], ['spk_0: Agreed.']]
+    assert '<notes_so_far>\nnotes 1\n</notes_so_far>' in llm.prompts[1]
+    assert 'Hello team' not in llm.prompts[1] and 'Budget review' in llm.prompts[1]
+    assert summary.notes == 'notes 2' and summary.transcription().count('\n') == 2
+
+
+def test_failed_update_is_retried_with_the_same_lines():
+    llm = FakeLlm(failures=1)
+    summary = RollingSummary(llm)
+    summary.add('spk_0: Hello team.')
+    with pytest.raises(RuntimeError):
+        summary.update()
+    summary.add('spk_0: Agreed.')
+    summary.update()
+    assert new_transcription(llm.prompts[0]) == ['spk_0: Hello team.', 'spk_0: Agreed.']
+
+
+def test_live_meeting_rolls_the_notes_and_ends_with_the_last_lines():
+    script = [(1.0, 'spk_0', 'Hello team.'), (2.0, 'spk_1', 'Alice sends the budget.'), (3.0, None, ' '),
+              (9.0, 'spk_0', 'Agreed.')]
+    transcriber = FakeStreamingTranscriber(script)
+    llm = FakeLlm()
+    updates = []
+    meeting = LiveMeeting(transcriber, RollingSummary(llm), interval=0.01, min_delta_chars=1,
+                          on_notes=updates.append)
+    meeting.start()
+    for _ in range(3):
+        meeting.send(bytes(SECOND))
+    # The rolling update picks up the first lines while the meeting goes on
+    deadline = time.time() + 5
+    while not updates and time.time() < deadline:
+        time.sleep(0.01)
+    assert updates and meeting.summary.pending_chars() == 0
+
+    notes = meeting.end()
+
+    assert transcriber.finished and meeting.audio_bytes == 3 * SECOND
+    # Every line is sent once, the last one by the final update
+    assert [line for prompt in llm.prompts for line in new_transcription(prompt)] == [
+        'spk_0: Hello team.', 'spk_1: Alice sends the budget.', 'spk_0: Agreed.']
+    assert new_transcription(llm.prompts[-1]) == ['spk_0: Agreed.']
+    assert notes == f'notes {len(llm.prompts)}'
+
+
+def test_transcribers_are_registered_by_name(monkeypatch):
+    monkeypatch.setattr(live, 'TRANSCRIBERS', dict(live.TRANSCRIBERS))
+    register_transcriber('fake', FakeStreamingTranscriber)
+    assert isinstance(make_transcriber('fake', script=[]), FakeStreamingTranscriber)
+    with pytest.raises(ValueError):
+        make_transcriber('unknown')
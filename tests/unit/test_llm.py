@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from docker_app.utils.cache import ResponseCache
+from docker_app.utils.llm import Llm
+
+
+def chunk(event):
+    return {'chunk': {'bytes': json.dumps(event).encode('utf-8')}}
+
+
+class FakeBedrockClient:
+
+    def __init__(self, events):
+        self.events = events
+        self.requests = []
+
+    def invoke_model_with_response_stream(self, modelId, body):
+        self.requests.append(json.loads(body))
+        return {'body': iter(self.events)}
+
+
+def test_generate_stream_assembles_text_and_timings():
+    events = [
+        chunk({'type': 'message_start', 'message': {'usage': {'input_tokens': 42}}}),
+        chunk({'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}}),
+        chunk({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': 'AGENDA\n'}}),
+        chunk({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': '    * Budget'}}),
+        chunk({'type': 'content_block_stop', 'index': 0}),
+        chunk({'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'}, 'usage': {'output_tokens': 7}}),
+        chunk({'type': 'message_stop'}),
+    ]
+    client = FakeBedrockClient(events)
+    partials = []
+
+    response = Llm(client=client).generate_stream('prompt', partials.append, max_tokens=100)
+
+    assert response.text == 'AGENDA\n    * Budget'
+    assert partials[0] == 'AGENDA\n' and partials[-1] == response.text
+    assert response.input_tokens == 42 and response.output_tokens == 7
+    assert 0 <= response.time_to_first_token <= response.total_time
+    assert client.requests[0]['max_tokens'] == 100
+
+
+def test_generate_stream_raises_on_stream_error():
+    client = FakeBedrockClient([{'throttlingException': {'message': 'Too many requests'}}])
+
+    with pytest.raises(RuntimeError, match='Too many requests'):
+        Llm(client=client).generate_stream('prompt', lambda text: None)
+
+
+def test_generate_stream_serves_repeated_prompt_from_cache():
+    events = [chunk({'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': 'notes'}})]
+    client = FakeBedrockClient(events)
+    llm = Llm(client=client, cache=ResponseCache())
+
+    first = llm.generate_stream('prompt', lambda text: None)
+    second = llm.generate_stream('prompt', lambda text: None)
+
+    assert len(client.requests) == 1
+    assert not first.cached and second.cached
+    assert second.text == 'notes'
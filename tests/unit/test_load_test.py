@@ -0,0 +1,47 @@
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from benchmarks.fakes import FakeBedrockClient, FakeS3Client, FakeTranscribeClient
+from benchmarks.load_test import build_parser, install_fakes, run_level, saturation_point
+from docker_app.utils.llm import Llm
+
+
+def test_fake_transcribe_completes_jobs_and_rejects_reused_names():
+    s3 = FakeS3Client()
+    transcribe = FakeTranscribeClient(s3, lambda name: name.encode('utf-8'), duration=0.05)
+    transcribe.start_transcription_job('job-1', OutputBucketName='bucket', OutputKey='job-1.json')
+    with pytest.raises(ClientError, match='ConflictException'):
+        transcribe.start_transcription_job('job-1', OutputBucketName='bucket', OutputKey='job-1.json')
+    assert transcribe.get_transcription_job('job-1')['TranscriptionJob']['TranscriptionJobStatus'] == 'IN_PROGRESS'
+    time.sleep(0.05)
+    job = transcribe.get_transcription_job('job-1')['TranscriptionJob']
+    assert job['TranscriptionJobStatus'] == 'COMPLETED' and s3.objects[('bucket', 'job-1.json')] == b'job-1'
+
+
+def test_fake_bedrock_streams_the_answer():
+    streamed = []
+    response = Llm(client=FakeBedrockClient('**AGENDA**\n* Budget', tokens_per_second=1000)).generate_stream(
+        'prompt', streamed.append)
+    assert response.text == streamed[-1] == '**AGENDA**\n* Budget'
+    assert response.output_tokens == 4
+
+
+def test_a_session_goes_through_the_whole_page():
+    args = build_parser().parse_args(['--think-seconds', '0', '--refresh-seconds', '0.2', '--ramp-seconds', '0',
+                                      '--transcribe-seconds', '0', '--tokens-per-second', '100000',
+                                      '--bedrock-latency', '0', '--quip-latency', '0', '--recording-kb', '64'])
+    args.fakes = install_fakes(args)
+    level = run_level(1, args)
+    assert level['errors'] == []
+    assert {step: summary['count'] > 0 for step, summary in level['steps'].items()} == dict.fromkeys(
+        ('load', 'submit', 'refresh', 'review', 'quip'), True)
+    # The review is one call, PARALLEL_SECTIONS being off by default
+    assert args.fakes['s3'].objects and args.fakes['bedrock-runtime'].requests == 1
+
+
+def test_saturation_point():
+    levels = [{'sessions': n, 'light': {'p95': p95}} for n, p95 in ((1, 0.05), (8, 0.2), (16, 0.9))]
+    assert saturation_point(levels, slo=0.5) == 16
+    assert saturation_point(levels, slo=1) is None
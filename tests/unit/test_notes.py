@@ -0,0 +1,69 @@
+import pytest
+
+from docker_app.utils.notes import (SECTIONS, MeetingNotes, NotesFormatError, parse_review, render_html,
+                                    render_markdown, render_review)
+
+REVIEW = """Here are the meeting notes:
+
+**DATE/TIME/LOCATION**
+    * Jun 28, 2024, 5:45 PM PT
+    * Chime
+
+**INVITEES**
+    * Alice
+    * Bob
+
+**AGENDA**
+    * Q3 budget
+        * Marketing spend
+        * Hiring plan
+    * Launch date
+
+**ACTION ITEMS**
+    * **Alice**: send the budget <draft> to finance
+
+**DECISIONS**
+
+**MEETING NOTES:**
+    - Launch moves to September
+    1. Budget approved
+"""
+
+
+def test_parse_review_builds_sections_with_nesting():
+    notes = parse_review(REVIEW)
+
+    assert notes.items('INVITEES') == [(0, 'Alice'), (0, 'Bob')]
+    assert notes.items('AGENDA') == [(0, 'Q3 budget'), (1, 'Marketing spend'), (1, 'Hiring plan'),
+                                     (0, 'Launch date')]
+    assert notes.items('DECISIONS') == []
+    assert notes.items('MEETING NOTES') == [(0, 'Launch moves to September'), (0, 'Budget approved')]
+
+
+def test_parse_review_rejects_free_text():
+    with pytest.raises(NotesFormatError):
+        parse_review('Please use professional language')
+
+
+def test_rendered_review_parses_back_to_the_same_notes():
+    notes = parse_review(REVIEW)
+
+    assert parse_review(render_review(notes)) == notes
+
+
+def test_render_html_escapes_and_nests_lists():
+    html = render_html(parse_review(REVIEW))
+
+    assert html.startswith('<html><body>') and html.endswith('</body></html>')
+    assert '<li><b>Alice</b>: send the budget &lt;draft&gt; to finance</li>' in html
+    assert '<li>Q3 budget</li>\n<ul>\n<li>Marketing spend</li>' in html
+    assert html.count('<ul>') == html.count('</ul>')
+    for name in SECTIONS:
+        assert f'<b>{name}</b>' in html
+
+
+def test_render_markdown():
+    markdown = render_markdown(MeetingNotes({'AGENDA': [(0, 'Budget'), (1, 'Hiring')]}))
+
+    assert '## Agenda\n\n- Budget\n  - Hiring' in markdown
+    assert '## Action Items' in markdown
@@ -0,0 +1,269 @@
+import json
+import threading
+import time
+import uuid
+
+from benchmarks.fakes import FakeS3Client, FakeTranscribeClient
+from docker_app.utils import transcription
+from docker_app.utils.llm import LlmResponse
+from docker_app.utils.pipeline import (MeetingChain, MeetingPipeline, format_report, list_local_recordings,
+                                       read_transcript, run_meeting_job, start_split_transcription)
+from docker_app.utils.summarize import ReviewState
+from docker_app.utils.transcription import TranscriptionJobTracker
+
+REVIEW = "DATE/TIME/LOCATION\n    * Monday\n\nINVITEES\n    * Alice\n\nAGENDA\n    * Budget\n"
+
+
+class FakeTracker:
+
+    def __init__(self, s3_client, bucket):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.jobs = []
+        self.forgotten = []
+        self.running = 0
+        self.peak_running = 0
+        self._lock = threading.Lock()
+
+    def start_job(self, job_name, output_key=None, **job_args):
+        self.jobs.append(job_args['Media']['MediaFileUri'])
+        self.output_key = output_key
+        transcript = {'results': {'transcripts': [{'transcript': 'Hello team.'}], 'items': [
+            {'type': 'pronunciation', 'start_time': '0.0', 'end_time': '0.5', 'speaker_label': 'spk_0',
+             'alternatives': [{'content': 'Hello', 'confidence': '0.99'}]}]}}
+        self.s3_client.put_object(Bucket=self.bucket, Key=output_key, Body=json.dumps(transcript))
+        return {'name': job_name}
+
+    def wait(self, job_name, timeout=None):
+        with self._lock:
+            self.running += 1
+            self.peak_running = max(self.peak_running, self.running)
+        time.sleep(0.02)
+        with self._lock:
+            self.running -= 1
+        return {'name': job_name, 'status': 'COMPLETED'}
+
+    def forget(self, output_key):
+        self.forgotten.append(output_key)
+
+
+class FakeLlm:
+
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, prompt, max_tokens=10000, temperature=0):
+        self.prompts.append(prompt)
+        return LlmResponse(REVIEW, None, 0.1)
+
+
+def make_recordings(tmp_path, count):
+    source = tmp_path / 'recordings'
+    source.mkdir()
+    for i in range(count):
+        (source / f'meeting-{i}.mp3').write_bytes(f'audio {i}'.encode('utf-8'))
+    (source / 'readme.txt').write_text('not a recording')
+    return list_local_recordings(str(source))
+
+
+def test_pipeline_summarizes_recordings_within_stage_limits(tmp_path):
+    s3_client = FakeS3Client()
+    tracker = FakeTracker(s3_client, 'bucket')
+    llm = FakeLlm()
+    prefix = f'test-{uuid.uuid4().hex}/'
+    recordings = make_recordings(tmp_path, 6)
+    pipeline = MeetingPipeline(s3_client, llm, tracker, 'bucket', prefix, str(tmp_path / 'notes'),
+                               upload_concurrency=2, transcribe_concurrency=3, summarize_concurrency=2)
+
+    results = pipeline.run(recordings)
+
+    assert len(recordings) == 6
+    assert all(result.error is None for result in results)
+    assert tracker.peak_running <= 3
+    assert len(llm.prompts) == 6 and 'spk_0: Hello' in llm.prompts[0]
+    notes = (tmp_path / 'notes' / 'meeting-0.md').read_text()
+    assert '## Invitees\n\n- Alice' in notes
+    assert pipeline.stats['transcribe'].summary()['count'] == 6
+    assert '6 of 6 recordings summarized' in format_report(results, pipeline.stats, 1.0)
+
+    # A second run reuses the transcripts recorded in the manifest
+    results = pipeline.run(recordings)
+    assert all(result.reused_transcript for result in results)
+    assert len(tracker.jobs) == 6
+
+
+def test_pipeline_compacts_transcripts(tmp_path):
+    s3_client = FakeS3Client()
+    llm = FakeLlm()
+    pipeline = MeetingPipeline(s3_client, llm, FakeTracker(s3_client, 'bucket'), 'bucket', f'test-{uuid.uuid4().hex}/',
+                               str(tmp_path / 'notes'), compaction_options={'min_confidence': 0.4})
+
+    results = pipeline.run(make_recordings(tmp_path, 1))
+
+    assert results[0].compaction is not None
+    assert 'spk_0: Hello' in llm.prompts[0]
+    assert 'Transcript tokens:' in format_report(results, pipeline.stats, 1.0)
+
+
+def test_pipeline_reports_failures_and_deletes_files(tmp_path):
+    s3_client = FakeS3Client()
+    tracker = FakeTracker(s3_client, 'bucket')
+    tracker.wait = lambda job_name, timeout=None: {'name': job_name, 'status': 'FAILED', 'failure_reason': 'bad'}
+    prefix = f'test-{uuid.uuid4().hex}/'
+    pipeline = MeetingPipeline(s3_client, FakeLlm(), tracker, 'bucket', prefix, str(tmp_path / 'notes'),
+                               delete_files=True)
+
+    results = pipeline.run(make_recordings(tmp_path, 2))
+
+    assert all('bad' in result.error for result in results)
+    assert pipeline.stats['transcribe'].failures == 2
+    assert not [key for bucket, key in s3_client.objects if key.startswith(prefix)]
+    assert sorted(tracker.forgotten) == sorted(result.transcript_key for result in results)
+    assert 'FAILED meeting-0.mp3' in format_report(results, pipeline.stats, 1.0)
+
+
+def test_meeting_job_resumes_after_a_failed_stage(tmp_path, monkeypatch):
+    s3_client = FakeS3Client()
+    tracker = FakeTracker(s3_client, 'bucket')
+    llm = FakeLlm()
+    quip_calls = []
+    monkeypatch.setattr('docker_app.utils.pipeline.write_to_quip',
+                        lambda token, name, content, location: quip_calls.append(content) or 'New meeting doc created')
+    prefix = f'test-{uuid.uuid4().hex}/'
+    pipeline = MeetingPipeline(s3_client, llm, tracker, 'bucket', prefix, None, delete_files=False)
+    spool_path = tmp_path / 'job.mp3'
+    spool_path.write_bytes(b'audio')
+    state = {'spool_path': str(spool_path), 'filename': 'weekly.mp3', 'user_prompt': 'Notes please',
+             'delete_files': True, 'quip': {'location': 'https://quip/folder/abc/'}}
+    stages = []
+
+    def fail_once(prompt, max_tokens=10000, temperature=0):
+        llm.generate = FakeLlm.generate.__get__(llm)
+        raise RuntimeError('throttled')
+    llm.generate = fail_once
+
+    try:
+        run_meeting_job(pipeline, state, stages.append)
+    except RuntimeError:
+        pass
+    assert stages == ['upload', 'transcribe', 'transcribe'] and 'review' not in state
+    assert not spool_path.exists()
+
+    run_meeting_job(pipeline, state, stages.append, quip_token='secret')
+
+    assert len(tracker.jobs) == 1
+    assert stages[3:] == ['summarize', 'quip']
+    assert state['quip_result'] == 'New meeting doc created' and 'secret' not in str(state)
+    assert '<b>INVITEES</b>' in quip_calls[0]
+    assert not [key for bucket, key in s3_client.objects if key.startswith(prefix + 'media/')]
+
+
+def test_segments_are_transcribed_in_parallel_and_stitched(monkeypatch):
+    monkeypatch.setattr(transcription, 'POLL_MIN_INTERVAL', 0.01)
+    s3_client = FakeS3Client()
+    prefix = f'test-{uuid.uuid4().hex}/'
+    # Two 60 second segments of a 110 second recording, one word per second
+    words = [f'word{i}' for i in range(110)]
+    segments = [(f'{prefix}media/abc.part00.flac', 0.0, 60.0), (f'{prefix}media/abc.part01.flac', 50.0, 60.0)]
+    for key, _, _ in segments:
+        s3_client.put_object(Bucket='bucket', Key=key, Body=b'audio')
+
+    def segment_transcript(job_name):
+        offset = 50 if client.jobs[job_name]['key'].endswith('part01.json') else 0
+        items = [{'type': 'pronunciation', 'start_time': str(i - offset), 'end_time': str(i - offset + 0.5),
+                  'speaker_label': 'spk_0', 'alternatives': [{'content': words[i], 'confidence': '0.99'}]}
+                 for i in range(offset, min(offset + 60, len(words)))]
+        return json.dumps({'results': {'transcripts': [{'transcript': ''}], 'items': items}})
+
+    client = FakeTranscribeClient(s3_client, segment_transcript, duration=0)
+    tracker = TranscriptionJobTracker(client=client)
+
+    job_name, job = start_split_transcription(tracker, s3_client, 'bucket', prefix, 'abc', segments,
+                                              f'{prefix}transcripts/abc.json')
+
+    assert len(job['parts']) == 2 and len(client.jobs) == 2
+    assert tracker.wait(job_name, timeout=5)['status'] == 'COMPLETED'
+    transcript = read_transcript(s3_client, 'bucket', f'{prefix}transcripts/abc.json')
+    assert transcript.words == words and transcript.starts[-1] == 109.0
+    # Only the stitched transcript is left
+    assert [key for _, key in s3_client.objects if key.startswith(prefix)] == [f'{prefix}transcripts/abc.json']
+
+
+def test_chain_drafts_while_transcribing_and_reviews_when_the_job_completes():
+    calls = []
+    release = threading.Event()
+
+    def summarize(transcription, on_text):
+        calls.append(transcription)
+        on_text('DATE/TIME')
+        if transcription:
+            release.wait(5)
+        return LlmResponse(REVIEW + transcription)
+
+    chain = MeetingChain(summarize)
+    chain.start_draft()
+    chain.join(5)
+    # The draft of the notes is ready before the transcript
+    assert chain.snapshot()['draft'].text == REVIEW and chain.snapshot()['stage'] == 'waiting'
+    # Nothing left to produce until a review is expected
+    assert not chain.snapshot()['running']
+    finished = []
+    callback = chain.on_transcribed(lambda: ('spk_0: Hello', None), lambda review: finished.append(review) or 'Written')
+    # Idle while Transcribe works, but still followed by the page
+    assert chain.snapshot()['running'] and not chain.snapshot()['busy']
+    callback({'status': 'COMPLETED'})
+    time.sleep(0.05)
+    assert chain.snapshot()['stage'] == 'summarize' and chain.snapshot()['review_text'] == 'DATE/TIME'
+    release.set()
+    chain.join(5)
+
+    state = chain.snapshot()
+    assert calls == ['', 'spk_0: Hello'] and finished == [REVIEW + 'spk_0: Hello']
+    assert state['stage'] == 'done' and state['result'] == 'Written' and not state['busy'] and not state['running']
+
+
+def test_chain_keeps_the_draft_as_the_review_of_notes_only():
+    calls = []
+    chain = MeetingChain(lambda transcription, on_text: calls.append(transcription) or LlmResponse(REVIEW))
+    chain.start_draft()
+    chain.start_review(lambda: ('', None))
+    chain.join(5)
+    assert calls == [''] and chain.snapshot()['review'].text == REVIEW
+
+
+def test_chain_reviews_after_the_draft_that_shares_its_review_state():
+    state = ReviewState()
+    drafting = threading.Event()
+    release = threading.Event()
+
+    def summarize(transcription, on_text):
+        if not transcription:
+            drafting.set()
+            release.wait(5)
+        review = REVIEW + transcription
+        state.record(transcription, 'Create notes', '', 'Notes', review)
+        return LlmResponse(review)
+
+    chain = MeetingChain(summarize)
+    chain.start_draft()
+    drafting.wait(5)
+    chain.start_review(lambda: ('spk_0: Hello', None))
+    time.sleep(0.05)
+    # Still drafting: the review waits instead of recording at the same time
+    assert chain.snapshot()['review'] is None
+    release.set()
+    chain.join(5)
+
+    assert chain.snapshot()['review'].text == state.review == REVIEW + 'spk_0: Hello'
+    assert state.reusable_sections('spk_0: Hello', 'Create notes', '', 'Notes')
+
+
+def test_chain_reports_a_failed_transcription():
+    chain = MeetingChain(lambda transcription, on_text: LlmResponse(REVIEW))
+    chain.start_draft()
+    chain.on_transcribed(lambda: ('', None))({'status': 'FAILED', 'failure_reason': 'Unsupported media'})
+    chain.join(5)
+    state = chain.snapshot()
+    assert state['stage'] == 'failed' and 'Unsupported media' in state['error'] and state['review'] is None
+    assert not state['running']
+    assert state['draft'].text == REVIEW
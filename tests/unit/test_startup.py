@@ -0,0 +1,41 @@
+import os
+
+from benchmarks.startup import (APP_PATH, lazy_imports, measure, own_modules, package_seconds, parse_import_times,
+                                script_imports, total_seconds)
+
+OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     _json
+import time:       300 |        420 |   json.decoder
+import time:       200 |        620 | json
+import time:      1000 |       1000 | utils.notes
+"""
+
+
+def test_import_times_are_parsed_by_package():
+    entries = parse_import_times(OUTPUT)
+
+    assert entries[1] == ('json.decoder', 0.0003, 0.00042, 1)
+    assert total_seconds(entries) == 0.00162
+    assert [package for package, _ in package_seconds(entries)] == ['utils', 'json', '_json']
+
+
+def test_script_imports_leave_out_the_imports_of_functions(tmp_path):
+    script = tmp_path / 'page.py'
+    script.write_text('import os, json\nfrom utils.notes import SECTIONS\nimport os\n\n\n'
+                      'def render():\n    import numpy\n')
+    (tmp_path / 'utils').mkdir()
+
+    modules = script_imports(str(script))
+
+    assert modules == ['os', 'json', 'utils.notes']
+    assert own_modules(modules, str(tmp_path)) == ['utils.notes']
+
+
+def test_modules_of_the_page_import_no_lazy_package():
+    folder = os.path.dirname(APP_PATH)
+    modules = own_modules(script_imports(APP_PATH), folder)
+
+    entries = measure(modules, folder)
+
+    assert 'utils.pipeline' in modules and 'config_file' in modules
+    assert lazy_imports(entries) == []
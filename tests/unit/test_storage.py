@@ -0,0 +1,62 @@
+import hashlib
+import io
+
+from botocore.exceptions import ClientError
+
+from docker_app.utils.storage import TranscriptManifest, hash_fileobj, media_key, object_exists
+
+
+class FakeS3Client:
+
+    def __init__(self):
+        self.objects = {}
+        self.gets = 0
+
+    def _missing(self, operation):
+        return ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, operation)
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key):
+        self.gets += 1
+        if (Bucket, Key) not in self.objects:
+            raise self._missing('GetObject')
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self._missing('HeadObject')
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+def test_hash_fileobj_streams_and_rewinds():
+    data = b'audio' * 1000
+    fileobj = io.BytesIO(data)
+
+    digest = hash_fileobj(fileobj, chunk_bytes=7)
+
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert fileobj.tell() == 0
+    # Keys depend on the content only, not on the uploaded file name
+    assert media_key('ml_test/', digest, 'Weekly Sync.MP4') == media_key('ml_test/', digest, 'renamed.mp4')
+
+
+def test_manifest_round_trip_and_cache():
+    s3_client = FakeS3Client()
+    manifest = TranscriptManifest(s3_client, 'bucket', 'ml_test/')
+
+    assert manifest.get('abc') is None
+    manifest.record_when_completed('abc', 'ml_test/media/abc.mp3', 'ml_test/transcripts/abc.json')({'status': 'COMPLETED'})
+
+    reader = TranscriptManifest(s3_client, 'bucket', 'ml_test/')
+    assert reader.get('abc')['transcript_key'] == 'ml_test/transcripts/abc.json'
+    reader.get('abc')
+    assert s3_client.gets == 2
+    assert object_exists(s3_client, 'bucket', 'ml_test/manifest/abc.json')
+
+    reader.delete('abc')
+    assert not object_exists(s3_client, 'bucket', 'ml_test/manifest/abc.json')
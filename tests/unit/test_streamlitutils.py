@@ -0,0 +1,32 @@
+import pytest
+
+from docker_app.utils.streamlitutils import conform_to_regex, get_quip_client, render_rerun_timer
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('weekly-sync_2024.mp4', 'weekly-sync_2024.mp4'),
+    ("ml_test/media/(final)!*'.m4a", "ml_test/media/(final)!*'.m4a"),
+    ('Réunion d’équipe — 28 juin.mp3', 'Runiondquipe28juin.mp3'),
+    ('a b' * 600, 'ab' * 512),
+    ('', ''),
+])
+def test_conform_to_regex(name, expected):
+    assert conform_to_regex(name) == expected
+
+
+def test_quip_clients_live_with_the_session_that_holds_them():
+    clients = {}
+
+    first = get_quip_client('token-1', clients)
+
+    assert get_quip_client('token-1', clients) is first
+    # A new token replaces the client of the old one, nothing else keeps it
+    assert get_quip_client('token-2', clients) is not first and clients['token'] == 'token-2'
+    assert get_quip_client('token-2') is not clients['client']
+
+
+def test_rerun_timer_clicks_its_button_once_per_run():
+    html = render_rerun_timer('Refresh </script>', 1.5, nonce=1)
+
+    assert 'Refresh <\\/script>' in html and html.count('</script>') == 1
+    assert '}, 1500);' in html and html != render_rerun_timer('Refresh </script>', 1.5, nonce=2)
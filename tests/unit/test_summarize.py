@@ -0,0 +1,217 @@
+import threading
+import time
+
+from docker_app.utils.llm import LlmResponse
+from docker_app.utils.notes import SECTIONS, parse_review
+from docker_app.utils.pipeline import generate_review
+from docker_app.utils.summarize import (MAX_WORKERS, SECTION_MAX_TOKENS, ReviewState, affected_sections,
+                                        chunk_transcript, generate_sections, summarize_transcript)
+
+
+class FakeLlm:
+
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, prompt, max_tokens=10000):
+        self.prompts.append(prompt)
+        return LlmResponse(f"summary {len(self.prompts)}")
+
+
+def test_chunk_transcript_splits_on_sentences_with_overlap():
+    transcript = " ".join(f"Sentence number {i} is here." for i in range(200))
+
+    chunks = chunk_transcript(transcript, chunk_chars=500, overlap_chars=60)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert all(chunk.endswith(".") for chunk in chunks)
+    # The last sentence of a chunk is repeated in the overlap of the next one
+    assert chunks[0].split(". ")[-1] in chunks[1][:60]
+
+
+def test_summarize_transcript_maps_chunks_then_reduces():
+    transcript = "\n".join(f"spk_{i % 2}: point {i}." for i in range(100))
+    llm = FakeLlm()
+
+    response = summarize_transcript(llm, transcript, "Create notes", "Agenda", "Notes", chunk_chars=200)
+
+    chunk_count = len(chunk_transcript(transcript, 200))
+    assert len(llm.prompts) == chunk_count + 1
+    assert f"<part{chunk_count}>" in llm.prompts[-1]
+    assert response.text == f"summary {chunk_count + 1}"
+
+
+class SectionLlm:
+    """
+    Answers each section prompt after a delay, repeating the heading of the
+    action items as models sometimes do.
+    """
+
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.budgets = {}
+        self.calls = []
+        self.running = 0
+        self.peak_running = 0
+        self._lock = threading.Lock()
+
+    def _answer(self, prompt, max_tokens):
+        if 'only these sections' in prompt:
+            # The sections regenerated together, answered under their headings
+            names = [name for name in SECTIONS if f'**{name}**:' in prompt]
+            with self._lock:
+                self.calls.append(tuple(names))
+            return None, '\n'.join(f'**{name}**\n* {name.lower()} item' for name in names)
+        name = next(name for name in SECTIONS if f'only the {name} section' in prompt)
+        with self._lock:
+            self.budgets[name] = max_tokens
+            self.calls.append(name)
+            self.running += 1
+            self.peak_running = max(self.peak_running, self.running)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+        text = f'* {name.lower()} item'
+        return name, ('**ACTION ITEMS**\n' + text if name == 'ACTION ITEMS' else text)
+
+    def generate(self, prompt, max_tokens=10000):
+        _, text = self._answer(prompt, max_tokens)
+        return LlmResponse(text, 0.1, self.delay, 1000, 10)
+
+    def generate_stream(self, prompt, on_text, max_tokens=10000):
+        name, text = self._answer(prompt, max_tokens)
+        on_text(text)
+        return LlmResponse(text, 0.1, self.delay, 1000, 10)
+
+
+def test_sections_are_generated_concurrently_within_their_budgets():
+    llm = SectionLlm()
+    start = time.perf_counter()
+
+    response = generate_sections(llm, 'spk_0: Let us ship on Friday.', 'Create notes', 'Agenda', 'Notes')
+
+    # Two rounds of MAX_WORKERS sections, not six sections one after the other
+    assert time.perf_counter() - start < 4 * llm.delay
+    assert llm.peak_running == MAX_WORKERS
+    assert llm.budgets == SECTION_MAX_TOKENS
+    notes = parse_review(response.text)
+    assert [notes.items(name) for name in SECTIONS] == [[(0, f'{name.lower()} item')] for name in SECTIONS]
+    assert (response.input_tokens, response.output_tokens) == (6000, 60)
+
+
+def test_sections_share_the_bedrock_concurrency_limit():
+    llm = SectionLlm(delay=0.05)
+
+    generate_sections(llm, 'transcript', 'Create notes', '', '', max_workers=2)
+
+    assert llm.peak_running == 2
+    assert sorted(llm.calls) == sorted(SECTIONS)
+
+
+def test_streamed_sections_are_assembled_on_the_calling_thread():
+    llm = SectionLlm(delay=0.05)
+    calls = []
+
+    response = generate_sections(llm, 'transcript', 'Create notes', '', '',
+                                 on_text=lambda text: calls.append((threading.current_thread(), text)))
+
+    assert {thread for thread, _ in calls} == {threading.current_thread()}
+    assert calls[-1][1] == response.text
+
+
+def test_long_transcripts_reduce_into_concurrent_sections():
+    transcript = "\n".join(f"spk_{i % 2}: point {i}." for i in range(100))
+    llm = SectionLlm(delay=0)
+    llm.generate = lambda prompt, max_tokens=10000: (
+        LlmResponse('chunk summary') if 'part of a longer meeting' in prompt
+        else SectionLlm.generate(llm, prompt, max_tokens))
+
+    response = summarize_transcript(llm, transcript, "Create notes", "", "", chunk_chars=200, parallel_sections=True)
+
+    assert set(llm.budgets) == set(SECTIONS)
+    assert parse_review(response.text).items('DECISIONS') == [(0, 'decisions item')]
+
+
+def test_edits_affect_the_sections_they_name():
+    inputs = {'user_prompt': 'Create notes', 'attendees_agenda': 'Alice, Bob', 'meeting_notes': 'Budget'}
+
+    assert affected_sections(inputs, dict(inputs)) == ()
+    assert affected_sections(inputs, dict(inputs, meeting_notes='Budget\nWe agreed to ship the beta')) == (
+        'DECISIONS', 'MEETING NOTES')
+    # The prompt instructs every section, even when it names one
+    assert affected_sections(inputs, dict(inputs, user_prompt='Create notes\nNumber the action items')) == SECTIONS
+    # An edit of the notes that names no section changes those its input feeds
+    assert affected_sections(inputs, dict(inputs, meeting_notes='Budget\nBob sends the deck')) == (
+        'ACTION ITEMS', 'DECISIONS', 'MEETING NOTES')
+
+
+def test_review_regenerates_only_the_edited_sections():
+    llm = SectionLlm(delay=0)
+    state = ReviewState()
+    generate_review(llm, 'spk_0: Let us ship.', 'Create notes', '', 'Budget', parallel_sections=True, state=state)
+    llm.calls.clear()
+
+    response = generate_review(llm, 'spk_0: Let us ship.', 'Create notes', '', 'Budget\nDecided to ship',
+                               parallel_sections=True, state=state)
+
+    assert sorted(llm.calls) == ['DECISIONS', 'MEETING NOTES']
+    notes = parse_review(response.text)
+    assert [notes.items(name) for name in SECTIONS] == [[(0, f'{name.lower()} item')] for name in SECTIONS]
+    assert response.input_tokens == 2000
+    # Nothing to regenerate when nothing changed, and everything once the transcription did
+    llm.calls.clear()
+    assert generate_review(llm, 'spk_0: Let us ship.', 'Create notes', '', 'Budget\nDecided to ship',
+                           state=state).cached and llm.calls == []
+    generate_review(llm, 'spk_0: Let us ship now.', 'Create notes', '', 'Budget\nDecided to ship',
+                    parallel_sections=True, state=state)
+    assert sorted(llm.calls) == sorted(SECTIONS)
+
+
+def test_prompt_edits_regenerate_every_section():
+    llm = SectionLlm(delay=0)
+    state = ReviewState()
+    generate_review(llm, 'spk_0: Let us ship.', 'Create notes', 'Alice, Bob', '', parallel_sections=True, state=state)
+    llm.calls.clear()
+
+    generate_review(llm, 'spk_0: Let us ship.', 'Create notes in a formal tone', 'Alice, Bob', '',
+                    parallel_sections=True, state=state)
+
+    assert sorted(llm.calls) == sorted(SECTIONS)
+
+
+def test_edited_sections_are_regenerated_in_one_call():
+    llm = SectionLlm(delay=0)
+    state = ReviewState()
+    generate_review(llm, 'spk_0: Let us ship.', 'Create notes', '', 'Budget', parallel_sections=True, state=state)
+    llm.calls.clear()
+
+    streamed = []
+    response = generate_review(llm, 'spk_0: Let us ship.', 'Create notes', '', 'Budget\nDecided to ship',
+                               on_text=streamed.append, state=state)
+
+    # The transcription is sent once for both sections
+    assert llm.calls == [('DECISIONS', 'MEETING NOTES')] and response.input_tokens == 1000
+    notes = parse_review(response.text)
+    assert [notes.items(name) for name in SECTIONS] == [[(0, f'{name.lower()} item')] for name in SECTIONS]
+    assert streamed[-1] == response.text == state.review
+
+
+def test_chunk_summaries_are_not_sent_again_after_an_edit():
+    transcript = "\n".join(f"spk_{i % 2}: point {i}." for i in range(1500))
+    llm = SectionLlm(delay=0)
+    chunk_prompts = []
+    llm.generate = lambda prompt, max_tokens=10000: (
+        chunk_prompts.append(prompt) or LlmResponse('chunk summary') if 'part of a longer meeting' in prompt
+        else SectionLlm.generate(llm, prompt, max_tokens))
+    state = ReviewState()
+    generate_review(llm, transcript, 'Create notes', '', '', map_reduce_threshold=200, parallel_sections=True,
+                    state=state)
+    chunk_count = len(chunk_prompts)
+    llm.calls.clear()
+
+    generate_review(llm, transcript, 'Create notes', '', 'Alice owns the follow-up', map_reduce_threshold=200,
+                    parallel_sections=True, state=state)
+
+    assert len(chunk_prompts) == chunk_count > 1
+    assert sorted(llm.calls) == ['ACTION ITEMS', 'MEETING NOTES']
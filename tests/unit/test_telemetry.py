@@ -0,0 +1,110 @@
+import contextvars
+import io
+import json
+import logging
+import threading
+import urllib.request
+
+import pytest
+
+from docker_app.utils.llm import Llm
+from docker_app.utils.telemetry import JsonFormatter, Telemetry, get_telemetry, record_retries, start_metrics_server
+
+
+def test_nested_spans_share_the_trace():
+    telemetry = Telemetry()
+
+    def model_call():
+        with telemetry.span('bedrock.generate'):
+            pass
+
+    with telemetry.span('meeting', trace_id='t1', recording='a.mp3') as parent:
+        with telemetry.span('stage.upload', bytes=1000) as child:
+            child.add('retries')
+            child.add('retries')
+        # A copied context carries the current span to another thread
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(model_call,))
+        thread.start()
+        thread.join()
+
+    spans = {span['name']: span for span in telemetry.trace('t1')}
+    assert spans['stage.upload']['parent_id'] == parent.span_id and spans['stage.upload']['retries'] == 2
+    assert spans['bedrock.generate']['parent_id'] == parent.span_id
+    assert spans['meeting']['recording'] == 'a.mp3' and spans['meeting']['parent_id'] is None
+
+
+def test_errors_are_recorded_and_raised():
+    telemetry = Telemetry()
+    with pytest.raises(ValueError):
+        with telemetry.span('stage.quip', trace_id='t2'):
+            raise ValueError('bad location')
+    assert telemetry.trace('t2')[0]['error'] == 'ValueError: bad location'
+    assert telemetry.stage_summary()[0]['errors'] == 1
+
+
+def test_prometheus_text():
+    telemetry = Telemetry(buckets=(1, 10))
+    telemetry.record_span('bedrock.generate', 0, 0.5, input_tokens=100, output_tokens=20)
+    telemetry.record_span('bedrock.generate', 0, 5, input_tokens=50, retries=1)
+    text = telemetry.prometheus()
+    assert 'meeting_summarizer_stage_duration_seconds_bucket{stage="bedrock.generate",le="1"} 1' in text
+    assert 'meeting_summarizer_stage_duration_seconds_bucket{stage="bedrock.generate",le="+Inf"} 2' in text
+    assert 'meeting_summarizer_stage_duration_seconds_count{stage="bedrock.generate"} 2' in text
+    assert 'meeting_summarizer_input_tokens_total{stage="bedrock.generate"} 150' in text
+    assert 'meeting_summarizer_retries_total{stage="bedrock.generate"} 1' in text
+    assert telemetry.stage_summary()[0]['p50_under_seconds'] == 1
+
+
+def test_recent_traces_are_bounded():
+    telemetry = Telemetry(recent_traces=2)
+    for trace_id in ('a', 'b', 'c'):
+        telemetry.record_span('stage.upload', 0, 1, trace_id)
+    assert telemetry.trace('a') == [] and len(telemetry.trace('c')) == 1
+
+
+def test_retries_from_botocore_responses():
+    telemetry = Telemetry()
+    with telemetry.span('s3.read_transcript', trace_id='t3'):
+        record_retries({'ResponseMetadata': {'RetryAttempts': 2}})
+        record_retries(None)
+    assert telemetry.trace('t3')[0]['retries'] == 2
+
+
+def test_json_log_lines():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    span_logger = logging.getLogger('meeting_summarizer.spans')
+    span_logger.addHandler(handler)
+    span_logger.setLevel(logging.INFO)
+    try:
+        Telemetry().record_span('stage.upload', 0, 2.5, 't4', bytes=10)
+    finally:
+        span_logger.removeHandler(handler)
+    line = json.loads(stream.getvalue())
+    assert line['level'] == 'INFO' and line['span']['name'] == 'stage.upload'
+    assert line['span']['trace_id'] == 't4' and line['span']['bytes'] == 10
+
+
+def test_model_calls_record_their_tokens():
+    class Body:
+        def read(self):
+            return json.dumps({'content': [{'text': 'notes'}], 'usage': {'input_tokens': 12, 'output_tokens': 3}})
+
+    class Client:
+        def invoke_model(self, modelId, body):
+            return {'body': Body(), 'ResponseMetadata': {'RetryAttempts': 1}}
+
+    with get_telemetry().span('stage.summarize', trace_id='t5'):
+        Llm(client=Client()).generate('prompt')
+    generate = [span for span in get_telemetry().trace('t5') if span['name'] == 'bedrock.generate'][0]
+    assert (generate['input_tokens'], generate['output_tokens'], generate['retries']) == (12, 3, 1)
+
+
+def test_metrics_endpoint():
+    server = start_metrics_server(0, host='127.0.0.1')
+    get_telemetry().record_span('stage.upload', 0, 1)
+    port = server.server_address[1]
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=5) as response:
+        assert response.headers['Content-Type'].startswith('text/plain')
+        assert b'meeting_summarizer_stage_duration_seconds_count{stage="stage.upload"}' in response.read()
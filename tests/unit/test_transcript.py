@@ -0,0 +1,133 @@
+import io
+import json
+
+import pytest
+
+from docker_app.utils.transcript import (Transcript, TranscriptFormatError, dump_transcript, parse_transcript,
+                                         stitch_transcripts)
+
+
+def word(start, end, content, confidence='0.99', speaker=None):
+    item = {'start_time': start, 'end_time': end, 'type': 'pronunciation',
+            'alternatives': [{'confidence': confidence, 'content': content}]}
+    if speaker:
+        item['speaker_label'] = speaker
+    return item
+
+
+def punctuation(content):
+    return {'type': 'punctuation', 'alternatives': [{'confidence': '0.0', 'content': content}]}
+
+
+def transcribe_output(items, **results):
+    return json.dumps({
+        'jobName': 'transcribe-media-1',
+        'accountId': '123456789012',
+        'results': dict(transcripts=[{'transcript': 'Hello team. Let\'s start "now"'}], items=items, **results),
+        'status': 'COMPLETED',
+    }).encode('utf-8')
+
+
+ITEMS = [
+    word('0.0', '0.4', 'Hello', speaker='spk_0'),
+    word('0.5', '0.9', 'team', speaker='spk_0'),
+    punctuation('.'),
+    word('3.0', '3.3', "Let's", confidence='0.9', speaker='spk_1'),
+    word('3.4', '3.8', 'start "now"', confidence='0.7', speaker='spk_1'),
+]
+
+
+@pytest.mark.parametrize('chunk_bytes', [1, 7, 64 * 1024])
+def test_parse_streams_items_into_segments(chunk_bytes):
+    # Skipped values may hold escaped quotes and brackets
+    body = transcribe_output(ITEMS, audio_segments=[{'id': 0, 'transcript': 'a \\" b } ]', 'items': [0, 1]}])
+
+    transcript = parse_transcript(io.BytesIO(body), chunk_bytes=chunk_bytes)
+
+    assert len(transcript) == 5
+    assert transcript.text() == 'Hello team. Let\'s start "now"'
+    assert transcript.speaker_names == ['spk_0', 'spk_1']
+    assert transcript.confidences[4] == pytest.approx(0.7)
+    segments = transcript.segments()
+    assert [(segment.speaker, segment.start, segment.end) for segment in segments] == [('spk_0', 0.0, 0.9),
+                                                                                     ('spk_1', 3.0, 3.8)]
+    assert transcript.format_segments() == 'spk_0: Hello team.\nspk_1: Let\'s start "now"'
+
+
+def test_parse_maps_speakers_from_speaker_label_segments():
+    items = [{key: value for key, value in item.items() if key != 'speaker_label'} for item in ITEMS]
+    speaker_labels = {'speakers': 2, 'segments': [
+        {'speaker_label': 'spk_0', 'items': [{'start_time': '0.0', 'speaker_label': 'spk_0'},
+                                             {'start_time': '0.5', 'speaker_label': 'spk_0'}]},
+        {'speaker_label': 'spk_1', 'items': [{'start_time': '3.0', 'speaker_label': 'spk_1'},
+                                             {'start_time': '3.4', 'speaker_label': 'spk_1'}]},
+    ]}
+
+    transcript = parse_transcript(io.BytesIO(transcribe_output(items, speaker_labels=speaker_labels)))
+
+    assert [segment.speaker for segment in transcript.segments()] == ['spk_0', 'spk_1']
+
+
+def test_parse_without_items_keeps_full_text_and_rejects_garbage():
+    transcript = parse_transcript(io.BytesIO(transcribe_output([])))
+    assert transcript.format_segments() == 'Hello team. Let\'s start "now"'
+
+    with pytest.raises(TranscriptFormatError):
+        parse_transcript(io.BytesIO(b'{"jobName": "x"}'))
+
+
+def segment_of(words, start, end, labels):
+    """
+    Transcript of the words said between start and end, with times relative
+    to start and speakers labelled as a separate job would.
+    """
+    transcript = Transcript()
+    for at, text, speaker in words:
+        if start <= at < end:
+            transcript.append(text, at - start, at - start + 0.4, 0.99, transcript.speaker_id(labels[speaker]))
+    return transcript
+
+
+def test_overlapping_segments_are_stitched_once_with_consistent_speakers():
+    # Alice and Bob talk over 100 seconds, Carol joins after the first segment
+    words = [(i * 0.5, f'w{i}', 'alice' if i // 20 % 2 == 0 else 'bob') for i in range(200)]
+    words += [(100 + i * 0.5, f'c{i}', 'carol') for i in range(10)]
+    parts = [
+        (segment_of(words, 0, 55, {'alice': 'spk_0', 'bob': 'spk_1'}), 0, 55),
+        # Labels are per job: the second one heard Bob first
+        (segment_of(words, 45, 110, {'bob': 'spk_0', 'alice': 'spk_1', 'carol': 'spk_2'}), 45, 65),
+    ]
+
+    transcript = stitch_transcripts(parts)
+
+    assert transcript.words == [text for _, text, _ in words]
+    assert list(transcript.starts) == [at for at, _, _ in words]
+    labels = {}
+    for i, (_, _, speaker) in enumerate(words):
+        labels.setdefault(speaker, set()).add(transcript.speaker_names[transcript.speakers[i]])
+    assert labels['alice'] == {'spk_0'} and labels['bob'] == {'spk_1'}
+    assert labels['carol'] == {'spk_2'}
+
+
+def test_segments_without_shared_words_are_cut_in_the_middle_of_the_overlap():
+    words = [(float(i), f'w{i}', 'alice') for i in range(20)]
+    first = segment_of(words, 0, 12, {'alice': 'spk_0'})
+    # The second job misheard the overlap
+    second = segment_of(words, 8, 20, {'alice': 'spk_0'})
+    for i in range(4):
+        second.words[i] = f'x{i}'
+
+    transcript = stitch_transcripts([(first, 0, 12), (second, 8, 12)])
+
+    assert transcript.words == [f'w{i}' for i in range(10)] + ['x2', 'x3'] + [f'w{i}' for i in range(12, 20)]
+    # Alice was not heard saying the same words twice, she may be someone else
+    assert transcript.speaker_names == ['spk_0', 'spk_1']
+
+
+def test_dumped_transcripts_parse_back():
+    transcript = parse_transcript(io.BytesIO(transcribe_output(ITEMS)))
+    parsed = parse_transcript(io.BytesIO(dump_transcript(transcript, 'job').encode('utf-8')))
+    assert parsed.words == transcript.words
+    assert list(parsed.starts) == list(transcript.starts)
+    assert parsed.speaker_names == transcript.speaker_names and list(parsed.speakers) == list(transcript.speakers)
+    assert parsed.format_segments() == transcript.format_segments()
@@ -0,0 +1,281 @@
+import json
+import time
+import types
+
+import pytest
+from botocore.exceptions import ClientError
+
+from benchmarks.fakes import FakeS3Client
+from docker_app.utils import transcription
+from docker_app.utils.pipeline import delete_recording
+from docker_app.utils.transcription import SqsEventSource, TranscriptionJobTracker
+
+
+class FakeTranscribeClient:
+
+    def __init__(self, polls_until_done=2):
+        self.polls_until_done = polls_until_done
+        self.started = []
+        self.deleted = []
+        self.gets = 0
+
+    def start_transcription_job(self, TranscriptionJobName, **kwargs):
+        self.started.append(TranscriptionJobName)
+
+    def get_transcription_job(self, TranscriptionJobName):
+        self.gets += 1
+        status = 'COMPLETED' if self.gets >= self.polls_until_done else 'IN_PROGRESS'
+        return {'TranscriptionJob': {
+            'TranscriptionJobName': TranscriptionJobName,
+            'TranscriptionJobStatus': status,
+            'Transcript': {'TranscriptFileUri': f's3://bucket/{TranscriptionJobName}.json'},
+        }}
+
+    def delete_transcription_job(self, TranscriptionJobName):
+        self.deleted.append(TranscriptionJobName)
+
+
+def test_tracker_polls_job_to_completion(monkeypatch):
+    monkeypatch.setattr(transcription, 'POLL_MIN_INTERVAL', 0.01)
+    client = FakeTranscribeClient()
+    tracker = TranscriptionJobTracker(client=client)
+
+    tracker.start_job('transcribe-media-1', output_key='key.json')
+    job = tracker.wait('transcribe-media-1', timeout=5)
+
+    assert job['status'] == 'COMPLETED'
+    assert job['transcript_uri'] == 's3://bucket/transcribe-media-1.json'
+    assert client.deleted == ['transcribe-media-1']
+
+
+def test_tracker_coalesces_sessions_and_accepts_events():
+    client = FakeTranscribeClient(polls_until_done=100)
+    tracker = TranscriptionJobTracker(client=client)
+    results = []
+
+    tracker.track('transcribe-media-2')
+    tracker.track('transcribe-media-2')
+    tracker.add_callback('transcribe-media-2', results.append)
+    tracker.notify('transcribe-media-2', 'FAILED', failure_reason='Unsupported media')
+
+    assert len(tracker._jobs) == 1
+    assert tracker.get('transcribe-media-2')['status'] == 'FAILED'
+    assert results[0]['failure_reason'] == 'Unsupported media'
+
+
+def test_job_names_derive_from_content_and_settings():
+    args = {'LanguageCode': 'en-US', 'Settings': {'MaxSpeakerLabels': 10, 'ShowSpeakerLabels': True}}
+    name = transcription.transcription_job_name('ab' * 32, args)
+    assert name == transcription.transcription_job_name('ab' * 32, dict(reversed(list(args.items()))))
+    assert name.startswith('transcribe-media-' + 'ab' * 16)
+    assert name != transcription.transcription_job_name('ab' * 32, dict(args, LanguageCode='fr-FR'))
+    assert name != transcription.transcription_job_name('cd' * 32, args)
+
+
+def test_requesters_of_the_same_recording_share_one_job(monkeypatch):
+    monkeypatch.setattr(transcription, 'POLL_MIN_INTERVAL', 0.01)
+    client = FakeTranscribeClient()
+    tracker = TranscriptionJobTracker(client=client)
+    results = []
+
+    first = tracker.start_job('transcribe-media-3', output_key='key.json')
+    second = tracker.start_job('transcribe-media-3', output_key='key.json')
+    tracker.add_callback('transcribe-media-3', results.append)
+
+    assert client.started == ['transcribe-media-3']
+    assert (first['requesters'], second['requesters']) == (1, 2)
+    assert tracker.wait('transcribe-media-3', timeout=5)['status'] == 'COMPLETED'
+    assert results[0]['transcript_uri'] == 's3://bucket/transcribe-media-3.json'
+
+
+def test_jobs_started_elsewhere_are_followed(monkeypatch):
+    class ConflictingClient(FakeTranscribeClient):
+
+        def start_transcription_job(self, TranscriptionJobName, **kwargs):
+            super().start_transcription_job(TranscriptionJobName, **kwargs)
+            raise ClientError({'Error': {'Code': 'ConflictException', 'Message': 'exists'}}, 'StartTranscriptionJob')
+
+    monkeypatch.setattr(transcription, 'POLL_MIN_INTERVAL', 10)
+    client = ConflictingClient(polls_until_done=1)
+    tracker = TranscriptionJobTracker(client=client)
+
+    tracker.start_job('transcribe-media-4', output_key='key.json')
+    # Polled right away rather than after POLL_MIN_INTERVAL
+    assert tracker.wait('transcribe-media-4', timeout=5)['status'] == 'COMPLETED'
+
+
+def test_jobs_that_failed_elsewhere_are_started_again(monkeypatch):
+    class FailedElsewhereClient(FakeTranscribeClient):
+
+        def __init__(self):
+            super().__init__(polls_until_done=1)
+            self.failed = {'transcribe-media-6'}
+
+        def start_transcription_job(self, TranscriptionJobName, **kwargs):
+            if TranscriptionJobName in self.failed:
+                raise ClientError({'Error': {'Code': 'ConflictException', 'Message': 'exists'}},
+                                  'StartTranscriptionJob')
+            super().start_transcription_job(TranscriptionJobName, **kwargs)
+
+        def get_transcription_job(self, TranscriptionJobName):
+            if TranscriptionJobName in self.failed:
+                return {'TranscriptionJob': {'TranscriptionJobName': TranscriptionJobName,
+                                             'TranscriptionJobStatus': 'FAILED', 'FailureReason': 'Throttled'}}
+            return super().get_transcription_job(TranscriptionJobName)
+
+        def delete_transcription_job(self, TranscriptionJobName):
+            super().delete_transcription_job(TranscriptionJobName)
+            self.failed.discard(TranscriptionJobName)
+
+    monkeypatch.setattr(transcription, 'POLL_MIN_INTERVAL', 0.01)
+    client = FailedElsewhereClient()
+    tracker = TranscriptionJobTracker(client=client)
+
+    tracker.start_job('transcribe-media-6', output_key='key.json')
+
+    assert client.started == ['transcribe-media-6']
+    assert tracker.wait('transcribe-media-6', timeout=5)['status'] == 'COMPLETED'
+    assert client.deleted == ['transcribe-media-6'] * 2
+
+
+def test_failed_starts_are_reported_and_retried():
+    class FailingOnceClient(FakeTranscribeClient):
+
+        def start_transcription_job(self, TranscriptionJobName, **kwargs):
+            super().start_transcription_job(TranscriptionJobName, **kwargs)
+            if len(self.started) == 1:
+                raise ClientError({'Error': {'Code': 'LimitExceededException', 'Message': 'busy'}},
+                                  'StartTranscriptionJob')
+
+    client = FailingOnceClient(polls_until_done=100)
+    tracker = TranscriptionJobTracker(client=client)
+
+    with pytest.raises(ClientError):
+        tracker.start_job('transcribe-media-5', output_key='key.json')
+    assert tracker.get('transcribe-media-5')['status'] == 'FAILED' and client.deleted == []
+    assert tracker.start_job('transcribe-media-5', output_key='key.json')['status'] == 'IN_PROGRESS'
+    assert client.started == ['transcribe-media-5'] * 2
+
+
+def test_split_jobs_complete_once_their_parts_are_merged(monkeypatch):
+    monkeypatch.setattr(transcription, 'POLL_MIN_INTERVAL', 0.01)
+    client = FakeTranscribeClient()
+    tracker = TranscriptionJobTracker(client=client)
+    merged = []
+
+    def merge(snapshots):
+        merged.append([snapshot['name'] for snapshot in snapshots])
+        return 's3://bucket/merged.json'
+
+    parts = [(f'transcribe-media-6-{i}', f'part{i}.json', {}) for i in range(3)]
+    job = tracker.start_split_job('transcribe-media-6', parts, merge, output_key='merged.json')
+
+    assert job['parts'] == ['transcribe-media-6-0', 'transcribe-media-6-1', 'transcribe-media-6-2']
+    assert sorted(client.started) == job['parts']
+    job = tracker.wait('transcribe-media-6', timeout=5)
+    assert job['status'] == 'COMPLETED' and job['transcript_uri'] == 's3://bucket/merged.json'
+    assert merged == [job['parts']]
+    # Attaching again does not start anything
+    assert tracker.start_split_job('transcribe-media-6', parts, merge)['requesters'] == 2
+    assert len(client.started) == 3
+
+
+def test_split_jobs_fail_with_their_first_failed_part(monkeypatch):
+    class OnePartFailsClient(FakeTranscribeClient):
+
+        def get_transcription_job(self, TranscriptionJobName):
+            response = super().get_transcription_job(TranscriptionJobName)
+            if TranscriptionJobName.endswith('-1'):
+                response['TranscriptionJob'].update(TranscriptionJobStatus='FAILED', FailureReason='Bad audio')
+            return response
+
+    monkeypatch.setattr(transcription, 'POLL_MIN_INTERVAL', 0.01)
+    tracker = TranscriptionJobTracker(client=OnePartFailsClient(polls_until_done=100))
+    parts = [(f'transcribe-media-7-{i}', f'part{i}.json', {}) for i in range(2)]
+
+    tracker.start_split_job('transcribe-media-7', parts, lambda snapshots: pytest.fail('merged a failed job'))
+
+    job = tracker.wait('transcribe-media-7', timeout=5)
+    assert job['status'] == 'FAILED'
+    assert job['failure_reason'] == 'Segment transcribe-media-7-1 failed: Bad audio'
+
+
+def test_jobs_unknown_to_transcribe_fail_instead_of_polling_forever(monkeypatch):
+    monkeypatch.setattr(transcription, 'POLL_MIN_INTERVAL', 0.01)
+
+    class DeletedJobClient(FakeTranscribeClient):
+
+        def get_transcription_job(self, TranscriptionJobName):
+            self.gets += 1
+            raise ClientError({'Error': {'Code': 'BadRequestException', 'Message': 'Not found'}},
+                              'GetTranscriptionJob')
+
+    tracker = TranscriptionJobTracker(client=DeletedJobClient())
+    tracker.track('transcribe-media-gone', output_key='gone.json')
+
+    job = tracker.wait('transcribe-media-gone', timeout=5)
+
+    assert job['status'] == 'FAILED' and 'not found' in job['failure_reason']
+
+
+def test_recordings_submitted_again_after_deletion_are_transcribed_again(monkeypatch):
+    monkeypatch.setattr(transcription, 'POLL_MIN_INTERVAL', 0.01)
+    client = FakeTranscribeClient(polls_until_done=1)
+    tracker = TranscriptionJobTracker(client=client)
+    s3_client = FakeS3Client()
+    tracker.start_job('transcribe-media-7', output_key='meetings/transcript.json')
+    assert tracker.wait('transcribe-media-7', timeout=5)['status'] == 'COMPLETED'
+
+    delete_recording(s3_client, 'bucket', 'meetings', transcript_key='meetings/transcript.json', tracker=tracker)
+    job = tracker.start_job('transcribe-media-7', output_key='meetings/transcript.json')
+
+    # A new job writes the deleted transcript again, instead of attaching to the finished one
+    assert client.started == ['transcribe-media-7', 'transcribe-media-7']
+    assert job['status'] == 'IN_PROGRESS'
+    assert tracker.wait('transcribe-media-7', timeout=5)['status'] == 'COMPLETED'
+
+
+class FakeSqsClient:
+
+    def __init__(self, bodies):
+        self.messages = [{'MessageId': str(i), 'Body': body, 'ReceiptHandle': str(i)} for i, body in enumerate(bodies)]
+        self.deleted = []
+
+    def receive_message(self, QueueUrl, **kwargs):
+        messages, self.messages = self.messages, []
+        if not messages:
+            time.sleep(0.01)
+        return {'Messages': messages}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        if ReceiptHandle == '0':
+            raise ClientError({'Error': {'Code': 'ReceiptHandleIsInvalid', 'Message': 'expired'}}, 'DeleteMessage')
+        self.deleted.append(ReceiptHandle)
+
+
+def test_event_source_outlives_bad_messages_and_failed_deletions():
+    tracker = TranscriptionJobTracker(client=FakeTranscribeClient(polls_until_done=100))
+    tracker.track('transcribe-media-8')
+    event = json.dumps({'detail': {'TranscriptionJobName': 'transcribe-media-8', 'TranscriptionJobStatus': 'FAILED',
+                                   'FailureReason': 'Unsupported media'}})
+    sqs = FakeSqsClient(['{"detail": {}}', '[1, 2]', 'not json', event])
+
+    SqsEventSource(tracker, 'queue', client=sqs).start()
+
+    assert tracker.wait('transcribe-media-8', timeout=5)['failure_reason'] == 'Unsupported media'
+    assert sqs.deleted == ['1', '2', '3']
+
+
+def test_events_feed_the_tracker_whichever_call_comes_first(monkeypatch):
+    started = []
+    monkeypatch.setattr(transcription, '_tracker', None)
+    monkeypatch.setattr(transcription, '_event_queue_urls', set())
+    monkeypatch.setattr(transcription, 'SqsEventSource',
+                        lambda tracker, queue_url, region_name: types.SimpleNamespace(
+                            start=lambda: started.append((tracker, queue_url))))
+
+    tracker = transcription.get_tracker()
+    assert transcription.get_tracker(events_queue_url='queue') is tracker
+    transcription.get_tracker(events_queue_url='queue')
+
+    assert started == [(tracker, 'queue')]
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from benchmarks.fakes import MB, FakeS3Client, SyntheticFile
+from docker_app.utils.upload import MultipartUploader, UploadError
+
+
+def test_upload_bounds_buffered_bytes_and_reports_progress():
+    client = FakeS3Client(store_data=False)
+    uploader = MultipartUploader(client, part_size=5 * MB, max_concurrency=4, max_buffered_bytes=12 * MB)
+    progress = []
+
+    uploader.upload(SyntheticFile(33 * MB), 'bucket', 'key', 33 * MB, on_progress=lambda done, total: progress.append(done))
+
+    assert client.objects[('bucket', 'key')] == 33 * MB
+    assert uploader.peak_buffered_bytes <= 12 * MB
+    assert progress[-1] == 33 * MB
+
+
+def test_failed_upload_resumes_from_completed_parts(monkeypatch):
+    monkeypatch.setattr('docker_app.utils.upload.RETRY_BACKOFF_SECONDS', 0)
+    client = FakeS3Client(store_data=False, failure_rate=0.5, failing_operations={'UploadPart'}, seed=1)
+    uploader = MultipartUploader(client, part_size=5 * MB, max_concurrency=2, retries=0)
+
+    with pytest.raises(UploadError):
+        uploader.upload(SyntheticFile(50 * MB), 'bucket', 'key', 50 * MB)
+    completed = len(next(iter(client.uploads.values()))['Parts'])
+
+    client.failure_rate = 0
+    requests = client.requests
+    progress = []
+    uploader.upload(SyntheticFile(50 * MB), 'bucket', 'key', 50 * MB, on_progress=lambda *args: progress.append(args))
+
+    assert client.objects[('bucket', 'key')] == 50 * MB
+    # Only the missing parts are sent again, plus list and complete calls
+    assert client.requests - requests == 10 - completed + 3
+    # and only they count in the progress
+    assert progress[-1] == ((10 - completed) * 5 * MB,) * 2
+    assert all(done <= total for done, total in progress)
+
+
+def test_concurrent_uploads_of_a_key_do_not_share_an_upload():
+    client = FakeS3Client(latency=0.05, store_data=False)
+    errors = []
+
+    def upload():
+        try:
+            MultipartUploader(client, part_size=5 * MB).upload(SyntheticFile(20 * MB), 'bucket', 'key', 20 * MB)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=upload) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+        # The second upload starts once the first one created its multipart upload
+        time.sleep(0.07)
+    for thread in threads:
+        thread.join()
+
+    assert errors == [] and client.objects[('bucket', 'key')] == 20 * MB